@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+pydbclib 性能基准测试
+基准测试套件: python -m benchmarks --help，用例定义在 benchmarks/suite.py
+单项对比测试: python -m benchmarks.bench_compiler
+"""
+import timeit
+
+
+def measure(func, repeat=5, number=1):
+    """返回多轮执行中最短的单次耗时(秒)"""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def report(title, rows):
+    """按列对齐打印测试结果"""
+    print(title)
+    widths = [max(len(str(r[i])) for r in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+    print()
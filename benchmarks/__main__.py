@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+pydbclib 基准测试套件
+
+python -m benchmarks                                 # 运行全部用例
+python -m benchmarks --cases bulk,read --rows 1000,100000 --widths 4,16
+python -m benchmarks --output result.json            # 结果写入json文件
+python -m benchmarks --save-baseline baseline.json   # 保存为基线
+python -m benchmarks --baseline baseline.json        # 与基线对比，耗时或内存超出阈值时返回码为1
+python -m benchmarks --list                          # 列出所有用例
+"""
+import argparse
+import datetime
+import json
+import platform
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+import pydbclib
+from benchmarks import report
+from benchmarks.suite import cases, drivers, available, connect_driver
+
+
+def int_list(text):
+    return [int(i) for i in text.split(",")]
+
+
+def run_case(name, driver, rows, width, repeat):
+    func, uses_db, _ = cases[name]
+    db = connect_driver(driver) if uses_db else None
+    try:
+        setup, run = func(db, rows, width)
+        seconds = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        if db is not None:
+            db.close()
+    best = min(seconds)
+    return {
+        "case": name, "driver": driver if uses_db else None, "rows": rows, "width": width,
+        "seconds": best, "rows_per_sec": rows / best if best else None,
+        "us_per_row": best / rows * 1e6, "peak_bytes": peak,
+    }
+
+
+def result_key(result):
+    return f"{result['case']}/{result['driver'] or '-'}/{result['rows']}/{result['width']}"
+
+
+def compare(results, baseline, threshold):
+    """与基线对比耗时及内存峰值，返回超出阈值的结果"""
+    base = {result_key(r): r for r in baseline["results"]}
+    table = [("benchmark", "seconds", "baseline", "ratio", "peak(KB)", "baseline", "ratio", "")]
+    regressions = []
+    for r in results:
+        b = base.get(result_key(r))
+        if b is None:
+            table.append((result_key(r), f"{r['seconds']:.4f}", "-", "-", r["peak_bytes"] // 1024, "-", "-", "new"))
+            continue
+        time_ratio = r["seconds"] / b["seconds"] if b["seconds"] else 1.0
+        memory_ratio = r["peak_bytes"] / b["peak_bytes"] if b["peak_bytes"] else 1.0
+        regressed = time_ratio > 1 + threshold or memory_ratio > 1 + threshold
+        if regressed:
+            regressions.append(r)
+        table.append((
+            result_key(r), f"{r['seconds']:.4f}", f"{b['seconds']:.4f}", f"{time_ratio:.2f}",
+            r["peak_bytes"] // 1024, b["peak_bytes"] // 1024, f"{memory_ratio:.2f}", "REGRESSION" if regressed else ""
+        ))
+    report(f"compare with baseline (threshold {threshold:.0%})", table)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="pydbclib benchmark suite")
+    parser.add_argument("--cases", default=",".join(cases), help="逗号分隔的用例名称")
+    parser.add_argument("--drivers", default=",".join(drivers), help="逗号分隔的驱动名称")
+    parser.add_argument("--rows", type=int_list, default=[10000], help="逗号分隔的行数")
+    parser.add_argument("--widths", type=int_list, default=[4, 16], help="逗号分隔的字段数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例计时的轮数，取最短耗时")
+    parser.add_argument("--output", help="结果写入的json文件")
+    parser.add_argument("--baseline", help="对比的基线json文件")
+    parser.add_argument("--save-baseline", help="把结果保存为基线json文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为性能退化的比例，默认0.2")
+    parser.add_argument("--list", action="store_true", help="列出所有用例")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, (func, uses_db, requires) in cases.items():
+            print(f"{name:16} {func.__doc__}{'' if available(name) else f' (需要安装{requires})'}")
+        return 0
+
+    results = []
+    for name in args.cases.split(","):
+        if name not in cases:
+            parser.error(f"未知的用例: {name}")
+        if not available(name):
+            print(f"skip {name}: {cases[name][2]} is not installed", file=sys.stderr)
+            continue
+        for driver in (args.drivers.split(",") if cases[name][1] else [None]):
+            for width in args.widths:
+                for rows in args.rows:
+                    results.append(run_case(name, driver, rows, width, args.repeat))
+
+    report("pydbclib benchmarks", [("benchmark", "seconds", "rows/s", "us/row", "peak(KB)")] + [
+        (result_key(r), f"{r['seconds']:.4f}", f"{r['rows_per_sec']:,.0f}", f"{r['us_per_row']:.2f}",
+         r["peak_bytes"] // 1024) for r in results
+    ])
+    output = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "pydbclib": pydbclib.__version__,
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(output, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+批量写入: executemany vs 多行VALUES, sqlite3 及 SQLAlchemy+sqlite
+"""
+import time
+
+from benchmarks import report
+from pydbclib import connect
+
+
+def load(db, width, rows, strategy):
+    columns = [f"c{i}" for i in range(width)]
+    db.execute(f"create table foo ({','.join(c + ' integer' for c in columns)})")
+    sql = f"insert into foo ({','.join(columns)}) values ({','.join(':' + c for c in columns)})"
+    data = [{c: i for c in columns} for i in range(rows)]
+    start = time.perf_counter()
+    r = db.bulk(sql, data, strategy=strategy)
+    elapsed = time.perf_counter() - start
+    assert r == rows
+    db.execute("drop table foo")
+    return elapsed
+
+
+def main(row_counts=(10000, 100000), widths=(4, 16)):
+    rows = [("driver", "rows", "width", "executemany(rows/s)", "multi_values(rows/s)", "speedup")]
+    for name, args, kwargs in [("sqlite3", (":memory:",), {"driver": "sqlite3"}),
+                               ("sqlalchemy", ("sqlite:///:memory:",), {})]:
+        db = connect(*args, **kwargs)
+        for width in widths:
+            for count in row_counts:
+                slow = load(db, width, count, "executemany")
+                fast = load(db, width, count, "multi_values")
+                rows.append((name, count, width, f"{count / slow:,.0f}", f"{count / fast:,.0f}", f"{slow / fast:.2f}x"))
+        db.close()
+    report("bulk insert strategies", rows)
+
+
+if __name__ == "__main__":
+    main()
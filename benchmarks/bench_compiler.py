@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+占位符解析: 单遍扫描 vs sqlparse, 按语句大小对比
+"""
+from benchmarks import measure, report
+from pydbclib.sql import tokenize_placeholders, sqlparse_placeholders
+
+
+def make_sql(size):
+    values = ",".join(f":p{i}" for i in range(size))
+    return f"select * from foo where b = 'x:y' and a in ({values}) -- :c"
+
+
+def main(sizes=(10, 100, 1000, 10000)):
+    rows = [("placeholders", "sql bytes", "tokenizer(ms)", "sqlparse(ms)", "speedup")]
+    for size in sizes:
+        sql = make_sql(size)
+        fast = measure(lambda: tokenize_placeholders(sql, "?"))
+        try:
+            assert tokenize_placeholders(sql, "?") == sqlparse_placeholders(sql, "?")
+            slow = measure(lambda: sqlparse_placeholders(sql, "?"), repeat=1)
+        except Exception as e:
+            # 新版本sqlparse对超长语句直接报错
+            rows.append((size, len(sql), f"{fast * 1000:.3f}", type(e).__name__, "-"))
+        else:
+            rows.append((size, len(sql), f"{fast * 1000:.3f}", f"{slow * 1000:.3f}", f"{slow / fast:.0f}x"))
+    report("placeholder parsing", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+executemany参数转换: 逐行生成器 vs 预先构建的itemgetter
+"""
+from benchmarks import measure, report
+from pydbclib.sql import QmarkCompiler, compiled_cache
+
+
+def legacy_process(sql, parameters):
+    """优化前的逐行转换方式"""
+    sql, keys, _, _, _ = QmarkCompiler(sql, parameters).compile()
+    return sql, [tuple(parameter[k] for k in keys) for parameter in parameters]
+
+
+def main(row_counts=(1000, 100000), widths=(4, 16)):
+    rows = [("rows", "width", "legacy(ms)", "itemgetter(ms)", "sequence(ms)", "speedup")]
+    for width in widths:
+        columns = [f"c{i}" for i in range(width)]
+        sql = f"insert into foo ({','.join(columns)}) values ({','.join(':' + c for c in columns)})"
+        for count in row_counts:
+            dicts = [{c: i for c in columns} for i in range(count)]
+            tuples = [tuple(range(width))] * count
+            compiled_cache.clear()
+            assert legacy_process(sql, dicts) == QmarkCompiler(sql, dicts).process()
+            legacy = measure(lambda: legacy_process(sql, dicts))
+            fast = measure(lambda: QmarkCompiler(sql, dicts).process())
+            seq = measure(lambda: QmarkCompiler(sql, tuples).process())
+            rows.append((
+                count, width, f"{legacy * 1000:.2f}", f"{fast * 1000:.2f}",
+                f"{seq * 1000:.3f}", f"{legacy / fast:.1f}x"
+            ))
+    report("executemany parameter conversion", rows)
+
+
+if __name__ == "__main__":
+    main()
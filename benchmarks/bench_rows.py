@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+结果记录对象: 字典 vs 共享字段索引的Row, 对比每行内存和构建速度
+"""
+import time
+import tracemalloc
+
+from benchmarks import report
+from pydbclib.utils import batches_to_records
+
+
+def build(batches, columns, compact):
+    start = time.perf_counter()
+    tracemalloc.start()
+    try:
+        rows = list(batches_to_records(batches, columns, compact))
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return rows, memory, time.perf_counter() - start
+
+
+def main(count=100000, widths=(4, 16)):
+    rows = [("rows", "width", "dict(B/row)", "Row(B/row)", "dict(rows/s)", "Row(rows/s)")]
+    for width in widths:
+        columns = [f"c{i}" for i in range(width)]
+        data = [tuple(range(i, i + width)) for i in range(count)]
+        batches = [data[i:i + 10000] for i in range(0, count, 10000)]
+        _, dict_mem, dict_time = build(batches, columns, False)
+        _, row_mem, row_time = build(batches, columns, True)
+        rows.append((
+            count, width, dict_mem // count, row_mem // count,
+            f"{count / dict_time:,.0f}", f"{count / row_time:,.0f}"
+        ))
+    report("records as dict vs Row (values tuples are shared with the cursor)", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+按键批量更新/删除: 逐行 Table.update/delete vs Table.bulk_update/bulk_delete, sqlite3 及 SQLAlchemy+sqlite
+"""
+import time
+
+from benchmarks import report
+from pydbclib import connect
+
+
+def setup(db, rows):
+    db.execute("create table foo (id integer primary key, a integer, b varchar(20))")
+    db.bulk("insert into foo (id,a,b) values (:id,:a,:b)", ({"id": i, "a": i, "b": str(i)} for i in range(rows)))
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def update_loop(db, table, rows):
+    for i in range(rows):
+        table.update({"id": i}, {"a": -i, "b": "x"})
+    db.commit()
+
+
+def delete_loop(db, table, rows):
+    for i in range(rows):
+        table.delete({"id": i})
+    db.commit()
+
+
+def run(db, rows):
+    table = db.get_table("foo")
+    updates = [{"id": i, "a": -i, "b": "x"} for i in range(rows)]
+    results = {}
+    for name, func in [
+        ("update loop", lambda: update_loop(db, table, rows)),
+        ("bulk_update executemany", lambda: table.bulk_update(updates, key=["id"], strategy="executemany")),
+        ("bulk_update case", lambda: table.bulk_update(updates, key=["id"], strategy="case")),
+        ("delete loop", lambda: delete_loop(db, table, rows)),
+        ("bulk_delete in", lambda: table.bulk_delete(range(rows).__iter__(), key="id")),
+    ]:
+        setup(db, rows)
+        results[name] = timed(func)
+        db.execute("drop table foo")
+    return results
+
+
+def main(row_counts=(1000, 20000)):
+    rows = [("driver", "rows", "method", "rows/s", "speedup")]
+    for name, args, kwargs in [("sqlite3", (":memory:",), {"driver": "sqlite3"}),
+                               ("sqlalchemy", ("sqlite:///:memory:",), {})]:
+        db = connect(*args, **kwargs)
+        for count in row_counts:
+            results = run(db, count)
+            for method, elapsed in results.items():
+                baseline = results["update loop" if "update" in method else "delete loop"]
+                rows.append((name, count, method, f"{count / elapsed:,.0f}", f"{baseline / elapsed:.2f}x"))
+        db.close()
+    report("bulk update/delete by key", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试用例，由 python -m benchmarks 运行
+每个用例完成准备工作后返回 (setup, run)，runner 每轮先调用setup再对run计时，
+另外单独运行一轮用tracemalloc统计run的内存峰值
+"""
+import importlib.util
+import os
+import tempfile
+
+from pydbclib import connect
+from pydbclib.sql import QmarkCompiler, compiled_cache
+
+# 驱动名称: connect参数
+drivers = {
+    "sqlite3": ((":memory:",), {"driver": "sqlite3"}),
+    "sqlalchemy": (("sqlite:///:memory:",), {}),
+}
+
+# 用例名称: (用例函数, 是否需要数据库连接, 依赖的可选包)
+cases = {}
+
+
+def case(name, uses_db=True, requires=None):
+    def decorator(func):
+        cases[name] = (func, uses_db, requires)
+        return func
+    return decorator
+
+
+def available(name):
+    requires = cases[name][2]
+    return requires is None or importlib.util.find_spec(requires) is not None
+
+
+def connect_driver(name):
+    args, kwargs = drivers[name]
+    return connect(*args, **kwargs)
+
+
+def make_records(rows, width):
+    return [{f"c{j}": i if j % 2 == 0 else f"value-{i}-{j}" for j in range(width)} for i in range(rows)]
+
+
+def create_table(db, width):
+    db.execute("drop table if exists bench")
+    db.execute(f"create table bench ({','.join(f'c{j} ' + ('integer' if j % 2 == 0 else 'varchar(30)') for j in range(width))})")
+    db.commit()
+
+
+def fill_table(db, rows, width):
+    create_table(db, width)
+    db.get_table("bench").bulk(make_records(rows, width))
+
+
+@case("bulk")
+def bench_bulk(db, rows, width):
+    """Table.bulk 批量写入，按数据库类型自动选择写入方式"""
+    data = make_records(rows, width)
+    return lambda: create_table(db, width), lambda: db.get_table("bench").bulk(data)
+
+
+@case("insert")
+def bench_insert(db, rows, width):
+    """Table.insert 多条记录，executemany方式"""
+    data = make_records(rows, width)
+
+    def run():
+        db.get_table("bench").insert(data)
+        db.commit()
+    return lambda: create_table(db, width), run
+
+
+@case("read")
+def bench_read(db, rows, width):
+    """Database.read 流式读取全部记录"""
+    fill_table(db, rows, width)
+
+    def run():
+        for _ in db.read("select * from bench", batch_size=1000, stream=True):
+            pass
+    return None, run
+
+
+@case("read_all")
+def bench_read_all(db, rows, width):
+    """Database.read 一次读取全部记录到列表"""
+    fill_table(db, rows, width)
+    return None, lambda: db.read("select * from bench").get_all()
+
+
+@case("to_df", requires="pandas")
+def bench_to_df(db, rows, width):
+    """Records.to_df 转换DataFrame"""
+    fill_table(db, rows, width)
+    return None, lambda: db.read("select * from bench").to_df()
+
+
+@case("to_numpy", requires="numpy")
+def bench_to_numpy(db, rows, width):
+    """Records.to_numpy 按列写入numpy数组"""
+    fill_table(db, rows, width)
+    return None, lambda: db.read("select * from bench").to_numpy()
+
+
+def fill_numeric_table(db, rows, width):
+    db.execute("drop table if exists bench")
+    db.execute(f"create table bench ({','.join(f'c{j} ' + ('integer' if j % 2 == 0 else 'real') for j in range(width))})")
+    db.commit()
+    db.get_table("bench").bulk([{f"c{j}": i if j % 2 == 0 else i * 0.5 for j in range(width)} for i in range(rows)])
+
+
+@case("to_df_numeric", requires="pandas")
+def bench_to_df_numeric(db, rows, width):
+    """Records.to_df 全部为数值字段"""
+    fill_numeric_table(db, rows, width)
+    return None, lambda: db.read("select * from bench").to_df()
+
+
+@case("to_numpy_numeric", requires="numpy")
+def bench_to_numpy_numeric(db, rows, width):
+    """Records.to_numpy 全部为数值字段"""
+    fill_numeric_table(db, rows, width)
+    return None, lambda: db.read("select * from bench").to_numpy()
+
+
+def export_csv(db, rows, width, **kwargs):
+    fill_table(db, rows, width)
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+
+    def run():
+        try:
+            db.read("select * from bench").to_csv(path, **kwargs)
+        finally:
+            os.remove(path)
+    return None, run
+
+
+@case("to_csv")
+def bench_to_csv(db, rows, width):
+    """Records.to_csv 使用csv模块导出"""
+    return export_csv(db, rows, width)
+
+
+@case("to_csv_pandas", requires="pandas")
+def bench_to_csv_pandas(db, rows, width):
+    """Records.to_csv 每批次转换DataFrame后导出"""
+    return export_csv(db, rows, width, engine="pandas")
+
+
+@case("compile", uses_db=False)
+def bench_compile(db, rows, width):
+    """占位符编译，每行为一条不同的语句(不命中缓存)"""
+    columns = [f"c{j}" for j in range(width)]
+    statements = [
+        f"insert into t{i} ({','.join(columns)}) values ({','.join(':' + c for c in columns)})" for i in range(rows)
+    ]
+    param = {c: 1 for c in columns}
+
+    def run():
+        for sql in statements:
+            QmarkCompiler(sql, param).process_one()
+    return compiled_cache.clear, run
+
+
+@case("compile_cached", uses_db=False)
+def bench_compile_cached(db, rows, width):
+    """占位符编译，同一条语句重复执行(命中缓存)"""
+    columns = [f"c{j}" for j in range(width)]
+    sql = f"select * from t where {' and '.join(f'{c}=:{c}' for c in columns)}"
+    param = {c: 1 for c in columns}
+
+    def run():
+        for _ in range(rows):
+            QmarkCompiler(sql, param).process_one()
+    return None, run
@@ -10,6 +10,11 @@ __version__ = '2.2.3'
 
 
 def connect(*args, **kwargs):
+    """
+    创建数据库连接，其他参数传给驱动
+    :param metadata_ttl: 表结构缓存有效期(秒)，默认一直有效(执行DDL时自动失效)，0表示不缓存
+    """
+    metadata_ttl = kwargs.pop("metadata_ttl", None)
     driver = kwargs.get("driver", "sqlalchemy")
     kwargs.update(driver=driver)
     if isinstance(driver, str):
@@ -18,4 +23,4 @@ def connect(*args, **kwargs):
         driver_class = CommonDriver
     else:
         driver_class = SQLAlchemyDriver
-    return Database(driver_class(*args, **kwargs))
+    return Database(driver_class(*args, **kwargs), metadata_ttl=metadata_ttl)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: asyncio 接口
+同步驱动的调用放到专用的工作线程中执行，每个工作线程对应一个数据库连接:
+未开启连接池时只有一个工作线程，开启连接池(pool_size)时工作线程数等于连接池大小。
+同一个查询结果的所有fetch都在打开它的工作线程中完成，但每次fetch之间不占用该线程，
+其他操作优先使用没有未读完查询结果的线程，都有时与查询结果共用线程(及连接)，与同步接口的行为一致，
+因此 async for 循环中可以继续 await 其他数据库操作。
+
+Example:
+    from pydbclib import aio
+
+    async def main():
+        async with await aio.connect(":memory:", driver="sqlite3") as db:
+            await db.execute("create table foo(a integer, b varchar(20))")
+            await db.get_table("foo").insert([{"a": 1, "b": "one"}] * 4)
+            async for record in db.read("select * from foo"):
+                print(record)
+"""
+import asyncio
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pydbclib.database import Table
+from pydbclib.exceptions import ParameterError
+
+
+async def connect(*args, **kwargs):
+    """
+    创建异步数据库连接，参数与pydbclib.connect一致
+    连接在工作线程中创建，sqlite3等限制连接只能在创建线程中使用的驱动也可以直接使用
+    """
+    from pydbclib import connect as sync_connect
+    executors = [ThreadPoolExecutor(max_workers=1) for _ in range(kwargs.get("pool_size") or 1)]
+    loop = asyncio.get_event_loop()
+    db = await loop.run_in_executor(executors[0], partial(sync_connect, *args, **kwargs))
+    return AsyncDatabase(db, executors)
+
+
+class AsyncDatabase(object):
+    """
+    Database 的异步封装
+    方法：
+        get_table
+        execute
+        bulk
+        read
+        read_one
+        run_sync
+    """
+
+    def __init__(self, db, executors=None):
+        self.db = db
+        if executors is None:
+            pool = getattr(db.driver, "pool", None)
+            workers = pool.max_size if pool is not None else 1
+            executors = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self._executors = executors
+        self._idle = None
+        # 每个工作线程上未读完的查询结果数
+        self._pinned = {}
+
+    async def acquire(self):
+        """占用一个工作线程，优先选择没有未读完查询结果的线程"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for executor in self._executors:
+                self._idle.put_nowait(executor)
+        executor = await self._idle.get()
+        for _ in range(self._idle.qsize()):
+            if not self._pinned.get(executor):
+                break
+            self._idle.put_nowait(executor)
+            executor = self._idle.get_nowait()
+        return executor
+
+    def release(self, executor):
+        self._idle.put_nowait(executor)
+
+    def pin(self, executor):
+        """查询结果在该工作线程上打开"""
+        self._pinned[executor] = self._pinned.get(executor, 0) + 1
+
+    def unpin(self, executor):
+        self._pinned[executor] -= 1
+
+    @staticmethod
+    async def run_on(executor, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+        在工作线程中执行同步函数，函数的第一个参数为同步的Database对象
+        连接池模式下多条语句组成的事务需要通过它在同一个连接上执行
+
+        Example:
+            def transfer(db, a, b):
+                db.execute(...)
+                db.execute(...)
+                db.commit()
+            await adb.run_sync(transfer, 1, 2)
+        """
+        executor = await self.acquire()
+        try:
+            return await self.run_on(executor, func, self.db, *args, **kwargs)
+        finally:
+            self.release(executor)
+
+    async def _run(self, method, *args, **kwargs):
+        executor = await self.acquire()
+        try:
+            return await self.run_on(executor, method, *args, **kwargs)
+        finally:
+            self.release(executor)
+
+    def get_table(self, name):
+        return AsyncTable(name, self)
+
+    async def execute(self, sql, args=None, autocommit=False):
+        return await self._run(self.db.execute, sql, args, autocommit)
+
+    async def bulk(self, sql, args, batch_size=100000):
+        return await self._run(self.db.bulk, sql, args, batch_size)
+
+    def read(self, sql, args=None, as_dict=True, batch_size=10000, stream=False):
+        """
+        查询返回所有表记录，返回异步迭代对象，在第一次取数时才执行查询
+        """
+        return AsyncRecords(self, partial(self.db.read, sql, args, as_dict, batch_size, stream), batch_size)
+
+    async def read_one(self, sql, args=None, as_dict=True):
+        return await self._run(self.db.read_one, sql, args, as_dict)
+
+    async def commit(self):
+        await self._run(self.db.commit)
+
+    async def rollback(self):
+        await self._run(self.db.rollback)
+
+    async def close(self):
+        await self.run_on(self._executors[0], self.db.close)
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.rollback()
+        finally:
+            await self.close()
+
+
+class AsyncTable(object):
+    """
+    Table 的异步封装
+    方法：
+        get_columns
+        insert
+        bulk
+        upsert
+        bulk_upsert
+        update
+        bulk_update
+        delete
+        bulk_delete
+        find_one
+        find
+    """
+
+    def __init__(self, name, db):
+        self.name = name
+        self.db = db
+        self._table = Table(name, db.db)
+
+    async def get_columns(self):
+        return await self.db._run(self._table.get_columns)
+
+    async def insert(self, records):
+        return await self.db._run(self._table.insert, records)
+
+    async def bulk(self, records, batch_size=100000):
+        return await self.db._run(self._table.bulk, records, batch_size)
+
+    async def upsert(self, records, key):
+        return await self.db._run(self._table.upsert, records, key)
+
+    async def bulk_upsert(self, records, key, batch_size=100000):
+        return await self.db._run(self._table.bulk_upsert, records, key, batch_size)
+
+    async def update(self, condition, update):
+        return await self.db._run(self._table.update, condition, update)
+
+    async def bulk_update(self, records, key, batch_size=10000, strategy=None):
+        return await self.db._run(self._table.bulk_update, records, key, batch_size, strategy)
+
+    async def delete(self, condition):
+        return await self.db._run(self._table.delete, condition)
+
+    async def bulk_delete(self, keys, key=None, batch_size=10000):
+        return await self.db._run(self._table.bulk_delete, keys, key, batch_size)
+
+    async def find_one(self, condition=None, fields=None):
+        return await self.db._run(self._table.find_one, condition, fields)
+
+    def find(self, condition=None, fields=None, batch_size=10000, stream=False):
+        return AsyncRecords(self.db, partial(self._table.find, condition, fields, batch_size, stream), batch_size)
+
+
+def _unpin_executor(loop, db, executor):
+    """结果对象未迭代完就被回收时解除与工作线程的关联"""
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(db.unpin, executor)
+
+
+class AsyncRecords(object):
+    """
+    Records 的异步封装，按batch_size分批在工作线程中取数
+    map/filter/rename/limit 需要在开始迭代前调用
+    所有fetch都在打开查询的工作线程中执行，fetch之间不占用该线程，迭代过程中可以await其他数据库操作
+    提前结束迭代时应调用aclose或使用async with，使该线程不再被视为有未读完的查询结果
+    """
+
+    def __init__(self, db, factory, batch_size):
+        self._db = db
+        self._factory = factory
+        self._batch_size = batch_size
+        self._records = None
+        self._executor = None
+        self._finalizer = None
+        self._ops = []
+        self._buffer = deque()
+        self._exhausted = False
+
+    def _chain(self, name, *args):
+        if self._records is not None:
+            raise ParameterError("查询已开始执行，不能再追加操作")
+        self._ops.append((name, args))
+        return self
+
+    def map(self, function):
+        return self._chain("map", function)
+
+    def filter(self, function):
+        return self._chain("filter", function)
+
+    def rename(self, mapper):
+        return self._chain("rename", mapper)
+
+    def limit(self, num):
+        return self._chain("limit", num)
+
+    def where(self, condition=None, **equals):
+        """仅Table.find的结果支持，见Query.where"""
+        return self._chain("where", condition, equals)
+
+    def fields(self, *names):
+        return self._chain("fields", *names)
+
+    def order_by(self, *keys):
+        return self._chain("order_by", *keys)
+
+    def _open(self):
+        records = self._factory()
+        for name, args in self._ops:
+            if name == "where":
+                records = records.where(args[0], **args[1])
+            else:
+                records = getattr(records, name)(*args)
+        # Table.find返回延迟查询，在工作线程中执行
+        return iter(records)
+
+    async def _fetch(self, num):
+        if self._exhausted:
+            return []
+        if self._records is None:
+            self._executor = await self._db.acquire()
+            self._db.pin(self._executor)
+            self._finalizer = weakref.finalize(
+                self, _unpin_executor, asyncio.get_event_loop(), self._db, self._executor)
+            try:
+                self._records = await self._db.run_on(self._executor, self._open)
+            except BaseException:
+                await self.aclose()
+                raise
+            finally:
+                self._db.release(self._executor)
+        rows = await self._db.run_on(self._executor, self._records.get, num)
+        if len(rows) < num:
+            await self.aclose()
+        return rows
+
+    async def aclose(self):
+        """停止取数，解除与工作线程的关联"""
+        self._exhausted = True
+        if self._finalizer is not None and self._finalizer.detach():
+            self._db.unpin(self._executor)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            self._buffer.extend(await self._fetch(self._batch_size))
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.popleft()
+
+    async def get(self, num):
+        rows = []
+        while self._buffer and len(rows) < num:
+            rows.append(self._buffer.popleft())
+        if len(rows) < num:
+            rows.extend(await self._fetch(num - len(rows)))
+        return rows
+
+    async def get_one(self):
+        """取一条记录后结束迭代"""
+        r = await self.get(1)
+        await self.aclose()
+        return r[0] if len(r) > 0 else None
+
+    async def get_all(self):
+        rows = list(self._buffer)
+        self._buffer.clear()
+        while True:
+            batch = await self._fetch(self._batch_size)
+            rows.extend(batch)
+            if len(batch) < self._batch_size:
+                return rows
+
+    async def to_df(self):
+        import pandas
+        return pandas.DataFrame.from_records(await self.get_all())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
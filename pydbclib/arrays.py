@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 查询结果按列写入预分配的numpy数组，需要安装numpy(>=1.23)
+每批次按列用numpy.fromiter直接从fetchmany返回的元组中取值，不构建字典及按列的中间列表，
+数组容量不足时按倍数扩容，读取完后截断到实际行数
+未指定类型的字段按第一批数据推断，之后出现空值、浮点数或字符串等无法原样保存的值时自动提升类型
+"""
+import datetime
+from operator import itemgetter
+
+from pydbclib.exceptions import ParameterError
+
+# description的type_code为python类型的驱动(如pyodbc)直接按类型确定dtype
+_TYPE_DTYPES = {
+    bool: "bool", int: "int64", float: "float64", datetime.datetime: "datetime64[us]", datetime.date: "datetime64[D]"
+}
+_NUMERIC_KINDS = ("b", "i", "u", "f")
+# 整数及布尔数组可以原样保存的python类型，其他类型(如浮点数)写入时会被numpy截断
+_EXACT_TYPES = {"b": {bool}, "i": {int, bool}, "u": {int, bool}}
+
+
+def infer_dtype(values, type_code=None):
+    """
+    按字段类型或数据推断dtype
+    整数含空值时为float64(空值为nan)，布尔含空值、字符串、Decimal等为object
+    """
+    import numpy
+    if isinstance(type_code, type) and type_code in _TYPE_DTYPES:
+        return numpy.dtype(_TYPE_DTYPES[type_code])
+    types = set(map(type, values))
+    nullable = type(None) in types
+    types.discard(type(None))
+    if not types:
+        dtype = "float64"
+    elif types == {bool}:
+        dtype = "object" if nullable else "bool"
+    elif types <= {int, bool}:
+        dtype = "float64" if nullable else "int64"
+    elif types <= {int, float, bool}:
+        dtype = "float64"
+    elif types == {datetime.datetime} and not any(v.tzinfo for v in values if v is not None):
+        dtype = "datetime64[us]"
+    elif types == {datetime.date}:
+        dtype = "datetime64[D]"
+    else:
+        dtype = "object"
+    return numpy.dtype(dtype)
+
+
+def promote_dtype(dtype, values):
+    """当前类型无法容纳新数据时提升后的类型"""
+    import numpy
+    new = infer_dtype(values)
+    if dtype.kind in _NUMERIC_KINDS and new.kind in _NUMERIC_KINDS and "object" not in (dtype, new):
+        promoted = numpy.result_type(dtype, new)
+    elif dtype.kind == new.kind == "M":
+        promoted = numpy.result_type(dtype, new)
+    else:
+        promoted = numpy.dtype("object")
+    # 类型不变仍然失败时(如整数溢出)使用object
+    return promoted if promoted != dtype else numpy.dtype("object")
+
+
+class ColumnBuffer(object):
+    """
+    单个字段的数组缓冲区
+    :param dtype: 数组类型
+    :param capacity: 初始容量
+    :param fixed: 是否为指定的类型，指定类型时不自动提升，无法转换时报错
+    """
+
+    def __init__(self, name, dtype, capacity, fixed=False):
+        import numpy
+        self.name = name
+        self.array = numpy.empty(capacity, dtype)
+        self.size = 0
+        self.fixed = fixed
+
+    def extend(self, batch, getter):
+        import numpy
+        end = self.size + len(batch)
+        if end > len(self.array):
+            self.array.resize(max(end, len(self.array) * 2), refcheck=False)
+        exact = None if self.fixed else _EXACT_TYPES.get(self.array.dtype.kind)
+        if exact is not None and not set(map(type, map(getter, batch))) <= exact:
+            self.array = self.array.astype(promote_dtype(self.array.dtype, list(map(getter, batch))))
+        while True:
+            try:
+                self.array[self.size:end] = numpy.fromiter(map(getter, batch), self.array.dtype, len(batch))
+                break
+            except (TypeError, ValueError, OverflowError) as e:
+                if self.fixed:
+                    raise ParameterError(f"字段{self.name}的值无法转换成{self.array.dtype}: {e}")
+                self.array = self.array.astype(promote_dtype(self.array.dtype, list(map(getter, batch))))
+        self.size = end
+
+    def finish(self):
+        self.array.resize(self.size, refcheck=False)
+        return self.array
+
+
+def normalize_dtypes(dtypes, names):
+    """dtypes可以是单个类型、按字段顺序的列表或{字段名: 类型}，返回按字段顺序的列表，未指定的为None"""
+    if dtypes is None:
+        return [None] * len(names)
+    if isinstance(dtypes, dict):
+        unknown = set(dtypes) - set(names)
+        if unknown:
+            raise ParameterError(f"dtypes中的字段不存在: {sorted(unknown, key=str)}")
+        return [dtypes.get(n) for n in names]
+    if isinstance(dtypes, (list, tuple)):
+        if len(dtypes) != len(names):
+            raise ParameterError(f"dtypes的长度({len(dtypes)})与字段数({len(names)})不一致")
+        return list(dtypes)
+    return [dtypes] * len(names)
+
+
+def batches_to_arrays(batches, names, getters=None, dtypes=None, type_codes=None):
+    """
+    按批次把记录写入按列的numpy数组
+    :param batches: 记录批次迭代器
+    :param names: 字段名称
+    :param getters: 每个字段的取值函数，默认按位置从元组中取值
+    :param dtypes: 指定的类型，见normalize_dtypes
+    :param type_codes: cursor.description中的type_code
+    :return: {字段名: ndarray}
+    """
+    import numpy
+    if getters is None:
+        getters = [itemgetter(i) for i in range(len(names))]
+    dtypes = normalize_dtypes(dtypes, names)
+    type_codes = type_codes or [None] * len(names)
+    buffers = None
+    for batch in batches:
+        if not batch:
+            continue
+        if buffers is None:
+            buffers = []
+            for name, getter, dtype, type_code in zip(names, getters, dtypes, type_codes):
+                fixed = dtype is not None
+                if not fixed:
+                    dtype = infer_dtype(list(map(getter, batch)), type_code)
+                buffers.append(ColumnBuffer(name, dtype, len(batch), fixed))
+        for buffer, getter in zip(buffers, getters):
+            buffer.extend(batch, getter)
+    if buffers is None:
+        return {
+            name: numpy.empty(0, dtype if dtype is not None else infer_dtype([], type_code))
+            for name, dtype, type_code in zip(names, dtypes, type_codes)
+        }
+    return {buffer.name: buffer.finish() for buffer in buffers}
+
+
+def arrays_to_structured(arrays):
+    """按列的数组合并成结构化数组"""
+    import numpy
+    dtype = [(str(name), array.dtype) for name, array in arrays.items()]
+    size = len(next(iter(arrays.values()))) if arrays else 0
+    structured = numpy.empty(size, dtype)
+    for (name, _), array in zip(dtype, arrays.values()):
+        structured[name] = array
+    return structured
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 查询结果缓存
+按sql及参数缓存查询结果的原始元组记录，通过Database写入某张表时自动清除引用了该表的缓存
+"""
+import hashlib
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+
+from pydbclib.exceptions import ParameterError
+from pydbclib.metadata import normalize_name
+from pydbclib.utils import LRUCache
+
+_NAME = r'[\w.$#"`\[\]]+'
+_KEYWORDS = "join|inner|left|right|full|cross|natural|on|using|where|group|having|order|limit|offset|fetch|union|except|intersect"
+_ALIAS = rf"(?:\s+(?:as\s+)?(?!(?:{_KEYWORDS})\b)\w+)?"
+_FROM_REGEX = re.compile(rf"\b(?:from|join)\s+({_NAME}{_ALIAS}(?:\s*,\s*{_NAME}{_ALIAS})*)", re.IGNORECASE)
+_READ_REGEX = re.compile(r"\s*(?:select|with)\b", re.IGNORECASE)
+# 每次执行结果可能不同的函数，以及sqlite日期函数的'now'参数，包含这些的查询不缓存
+_VOLATILE_REGEX = re.compile(
+    r"\b(?:random|rand|randomblob|newid|uuid|gen_random_uuid|uuid_generate_v\d|nextval|currval|sys_guid"
+    r"|now|current_timestamp|current_date|current_time|localtime|localtimestamp|sysdate|systimestamp|getdate"
+    r"|getutcdate|sysdatetime|clock_timestamp|statement_timestamp|timeofday|unix_timestamp|utc_timestamp"
+    r"|last_insert_rowid|last_insert_id|changes|row_count|found_rows)\b|'now'",
+    re.IGNORECASE
+)
+_WRITE_REGEX = re.compile(
+    r"\s*(?:insert|update|delete|merge|replace|upsert|truncate|drop|alter|create|rename|comment|call|exec|execute)\b",
+    re.IGNORECASE
+)
+_WRITE_TABLE_REGEX = re.compile(
+    rf"\s*(?:insert\s+(?:or\s+\w+\s+)?into|replace\s+into|update|delete\s+from|merge\s+into"
+    rf"|truncate(?:\s+table)?|(?:drop|alter|create)\s+table(?:\s+if\s+(?:not\s+)?exists)?)\s+({_NAME})",
+    re.IGNORECASE
+)
+
+
+def table_name(name):
+    """去掉引号及schema前缀的小写表名，不同写法的同一张表按同一个名称处理"""
+    return normalize_name(name).rsplit(".", 1)[-1]
+
+
+def read_tables(sql):
+    """
+    查询语句引用的表名
+    :return: 不可缓存时返回None，包括非查询语句、没有引用表(写入时无法失效)及调用了random/now等函数的查询
+    """
+    if not _READ_REGEX.match(sql) or _VOLATILE_REGEX.search(sql):
+        return None
+    tables = set()
+    for match in _FROM_REGEX.finditer(sql):
+        for item in match.group(1).split(","):
+            tables.add(table_name(item.split()[0]))
+    return frozenset(tables) or None
+
+
+def written_tables(sql):
+    """
+    写入语句涉及的表名
+    :return: 非写入语句返回空集合，写入语句无法识别表名时返回None(需要清除全部缓存)
+    """
+    if not _WRITE_REGEX.match(sql):
+        return frozenset()
+    match = _WRITE_TABLE_REGEX.match(sql)
+    return frozenset([table_name(match.group(1))]) if match else None
+
+
+def make_key(kind, sql, params):
+    """缓存键，参数不可哈希时返回None(不缓存)"""
+    if params is None:
+        frozen = None
+    elif isinstance(params, Mapping):
+        frozen = tuple(sorted(params.items()))
+    else:
+        frozen = tuple(params)
+    key = (kind, sql, frozen)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class CacheEntry(object):
+    """缓存的查询结果，rows为原始元组记录"""
+    __slots__ = ("columns", "rows", "tables", "expires")
+
+    def __init__(self, columns, rows, tables, expires):
+        self.columns = columns
+        self.rows = rows
+        self.tables = tables
+        self.expires = expires
+
+    def __getstate__(self):
+        return self.columns, self.rows, self.tables, self.expires
+
+    def __setstate__(self, state):
+        self.columns, self.rows, self.tables, self.expires = state
+
+
+class MemoryBackend(object):
+    """内存缓存，按LRU淘汰"""
+
+    def __init__(self, max_entries=1000):
+        self._entries = LRUCache(max_entries, on_evict=self._unindex)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _unindex(self, key, entry):
+        with self._lock:
+            for table in entry.tables:
+                keys = self._tables.get(table)
+                if keys is not None:
+                    keys.discard(key)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            for table in entry.tables:
+                self._tables.setdefault(table, set()).add(key)
+        self._entries.set(key, entry)
+
+    def invalidate(self, tables=None):
+        if tables is None:
+            self._entries.clear()
+            with self._lock:
+                self._tables.clear()
+            return
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys.update(self._tables.pop(table, ()))
+        for key in keys:
+            self._entries.pop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        self.invalidate()
+
+
+class SqliteBackend(object):
+    """
+    sqlite文件缓存，进程重启后仍然有效，超出max_entries时淘汰最久未访问的记录
+    :param path: 缓存文件路径
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.max_entries = max_entries
+        self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._con.execute(
+            "create table if not exists entries (key text primary key, value blob, accessed real)"
+        )
+        self._con.execute("create table if not exists entry_tables (key text, name text)")
+        self._con.execute("create index if not exists entry_tables_name on entry_tables (name)")
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(pickle.dumps(key, protocol=4)).hexdigest()
+
+    def get(self, key):
+        key = self._hash(key)
+        with self._lock:
+            row = self._con.execute("select value from entries where key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._con.execute("update entries set accessed=? where key=?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key, entry):
+        key = self._hash(key)
+        value = pickle.dumps(entry, protocol=4)
+        with self._lock:
+            self._con.execute("begin")
+            try:
+                self._delete([key])
+                self._con.execute("insert into entries values (?, ?, ?)", (key, value, time.time()))
+                self._con.executemany("insert into entry_tables values (?, ?)", [(key, t) for t in entry.tables])
+                evicted = [r[0] for r in self._con.execute(
+                    "select key from entries order by accessed desc limit -1 offset ?", (self.max_entries,)
+                )]
+                self._delete(evicted)
+                self._con.execute("commit")
+            except BaseException:
+                self._con.execute("rollback")
+                raise
+
+    def _delete(self, keys):
+        for key in keys:
+            self._con.execute("delete from entries where key=?", (key,))
+            self._con.execute("delete from entry_tables where key=?", (key,))
+
+    def invalidate(self, tables=None):
+        with self._lock:
+            if tables is None:
+                self._con.execute("delete from entries")
+                self._con.execute("delete from entry_tables")
+                return
+            self._con.execute("begin")
+            for table in tables:
+                keys = [r[0] for r in self._con.execute("select key from entry_tables where name=?", (table,))]
+                self._delete(keys)
+            self._con.execute("commit")
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("select count(*) from entries").fetchone()[0]
+
+    def close(self):
+        self._con.close()
+
+
+class ResultCache(object):
+    """
+    查询结果缓存
+    :param backend: memory 或 sqlite，也可以传入自定义的backend对象(实现get/set/invalidate/close)
+    :param path: sqlite缓存文件路径
+    :param ttl: 缓存有效期(秒)，None表示一直有效，其他进程写入的数据只能通过ttl过期
+    :param max_entries: 最多缓存的查询数
+    :param max_rows: 单个查询最多缓存的行数，结果超出时不缓存
+    """
+
+    def __init__(self, backend="memory", path=None, ttl=None, max_entries=1000, max_rows=10000):
+        if backend == "memory":
+            backend = MemoryBackend(max_entries)
+        elif backend == "sqlite":
+            if path is None:
+                raise ParameterError("sqlite缓存需要指定path参数")
+            backend = SqliteBackend(path, max_entries)
+        elif isinstance(backend, str):
+            raise ParameterError(f"不支持的缓存类型: {backend}")
+        self.backend = backend
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 每张表及全部清除的失效版本号，读取期间有写入时不写入缓存
+        self._generation = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, tables):
+        """查询开始前记录引用表的失效版本号，传给set/recording"""
+        with self._lock:
+            return self._generation, tuple(self._generations.get(table_name(t), 0) for t in tables)
+
+    def get(self, key):
+        """返回未过期的CacheEntry，不存在时返回None"""
+        entry = self.backend.get(key)
+        if entry is not None and entry.expires is not None and entry.expires < time.time():
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, columns, rows, tables, snapshot=None):
+        """snapshot为查询开始前的失效版本号，之后引用的表被清除过时不写入"""
+        if snapshot is not None and snapshot != self.snapshot(tables):
+            return
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self.backend.set(key, CacheEntry(columns, rows, tables, expires))
+
+    def recording(self, key, batches, columns, tables, snapshot=None):
+        """读取批次数据的同时记录下来，全部读完且未超出max_rows时写入缓存"""
+        if snapshot is None:
+            snapshot = self.snapshot(tables)
+        return self._record(key, batches, columns, tables, snapshot)
+
+    def _record(self, key, batches, columns, tables, snapshot):
+        rows = []
+        for batch in batches:
+            if rows is not None:
+                if len(rows) + len(batch) > self.max_rows:
+                    rows = None
+                else:
+                    rows.extend(batch)
+            yield batch
+        if rows is not None:
+            self.set(key, columns, rows, tables, snapshot)
+
+    def invalidate(self, tables=None):
+        """清除引用了指定表的缓存，tables为None时清除全部"""
+        self.invalidations += 1
+        names = None if tables is None else [table_name(t) for t in tables]
+        with self._lock:
+            if names is None:
+                self._generation += 1
+            else:
+                for name in names:
+                    self._generations[name] = self._generations.get(name, 0) + 1
+        self.backend.invalidate(names)
+
+    def cache_info(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+            "size": len(self.backend), "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self.backend.close()
@@ -3,11 +3,18 @@
 @time: 2020/3/26 11:30 上午
 @desc:
 """
-from collections.abc import Iterator
+from collections.abc import Iterator, Mapping
+from functools import lru_cache
 
+from pydbclib.cache import ResultCache, make_key, read_tables, written_tables
+from pydbclib.dialects import limit_sql, max_params, upsert_sql
 from pydbclib.exceptions import ParameterError
-from pydbclib.record import Records
-from pydbclib.utils import batch_dataset, get_records
+from pydbclib.instrument import StatsAggregator
+from pydbclib.metadata import MetaData, TableInfo
+from pydbclib.query import Query
+from pydbclib.parallel import parallel_bulk, parallel_read, range_conditions, split_range
+from pydbclib.record import Records, BulkResult, Page, key_getter
+from pydbclib.utils import batch_dataset, get_batches, batches_to_records
 
 
 class Database(object):
@@ -19,10 +26,31 @@ class Database(object):
         bulk
         read
         read_one
+        release
+        pool_status
+        statement_cache_info
+        enable_stats
+        stats
+        enable_cache
+        invalidate_cache
+        cache_info
     """
 
-    def __init__(self, driver):
+    def __init__(self, driver, metadata_ttl=None):
+        """
+        :param metadata_ttl: 表结构缓存有效期(秒)，None表示一直有效(执行DDL时自动失效)，0表示不缓存
+        """
         self.driver = driver
+        self.metadata = MetaData(ttl=metadata_ttl)
+        self.aggregator = None
+        self.cache = None
+        # 当前事务中写入过的表，回滚时清除这些表的查询缓存，None表示无法识别
+        self._written = set()
+
+    @property
+    def instrumentation(self):
+        """sql执行监控事件分发器，subscribe(subscriber)添加订阅者"""
+        return self.driver.instrumentation
 
     def get_table(self, name):
         return Table(name, self)
@@ -54,7 +82,9 @@ class Database(object):
                 ]
             )
         """
-        if args is None or isinstance(args, dict):
+        self.metadata.invalidate_ddl(sql)
+        self._invalidate(sql)
+        if args is None or isinstance(args, Mapping):
             res = self.driver.execute(sql, args)
         elif isinstance(args, (list, tuple)):
             res = self.driver.execute_many(sql, args)
@@ -64,46 +94,104 @@ class Database(object):
             self.commit()
         return res
 
-    def bulk(self, sql, args, batch_size=100000):
-        """批量插入"""
+    def bulk(self, sql, args, batch_size=100000, strategy=None):
+        """
+        批量插入，每批次提交一次
+        :param sql: sql语句
+        :param args: 记录数据，字典或序列的集合/迭代器
+        :param batch_size: 每批次写入行数
+        :param strategy: 批量写入方式，copy(postgresql)、multi_values、executemany，默认按数据库类型自动选择
+        :return: BulkResult，写入的总行数，strategy属性为实际使用的写入方式
+        """
         if isinstance(args, (list, tuple, Iterator)):
             rowcount = 0
+            strategy_used = None
             for batch in batch_dataset(args, batch_size):
-                rowcount += self.driver.bulk(sql, batch)
-            return rowcount
+                r = self._bulk(sql, batch, strategy)
+                rowcount += r
+                strategy_used = r.strategy
+            return BulkResult(rowcount, strategy_used)
         else:
             raise ParameterError("'params'参数类型无效")
 
-    def read(self, sql, args=None, as_dict=True, batch_size=10000):
+    def _bulk(self, sql, batch, strategy=None):
+        """单批次批量写入并提交"""
+        self._invalidate(sql)
+        result = self.driver.bulk(sql, batch, strategy)
+        # driver.bulk已提交，之前未提交的写入也一并提交了
+        self._written = set()
+        return result
+
+    def read(self, sql, args=None, as_dict=True, batch_size=10000, stream=False, compact=False, fetch_bytes=None,
+             cache=True):
         """
         查询返回所有表记录
         :param sql: sql语句
         :param args: sql语句参数
         :param as_dict: 返回记录是否转换成字典形式（True: [{"a": 1, "b": "one"}]， False: [(1, "one)]），默认为True
         :param batch_size: 每次查询返回的缓存的数量，大数据量可以适当提高大小
+        :param stream: 是否使用服务端游标分批拉取结果，大数据量导出时避免客户端缓存全部结果
+        :param compact: as_dict为True时使用共享字段索引的Row对象代替字典，减少内存占用，
+            Row支持 row["a"]、row.a、dict(row)，但不能修改
+        :param fetch_bytes: 每批次读取的目标字节数，指定后根据估算的行宽自动调整每批次行数，
+            实际读取情况记录在返回结果的stats属性中
+        :param cache: 开启查询缓存(enable_cache)时是否使用缓存，流式读取不使用缓存
         :return: 生成器对象
         """
-        r = self.driver.execute(sql, args)
-        if as_dict:
-            # columns = [i[0].lower() for i in r.description]
-            columns = r.get_columns()
-            records = get_records(r, batch_size, columns)
+        key = tables = snapshot = None
+        if self.cache is not None and cache and not stream:
+            key = make_key("read", sql, args)
+            tables = read_tables(sql) if key is not None else None
+            if tables is not None:
+                snapshot = self.cache.snapshot(tables)
+                entry = self.cache.get(key)
+                if entry is not None:
+                    columns = list(entry.columns)
+                    batches = iter([entry.rows])
+                    records = batches_to_records(batches, columns if as_dict else None, compact)
+                    return Records(
+                        records, as_dict, batches=batches, columns=columns, stats={"cached": True}, compact=compact
+                    )
+        if stream:
+            r = self.driver.execute_stream(sql, args, batch_size)
         else:
-            records = get_records(r, batch_size)
-        return Records(records, as_dict)
-
-    def read_one(self, sql, args=None, as_dict=True):
+            r = self.driver.execute(sql, args)
+        # columns = [i[0].lower() for i in r.description]
+        columns = r.get_columns()
+        stats = {}
+        on_fetch = self.instrumentation.fetch_observer(sql)
+        batches = get_batches(r, batch_size, close=stream, fetch_bytes=fetch_bytes, stats=stats, on_fetch=on_fetch)
+        if tables is not None:
+            batches = self.cache.recording(key, batches, tuple(columns), tables, snapshot)
+        records = batches_to_records(batches, columns if as_dict else None, compact)
+        types = [d[1] for d in r.description] if r.description else None
+        return Records(records, as_dict, batches=batches, columns=columns, stats=stats, compact=compact, types=types)
+
+    def read_one(self, sql, args=None, as_dict=True, cache=True):
         """
         查询返回一条表记录
         :param sql: sql语句
         :param args: sql语句参数
         :param as_dict: 返回记录是否转换成字典形式（True: [{"a": 1, "b": "one"}]， False: [(1, "one)]），默认为True
+        :param cache: 开启查询缓存(enable_cache)时是否使用缓存
         :return: to_dict=True {"a": 1, "b": "one"}, to_dict=False (1, "one")
         """
+        key = tables = snapshot = None
+        if self.cache is not None and cache:
+            key = make_key("read_one", sql, args)
+            tables = read_tables(sql) if key is not None else None
+            if tables is not None:
+                snapshot = self.cache.snapshot(tables)
+                entry = self.cache.get(key)
+                if entry is not None:
+                    record = entry.rows[0] if entry.rows else None
+                    return dict(zip(entry.columns, record)) if as_dict and record is not None else record
         r = self.driver.execute(sql, args)
         record = r.fetchone()
         # Unbuffered Cursor needed
         r.fetchall()
+        if tables is not None:
+            self.cache.set(key, tuple(r.get_columns()), [record] if record is not None else [], tables, snapshot)
         if as_dict:
             if record is None:
                 return None
@@ -116,9 +204,102 @@ class Database(object):
 
     def commit(self):
         self.driver.commit()
+        self._written = set()
 
     def rollback(self):
         self.driver.rollback()
+        if self.cache is not None and self._written != set():
+            # 写入后、回滚前缓存的查询结果可能包含未提交的数据
+            self.cache.invalidate(self._written)
+        self._written = set()
+
+    def enable_cache(self, backend="memory", path=None, ttl=None, max_entries=1000, max_rows=10000):
+        """
+        开启查询结果缓存，read/read_one(及Table.find/find_one)按sql及参数缓存结果，
+        通过execute/bulk及Table的写入方法写入表时自动清除引用了该表的缓存，已开启时直接返回
+        :param backend: memory 或 sqlite
+        :param path: sqlite缓存文件路径
+        :param ttl: 缓存有效期(秒)，其他连接或进程写入的数据只能通过ttl过期
+        :param max_entries: 最多缓存的查询数
+        :param max_rows: 单个查询最多缓存的行数
+        :return: ResultCache
+        """
+        if self.cache is None:
+            self.cache = ResultCache(backend, path, ttl, max_entries, max_rows)
+        return self.cache
+
+    def disable_cache(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def invalidate_cache(self, table=None):
+        """清除指定表相关或全部的查询缓存"""
+        if self.cache is not None:
+            self.cache.invalidate(None if table is None else [table])
+
+    def cache_info(self):
+        """查询缓存统计，未开启时返回None"""
+        return self.cache.cache_info() if self.cache is not None else None
+
+    def _invalidate(self, sql):
+        """写入语句清除相关表的查询缓存"""
+        if self.cache is None:
+            return
+        tables = written_tables(sql)
+        if tables is None:
+            self.cache.invalidate()
+            self._written = None
+        elif tables:
+            self.cache.invalidate(tables)
+            if self._written is not None:
+                self._written.update(tables)
+
+    def release(self):
+        """连接池模式下归还当前线程占用的连接"""
+        self.driver.release()
+
+    def pool_status(self):
+        """
+        连接池状态，未开启连接池时返回None
+        :return: 字典，如 {"size": 2, "in_use": 1, "idle": 1, "wait_time": 0.01, ...}
+        """
+        pool = getattr(self.driver, "pool", None)
+        return pool.status() if pool is not None else None
+
+    def enable_stats(self, max_samples=1024, max_statements=1000):
+        """
+        开启内存中的执行统计，已开启时直接返回
+        :return: StatsAggregator
+        """
+        if self.aggregator is None:
+            self.aggregator = self.instrumentation.subscribe(StatsAggregator(max_samples, max_statements))
+        return self.aggregator
+
+    def disable_stats(self):
+        if self.aggregator is not None:
+            self.instrumentation.unsubscribe(self.aggregator)
+            self.aggregator = None
+
+    def stats(self, reset=False):
+        """
+        按规范化语句汇总的执行统计，需要先调用enable_stats，未开启时返回None
+        :param reset: 返回后是否清空统计
+        :return: {语句: {"compile"/"execute"/"fetch"/"bulk": {"count", "total", "rows", "bytes", "p50", "p95", "p99", "max"}}}
+        """
+        if self.aggregator is None:
+            return None
+        result = self.aggregator.stats()
+        if reset:
+            self.aggregator.reset()
+        return result
+
+    def statement_cache_info(self):
+        """
+        预编译语句缓存统计，CommonDriver开启prepared模式时有效，否则返回None
+        :return: 字典，如 {"hits": 98, "misses": 2, "evictions": 0, "size": 2, "hit_rate": 0.98, ...}
+        """
+        return self.driver.statement_cache_info()
 
     def close(self):
         self.driver.close()
@@ -138,7 +319,7 @@ class Database(object):
 
 def format_condition(condition):
     param = {}
-    if isinstance(condition, dict):
+    if isinstance(condition, Mapping):
         expressions = []
         for i, k in enumerate(condition):
             param[f"c{i}"] = condition[k]
@@ -150,7 +331,7 @@ def format_condition(condition):
 
 def format_update(update):
     param = {}
-    if isinstance(update, dict):
+    if isinstance(update, Mapping):
         expressions = []
         for i, k in enumerate(update):
             param[f"u{i}"] = update[k]
@@ -161,6 +342,30 @@ def format_update(update):
     return update, param
 
 
+@lru_cache(maxsize=256)
+def param_names(prefix, num):
+    return tuple(f"{prefix}{i}" for i in range(num))
+
+
+def key_fields(key):
+    """键字段统一为元组，key可以是单个字段名或字段名列表"""
+    return (key,) if isinstance(key, str) else tuple(key)
+
+
+def keyset_condition(keys, names):
+    """
+    键集分页条件，按键字段顺序取大于上一页最后一条记录的键值
+    (a, b) > (:k0, :k1) => a > :k0 or (a = :k0 and b > :k1)
+    """
+    expressions = []
+    for i, key in enumerate(keys):
+        equals = [f"{k} = :{n}" for k, n in zip(keys[:i], names)]
+        expressions.append(" and ".join(equals + [f"{key} > :{names[i]}"]))
+    if len(expressions) == 1:
+        return expressions[0]
+    return " or ".join(f"({e})" for e in expressions)
+
+
 class Table(object):
     """
     数据库表操作封装
@@ -168,11 +373,18 @@ class Table(object):
         get_columns
         insert
         bulk
+        upsert
+        bulk_upsert
         update
+        bulk_update
         delete
+        bulk_delete
         find_one
         find
+        iter_pages
     """
+    # bulk_update 单个键字段时使用case方式更新的最少记录数
+    case_min_rows = 16
 
     def __init__(self, name, db):
         self.name = name
@@ -180,31 +392,127 @@ class Table(object):
 
     def get_columns(self):
         """获取表字段名称"""
+        return list(self.get_info().columns)
+
+    def get_info(self):
+        """获取表结构，首次查询后缓存在Database.metadata中"""
+        return self.db.metadata.get_table(self.name, self._load_info)
+
+    def _load_info(self):
         r = self.db.execute(f"select * from {self.name} where 1=0")
         r.fetchall()
         # return [i[0].lower() for i in r.description]
-        return r.get_columns()
+        return TableInfo(tuple(r.get_columns()), tuple(i[1] for i in r.description))
+
+    def _render(self, kind, condition=None, update=None, fields=None):
+        """
+        生成sql及参数，条件和更新字段为字典时按字段集合缓存sql模板
+        """
+        if isinstance(condition, (Mapping, type(None))) and isinstance(update, (Mapping, type(None))):
+            key = (kind, tuple(fields) if fields else None, tuple(condition or ()), tuple(update or ()))
+            sql = self.db.metadata.get_template(
+                self.name, key, lambda: self._format(kind, condition, update, fields)[0]
+            )
+            param = {}
+            if condition:
+                param.update(zip(param_names("c", len(condition)), condition.values()))
+            if update:
+                param.update(zip(param_names("u", len(update)), update.values()))
+            return sql, param
+        return self._format(kind, condition, update, fields)
+
+    def _format(self, kind, condition=None, update=None, fields=None):
+        condition, param = format_condition(condition)
+        if kind == "select":
+            fields = "*" if fields is None else ','.join(fields)
+            return f"select {fields} from {self.name}{condition}", param
+        elif kind == "update":
+            update, p2 = format_update(update)
+            param.update(p2)
+            return f"update {self.name} set {update}{condition}", param
+        else:
+            return f"delete from {self.name}{condition}", param
 
     def insert(self, records):
         """
         表中插入记录
         :param records: 要插入的记录数据，字典or字典列表
         """
-        if isinstance(records, dict):
+        if isinstance(records, Mapping):
             return self._insert_one(records)
         else:
             return self._insert_many(records)
 
-    def bulk(self, records, batch_size=100000):
+    def bulk(self, records, batch_size=100000, strategy=None, parallel=None):
+        """
+        批量插入记录，每批次提交一次
+        :param records: 字典记录的集合/迭代器
+        :param batch_size: 每批次写入行数
+        :param strategy: 批量写入方式，默认按数据库类型自动选择
+        :param parallel: 并行写入的连接数，每个连接各自提交，失败的批次不会中断写入，
+            记录在返回结果的errors中(含批次在输入数据中的位置offset，用于续传)
+        :return: BulkResult，batches属性为每批次写入行数
+        """
         if isinstance(records, (list, tuple, Iterator)):
-            rowcount = 0
-            for batch in batch_dataset(records, batch_size):
-                rowcount += self._insert_many(batch)
-                self.db.commit()
-            return rowcount
+            batches = batch_dataset(records, batch_size)
+            if parallel:
+                return parallel_bulk(self.db, lambda batch: self._bulk_insert(batch, strategy), batches, parallel)
+            rowcounts = []
+            strategy_used = None
+            for batch in batches:
+                r = self._bulk_insert(batch, strategy)
+                rowcounts.append(int(r))
+                strategy_used = r.strategy
+            return BulkResult(sum(rowcounts), strategy_used, batches=rowcounts)
         else:
             raise ParameterError("'params'参数类型无效")
 
+    def upsert(self, records, key):
+        """
+        按键字段插入或更新记录，记录已存在时更新其它字段，否则插入
+        :param records: 字典or字典列表
+        :param key: 键字段名或键字段列表，需要是表的主键或唯一约束
+        :return: 返回影响行数
+        """
+        if isinstance(records, Mapping):
+            sample = records
+        elif isinstance(records, (list, tuple)) and records and isinstance(records[0], Mapping):
+            sample = records[0]
+        else:
+            raise ParameterError("无效的参数")
+        return self.db.execute(self._get_upsert_sql(sample.keys(), key), records).rowcount
+
+    def bulk_upsert(self, records, key, batch_size=100000, strategy=None):
+        """
+        批量插入或更新记录，每批次一次写入并提交
+        同一批次内键重复的记录只保留最后一条(postgresql等数据库不允许一条语句内重复更新同一行)
+        :param records: 字典记录的集合/迭代器
+        :param key: 键字段名或键字段列表，需要是表的主键或唯一约束
+        :param batch_size: 每批次写入行数
+        :param strategy: 批量写入方式，multi_values、executemany，默认按数据库类型自动选择
+        :return: BulkResult
+        """
+        if not isinstance(records, (list, tuple, Iterator)):
+            raise ParameterError("'params'参数类型无效")
+        key = key_fields(key)
+        rowcounts = []
+        strategy_used = None
+        for batch in batch_dataset(records, batch_size):
+            sample = batch[0]
+            if not isinstance(sample, Mapping):
+                raise ParameterError("无效的参数")
+            batch = list({tuple(r[k] for k in key): r for r in batch}.values())
+            r = self.db._bulk(self._get_upsert_sql(sample.keys(), key), batch, strategy)
+            rowcounts.append(int(r))
+            strategy_used = r.strategy
+        return BulkResult(sum(rowcounts), strategy_used, batches=rowcounts)
+
+    def _get_upsert_sql(self, columns, key):
+        columns, key = tuple(columns), key_fields(key)
+        return self.db.metadata.get_template(self.name, ("upsert", columns, key), lambda: upsert_sql(
+            self.db.driver.dialect, self.name, columns, key
+        ))
+
     def update(self, condition, update):
         """
         表更新操作
@@ -212,10 +520,79 @@ class Table(object):
         :param update: 要更新的字段，字典类型
         :return: 返回影响行数
         """
-        condition, p1 = format_condition(condition)
-        update, p2 = format_update(update)
-        p1.update(p2)
-        return self.db.execute(f"update {self.name} set {update}{condition}", p1).rowcount
+        sql, param = self._render("update", condition, update)
+        return self.db.execute(sql, param).rowcount
+
+    def bulk_update(self, records, key, batch_size=10000, strategy=None):
+        """
+        按键字段批量更新记录，每条记录按键字段更新其余字段，每批次提交一次
+        :param records: 字典记录的集合/迭代器，如 [{"id": 1, "b": "one"}, {"id": 2, "b": "two"}]
+        :param key: 键字段名或键字段列表
+        :param batch_size: 每批次更新行数
+        :param strategy: 更新方式，executemany: 每行一条update语句批量执行，
+            case: update ... set b=case id when .. then .. end where id in (..) 按块更新，只支持单个键字段，
+            默认非sqlite数据库(executemany每行一次网络往返)单个键字段且同一字段组合的记录数达到case_min_rows时使用case
+        :return: BulkResult，更新的总行数
+        """
+        if not isinstance(records, (list, tuple, Iterator)):
+            raise ParameterError("'params'参数类型无效")
+        key = key_fields(key)
+        if strategy not in (None, "executemany", "case") or (strategy == "case" and len(key) != 1):
+            raise ParameterError(f"无效的更新方式: {strategy}")
+        rowcounts = []
+        strategy_used = None
+        for batch in batch_dataset(records, batch_size):
+            groups = {}
+            for record in batch:
+                if not isinstance(record, Mapping):
+                    raise ParameterError("无效的参数")
+                groups.setdefault(tuple(record), []).append(record)
+            rowcount = 0
+            for columns, rows in groups.items():
+                r, strategy_used = self._update_group(columns, key, rows, strategy)
+                rowcount += r
+            self.db.commit()
+            rowcounts.append(rowcount)
+        return BulkResult(sum(rowcounts), strategy_used, batches=rowcounts)
+
+    def _update_group(self, columns, key, rows, strategy):
+        """更新字段组合相同的一组记录，返回(更新行数, 更新方式)"""
+        updates = tuple(c for c in columns if c not in key)
+        if len(updates) + len(key) != len(columns) or not updates:
+            raise ParameterError(f"记录需要包含键字段{key}及至少一个更新字段: {columns}")
+        if strategy is None:
+            use_case = self.db.driver.dialect != "sqlite" and len(key) == 1 and len(rows) >= self.case_min_rows
+            strategy = "case" if use_case else "executemany"
+        if strategy == "executemany":
+            sql = self.db.metadata.get_template(self.name, ("bulk_update", updates, key), lambda: (
+                f"update {self.name} set {','.join(f'{c}=:{c}' for c in updates)}"
+                f" where {' and '.join(f'{k}=:{k}' for k in key)}"
+            ))
+            return self.db.execute(sql, rows).rowcount, strategy
+        # 同一个键值只保留最后一条记录，与逐行更新的结果一致
+        k = key[0]
+        rows = list({r[k]: r for r in rows}.values())
+        size = max(1, min(500, max_params(self.db.driver.dialect) // (1 + 2 * len(updates))))
+        rowcount = 0
+        for i in range(0, len(rows), size):
+            chunk = rows[i:i + size]
+            sql = self.db.metadata.get_template(
+                self.name, ("bulk_update_case", updates, k, len(chunk)),
+                lambda: self._case_update_sql(updates, k, len(chunk))
+            )
+            param = dict(zip(param_names("k", len(chunk)), (r[k] for r in chunk)))
+            for j, c in enumerate(updates):
+                param.update(zip(param_names(f"u{j}_", len(chunk)), (r[c] for r in chunk)))
+            rowcount += self.db.execute(sql, param).rowcount
+        return rowcount, strategy
+
+    def _case_update_sql(self, updates, key, num):
+        keys = param_names("k", num)
+        assignments = []
+        for j, c in enumerate(updates):
+            branches = " ".join(f"when :{k} then :{v}" for k, v in zip(keys, param_names(f"u{j}_", num)))
+            assignments.append(f"{c}=case {key} {branches} end")
+        return f"update {self.name} set {','.join(assignments)} where {key} in ({','.join(':' + k for k in keys)})"
 
     def delete(self, condition):
         """
@@ -223,52 +600,168 @@ class Table(object):
         :param condition: 删除条件，字典类型或者sql条件表达式
         :return: 返回影响行数
         """
-        condition, param = format_condition(condition)
-        return self.db.execute(f"delete from {self.name}{condition}", param).rowcount
+        sql, param = self._render("delete", condition)
+        return self.db.execute(sql, param).rowcount
 
-    def find_one(self, condition=None, fields=None):
+    def bulk_delete(self, keys, key=None, batch_size=10000):
+        """
+        按键值批量删除记录，每批次提交一次
+        单个键字段时按 where id in (..) 分块删除，多个键字段时每行一条delete语句批量执行
+        :param keys: 键值的集合/迭代器，单个键字段时为键值，如 [1, 2, 3]，多个键字段时为字典，如 [{"a": 1, "b": "1"}]
+        :param key: 键字段名或键字段列表，keys为字典时默认使用字典的键
+        :param batch_size: 每批次删除行数
+        :return: BulkResult，删除的总行数
+        """
+        if not isinstance(keys, (list, tuple, Iterator)):
+            raise ParameterError("'params'参数类型无效")
+        rowcounts = []
+        strategy = None
+        for batch in batch_dataset(keys, batch_size):
+            if key is None:
+                if not isinstance(batch[0], Mapping):
+                    raise ParameterError("keys不是字典时需要指定key参数")
+                key = batch[0]
+            key = key_fields(key)
+            if len(key) == 1:
+                strategy = "in"
+                k = key[0]
+                values = [v[k] for v in batch] if isinstance(batch[0], Mapping) else batch
+                rowcount = self._delete_in(k, values)
+            else:
+                strategy = "executemany"
+                sql = self.db.metadata.get_template(self.name, ("bulk_delete", key), lambda: (
+                    f"delete from {self.name} where {' and '.join(f'{k}=:{k}' for k in key)}"
+                ))
+                rowcount = self.db.execute(sql, [{k: v[k] for k in key} for v in batch]).rowcount
+            self.db.commit()
+            rowcounts.append(rowcount)
+        return BulkResult(sum(rowcounts), strategy, batches=rowcounts)
+
+    def _delete_in(self, key, values):
+        # oracle的in列表最多1000个表达式
+        size = max(1, min(1000, max_params(self.db.driver.dialect)))
+        rowcount = 0
+        for i in range(0, len(values), size):
+            chunk = values[i:i + size]
+            names = param_names("k", len(chunk))
+            sql = self.db.metadata.get_template(self.name, ("bulk_delete_in", key, len(chunk)), lambda: (
+                f"delete from {self.name} where {key} in ({','.join(':' + n for n in names)})"
+            ))
+            rowcount += self.db.execute(sql, dict(zip(names, chunk))).rowcount
+        return rowcount
+
+    def find_one(self, condition=None, fields=None, cache=True):
         """
         按条件查询一条表记录
         :param condition: 查询条件，字典类型或者sql条件表达式
         :param fields: 指定返回的字段
+        :param cache: 开启查询缓存时是否使用缓存
         :return: 字典类型，如 {"a": 1, "b": "one"}
         """
-        if fields is None:
-            fields = "*"
-        else:
-            fields = ','.join(fields)
-        condition, param = format_condition(condition)
-        return self.db.read_one(f"select {fields} from {self.name}{condition}", param)
+        sql, param = self._render("select", condition, fields=fields)
+        return self.db.read_one(sql, param, cache=cache)
 
-    def find(self, condition=None, fields=None):
+    def find(self, condition=None, fields=None, batch_size=10000, stream=False, compact=False, fetch_bytes=None,
+             partition_by=None, partitions=4, bounds=None, ordered=False, cache=True):
         """
         按条件查询所有符合条件的表记录
         :param condition: 查询条件，字典类型或者sql条件表达式
         :param fields: 指定返回的字段
-        :return: 生成器类型
+        :param batch_size: 每次查询返回的缓存的数量
+        :param stream: 是否使用服务端游标分批拉取结果
+        :param compact: 是否使用Row对象代替字典
+        :param fetch_bytes: 每批次读取的目标字节数
+        :param partition_by: 分区字段(数值或日期类型)，指定后按该字段把查询拆分成多个区间，在多个连接上并行读取，
+            CommonDriver需要开启连接池且连接数大于分区数
+        :param partitions: 分区数量
+        :param bounds: 分区字段的(最小值, 最大值)，默认查询min/max得到
+        :param ordered: 是否按分区顺序返回记录
+        :param cache: 开启查询缓存时是否使用缓存，分区并行读取不使用缓存
+        :return: 延迟执行的Query对象，之后调用的where/fields/order_by/limit合并到sql中执行；
+            分区读取时返回Records
         """
-        if fields is None:
-            fields = "*"
-        else:
-            fields = ','.join(fields)
+        options = dict(batch_size=batch_size, stream=stream, compact=compact, fetch_bytes=fetch_bytes)
+        if partition_by is None:
+            return Query(self, condition, fields, cache=cache, **options)
+        select = f"select {'*' if fields is None else ','.join(fields)} from {self.name}"
         condition, param = format_condition(condition)
-        return self.db.read(f"select {fields} from {self.name}{condition}", param)
+        if bounds is None:
+            bounds = self.db.read_one(
+                f"select min({partition_by}), max({partition_by}) from {self.name}{condition}", param, as_dict=False
+            )
+        where = condition[len(" where "):]
+        queries = []
+        for expression, range_param in range_conditions(partition_by, split_range(*bounds, partitions)):
+            expressions = " and ".join(f"({e})" for e in (where, expression) if e)
+            queries.append((f"{select} where {expressions}" if expressions else select, {**param, **range_param}))
+        return Records(parallel_read(self.db, queries, ordered=ordered, cache=False, **options), True)
+
+    def iter_pages(self, order_by, page_size=10000, condition=None, fields=None, last_key=None):
+        """
+        按键集(keyset)分页读取，每页按键字段排序后取大于上一页最后键值的记录，
+        查询耗时不随页数增加，每页读取完即释放游标，页之间不占用游标和事务
+        :param order_by: 排序的键字段名称或列表，键值需要唯一且非空
+        :param page_size: 每页记录数
+        :param condition: 查询条件，字典类型或者sql条件表达式
+        :param fields: 指定返回的字段，需要包含键字段
+        :param last_key: 从该键值之后开始读取，即上次读取的最后一页的Page.last_key，多个键字段时为元组
+        :return: Page生成器，Page为记录列表，last_key为该页最后一条记录的键值
+        """
+        keys = [order_by] if isinstance(order_by, str) else list(order_by)
+        if not keys:
+            raise ParameterError("'order_by' 参数不能为空值")
+        if fields is not None and any(k not in fields for k in keys):
+            raise ParameterError(f"返回字段必须包含键字段: {keys}")
+        condition, param = format_condition(condition)
+        where = condition[len(" where "):]
+        select = f"select {'*' if fields is None else ','.join(fields)} from {self.name}"
+        names = param_names("k", len(keys))
+        keyset = keyset_condition(keys, names)
+        order = f" order by {','.join(keys)}"
+        dialect = self.db.driver.dialect
+        first = limit_sql(dialect, f"{select}{condition}{order}", page_size)
+        following = limit_sql(
+            dialect, f"{select} where {f'({where}) and ({keyset})' if where else keyset}{order}", page_size
+        )
+        getter = key_getter(order_by if isinstance(order_by, str) else keys)
+        while True:
+            if last_key is None:
+                rows = self.db.read(first, param).get_all()
+            else:
+                values = (last_key,) if isinstance(order_by, str) else tuple(last_key)
+                rows = self.db.read(following, {**param, **dict(zip(names, values))}).get_all()
+            if not rows:
+                return
+            last_key = getter(rows[-1])
+            yield Page(rows, last_key)
+            if len(rows) < page_size:
+                return
 
     def _get_insert_sql(self, columns):
-        return f"insert into {self.name} ({','.join(columns)})" \
-               f" values ({','.join([':%s' % i for i in columns])})"
+        columns = tuple(columns)
+        return self.db.metadata.get_template(self.name, ("insert", columns), lambda: (
+            f"insert into {self.name} ({','.join(columns)})"
+            f" values ({','.join([':%s' % i for i in columns])})"
+        ))
 
     def _insert_one(self, record):
         """
         表中插入一条记录
         :param record: 要插入的记录数据，字典类型
         """
-        if isinstance(record, dict):
+        if isinstance(record, Mapping):
             columns = record.keys()
             return self.db.execute(self._get_insert_sql(columns), record).rowcount
         else:
             raise ParameterError("无效的参数")
 
+    def _bulk_insert(self, records, strategy=None):
+        sample = records[0]
+        if isinstance(sample, Mapping):
+            return self.db._bulk(self._get_insert_sql(sample.keys()), records, strategy)
+        else:
+            raise ParameterError("无效的参数")
+
     def _insert_many(self, records):
         """
         表中插入多条记录
@@ -277,7 +770,7 @@ class Table(object):
         if not isinstance(records, (tuple, list)):
             raise ParameterError("records param must list or tuple")
         sample = records[0]
-        if isinstance(sample, dict):
+        if isinstance(sample, Mapping):
             columns = sample.keys()
             return self.db.execute(self._get_insert_sql(columns), records).rowcount
         else:
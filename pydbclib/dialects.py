@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 不同数据库的sql方言
+"""
+import re
+
+from pydbclib.exceptions import ParameterError
+
+# 单条语句绑定参数个数上限
+_max_params = {"mysql": 65535, "postgresql": 65535, "oracle": 65535, "mssql": 2000}
+# 单条语句(含参数值)的字节数上限，多行插入按此分块，可以按服务端配置修改，如
+# statement_bytes["mysql"] = 64 * 1024 * 1024
+# mysql取max_allowed_packet在5.7的默认值4MB，驱动在客户端把参数值拼接进sql
+statement_bytes = {"mysql": 4 * 1024 * 1024, "postgresql": 64 * 1024 * 1024, "sqlite": 64 * 1024 * 1024}
+# 不在括号(子查询)内的order by
+_ORDER_BY_REGEX = re.compile(r"\border\s+by\b(?![^(]*\))", re.IGNORECASE)
+_SELECT_REGEX = re.compile(r"^\s*select(\s+distinct)?\b", re.IGNORECASE)
+
+
+def max_params(dialect):
+    """单条sql语句最多可以绑定的参数个数，未知数据库按1000处理"""
+    if dialect == "sqlite":
+        import sqlite3
+        return 999 if sqlite3.sqlite_version_info < (3, 32) else 32766
+    return _max_params.get(dialect, 1000)
+
+
+def max_statement_bytes(dialect):
+    """单条sql语句(含参数值)的字节数上限，未知数据库按16MB处理"""
+    return statement_bytes.get(dialect, 16 * 1024 * 1024)
+
+
+def upsert_sql(dialect, table, columns, keys):
+    """
+    生成按主键/唯一键存在则更新、不存在则插入的sql
+    sqlite/postgresql: insert ... on conflict
+    mysql: insert ... on duplicate key update
+    oracle/mssql: merge into
+    :param dialect: 数据库类型
+    :param table: 表名
+    :param columns: 写入的字段
+    :param keys: 冲突判断的键字段，需要有主键或唯一约束(mysql按表上的约束判断)
+    """
+    missing = [k for k in keys if k not in columns]
+    if not keys or missing:
+        raise ParameterError(f"upsert的键字段必须包含在写入的字段中: {missing or keys}")
+    updates = [c for c in columns if c not in keys]
+    names = ",".join(columns)
+    values = ",".join(f":{c}" for c in columns)
+    if dialect in ("sqlite", "postgresql"):
+        if updates:
+            action = "do update set " + ",".join(f"{c}=excluded.{c}" for c in updates)
+        else:
+            action = "do nothing"
+        return f"insert into {table} ({names}) values ({values}) on conflict ({','.join(keys)}) {action}"
+    elif dialect == "mysql":
+        assignments = ",".join(f"{c}=values({c})" for c in (updates or keys[:1]))
+        return f"insert into {table} ({names}) values ({values}) on duplicate key update {assignments}"
+    elif dialect in ("oracle", "mssql"):
+        source = ",".join(f":{c} as {c}" for c in columns)
+        if dialect == "oracle":
+            source = f"select {source} from dual"
+        else:
+            source = f"select {source}"
+        sql = f"merge into {table} t using ({source}) s on ({' and '.join(f't.{k}=s.{k}' for k in keys)})"
+        if updates:
+            sql += f" when matched then update set {','.join(f't.{c}=s.{c}' for c in updates)}"
+        sql += f" when not matched then insert ({names}) values ({','.join(f's.{c}' for c in columns)})"
+        # mssql的merge语句必须以分号结尾
+        return sql + ";" if dialect == "mssql" else sql
+    else:
+        raise ParameterError(f"不支持{dialect}数据库的upsert")
+
+
+def limit_sql(dialect, sql, limit):
+    """
+    限制查询返回的行数
+    oracle: fetch first n rows only(12c及以上)
+    mssql: 有order by时使用offset ... fetch next，否则使用select top
+    其他数据库: limit n
+    """
+    limit = int(limit)
+    if dialect == "oracle":
+        return f"{sql} fetch first {limit} rows only"
+    elif dialect == "mssql":
+        if _ORDER_BY_REGEX.search(sql):
+            return f"{sql} offset 0 rows fetch next {limit} rows only"
+        return _SELECT_REGEX.sub(lambda m: f"select{m.group(1) or ''} top {limit}", sql, count=1)
+    return f"{sql} limit {limit}"
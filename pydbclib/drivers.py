@@ -3,16 +3,52 @@
 @time: 2020/3/18 2:36 下午
 @desc:
 """
+import io
+import json
+import re
 import sys
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
-
-from log4py import Logger
-
-from pydbclib.sql import compilers
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial, lru_cache
+
+from pydbclib.dialects import max_params, max_statement_bytes
+from pydbclib.exceptions import ParameterError
+from pydbclib.instrument import Instrumentation
+from pydbclib.log import QueryLog
+from pydbclib.pool import ConnectionPool, ConnectionRecord, ThreadCheckout
+from pydbclib.record import BulkResult
+from pydbclib.sql import compilers, make_getter
+from pydbclib.statements import StatementCache
 from pydbclib.utils import get_suffix, get_dbapi_module
 
 
 class Driver(ABC):
+    query_log = QueryLog(__name__)
+
+    @property
+    def logger(self):
+        return self.query_log.logger
+
+    def _begin(self):
+        """日志或监控开启时返回开始时间，否则返回None"""
+        if self.instrumentation.subscribers or self.query_log.enabled:
+            return time.perf_counter()
+        return None
+
+    def _end(self, start, kind, sql, params, result=None, many=False, label="execute"):
+        """记录日志并触发监控事件，result为游标或影响行数"""
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if self.query_log.enabled:
+            self.query_log.log(elapsed, sql, params, many, label)
+        if self.instrumentation.subscribers:
+            rows = result if isinstance(result, int) else getattr(result, "rowcount", None)
+            self.instrumentation.emit(kind, sql, elapsed, rows if rows is not None and rows >= 0 else None)
 
     @property
     @abstractmethod
@@ -27,11 +63,46 @@ class Driver(ABC):
     def execute_many(self, sql, params=None, **kw):
         pass
 
-    def bulk(self, sql, params):
+    def execute_stream(self, sql, params=None, batch_size=None):
+        """
+        使用服务端游标执行查询，结果分批从服务端拉取，不支持的驱动退化为普通查询
+        返回结果使用完后需要调用close
+        """
+        return self.execute(sql, params)
+
+    @property
+    @abstractmethod
+    def dialect(self):
+        """数据库类型，如 sqlite、mysql、postgresql、oracle、mssql"""
+        pass
+
+    @property
+    @abstractmethod
+    def paramstyle(self):
+        """底层DB-API驱动的参数形式"""
+        pass
+
+    @abstractmethod
+    def raw_cursor(self):
+        """底层DB-API游标的上下文管理器，sql不经过占位符转换直接交给驱动执行"""
+        pass
+
+    def bulk(self, sql, params, strategy=None):
+        """
+        批量写入并提交
+        :param strategy: 指定批量写入方式，默认按数据库类型选择可用的最快方式
+        :return: BulkResult
+        """
         # return self.connection.execute(sql, params).rowcount
-        r = self.execute_many(sql, params)
+        loader = get_bulk_loader(self, sql, strategy)
+        start = self._begin()
+        rowcount = None
+        try:
+            rowcount = loader.load(params)
+        finally:
+            self._end(start, "bulk", sql, params, rowcount, many=True, label=f"bulk({loader.name})")
         self.commit()
-        return r.rowcount
+        return BulkResult(rowcount, loader.name)
 
     @abstractmethod
     def rollback(self):
@@ -45,6 +116,19 @@ class Driver(ABC):
     def close(self):
         pass
 
+    @property
+    def threadsafe(self):
+        """是否支持多个线程各自使用独立的连接"""
+        return False
+
+    def release(self):
+        """归还当前线程占用的连接，未使用连接池时无操作"""
+        pass
+
+    def statement_cache_info(self):
+        """预编译语句缓存的统计信息，未开启或不支持时返回None"""
+        return None
+
 
 class ResultProxy(object):
 
@@ -72,42 +156,150 @@ class ResultProxy(object):
         return [i[0].lower() for i in self.description]
 
 
-@Logger.class_logger()
 class CommonDriver(Driver):
+    """
+    DB-API 驱动封装
+    指定pool_size参数时开启连接池模式，每个线程首次使用时从池中取出一个连接并绑定其游标，
+    调用release或线程结束后归还
+    连接池参数:
+        pool_size: 最大连接数
+        pool_min_size: 最少保持的连接数，默认0
+        pool_timeout: 获取连接的等待超时时间(秒)，默认30
+        pool_pre_ping: 取出连接时是否检测连接可用，默认False
+        pool_recycle: 连接最长使用时间(秒)，默认-1不回收
+    预编译参数:
+        prepared: 是否开启预编译模式，每个连接按sql缓存预编译的游标，重复执行时跳过服务端解析，
+            支持psycopg、mysql.connector、cx_Oracle/oracledb、sqlite3，其他驱动按普通方式执行
+        prepared_cache_size: 每个连接最多缓存的预编译语句数，默认100
+    """
+    query_log = QueryLog(f"{__name__}.CommonDriver")
 
     def __init__(self, *args, **kwargs):
         driver_param = kwargs.pop("driver")
-        self._cursor = None
+        prepared = kwargs.pop("prepared", False)
+        prepared_cache_size = kwargs.pop("prepared_cache_size", 100)
+        pool_size = kwargs.pop("pool_size", None)
+        pool_options = {
+            "min_size": kwargs.pop("pool_min_size", 0),
+            "timeout": kwargs.pop("pool_timeout", 30),
+            "pre_ping": kwargs.pop("pool_pre_ping", False),
+            "recycle": kwargs.pop("pool_recycle", -1),
+        }
+        self.pool = None
+        self._local = threading.local()
         if hasattr(driver_param, "cursor"):
+            if pool_size is not None:
+                raise ParameterError("传入已有连接时不支持连接池模式")
             self.driver_name = get_dbapi_module(driver_param.__class__.__module__)
             self.dbapi = sys.modules[self.driver_name]
-            self.con = driver_param
+            self._record = ConnectionRecord(driver_param)
         else:
             __import__(driver_param)
             self.driver_name = driver_param
             self.dbapi = sys.modules[driver_param]
-            self.con = self.dbapi.connect(*args, **kwargs)
+            if pool_size is None:
+                self._record = ConnectionRecord(self.dbapi.connect(*args, **kwargs))
+            else:
+                self._record = None
+                creator = partial(self.dbapi.connect, *args, **kwargs)
+                self.pool = ConnectionPool(creator, max_size=pool_size, **pool_options)
         self.compiler = compilers[self.dbapi.paramstyle]
+        self.instrumentation = Instrumentation()
+        self.statements = StatementCache(self.driver_name, prepared_cache_size) if prepared else None
+
+    def _get_record(self):
+        if self.pool is None:
+            return self._record
+        checkout = getattr(self._local, "checkout", None)
+        if checkout is None:
+            checkout = ThreadCheckout(self.pool, self.pool.checkout())
+            self._local.checkout = checkout
+        return checkout.record
+
+    @property
+    def con(self):
+        return self._get_record().con
+
+    @property
+    def dialect(self):
+        return dbapi_dialects.get(self.driver_name, self.driver_name)
+
+    @property
+    def threadsafe(self):
+        return self.pool is not None
+
+    @property
+    def paramstyle(self):
+        return self.dbapi.paramstyle
+
+    @contextmanager
+    def raw_cursor(self):
+        yield self.session
 
     @property
     def session(self):
-        if not self._cursor:
-            self._cursor = self.con.cursor()
-        return self._cursor
+        return self._get_record().cursor
+
+    def _compile(self, sql, params, many=False):
+        compiler = self.compiler(sql, params)
+        if not self.instrumentation.subscribers:
+            return compiler.process() if many else compiler.process_one()
+        start = time.perf_counter()
+        compiled = compiler.process() if many else compiler.process_one()
+        self.instrumentation.emit("compile", sql, time.perf_counter() - start)
+        return compiled
 
     def execute(self, sql, params=None, **kw):
-        sql, params = self.compiler(sql, params).process_one()
+        sql, params = self._compile(sql, params)
         params = params if params else []
-        self.logger.info("{}, {}".format(sql, params))
-        self.session.execute(sql, params, **kw)
-        return ResultProxy(self._cursor)
+        start = self._begin()
+        cursor = None
+        try:
+            if self.statements is not None and not kw:
+                statement = self.statements.get(self._get_record(), sql)
+                if statement is not None:
+                    cursor = statement.execute(params)
+                    return statement.bind(ResultProxy(cursor))
+            cursor = self.session
+            cursor.execute(sql, params, **kw)
+            return ResultProxy(cursor)
+        finally:
+            self._end(start, "execute", sql, params, cursor)
 
     def execute_many(self, sql, params=None, **kw):
-        sql, params = self.compiler(sql, params).process()
+        sql, params = self._compile(sql, params, many=True)
         params = params if params else []
-        self.logger.info("{}, {}".format(sql, params))
-        self.session.executemany(sql, params, **kw)
-        return ResultProxy(self._cursor)
+        start = self._begin()
+        cursor = None
+        try:
+            cursor = self.session
+            cursor.executemany(sql, params, **kw)
+            return ResultProxy(cursor)
+        finally:
+            self._end(start, "execute", sql, params, cursor, many=True)
+
+    def execute_stream(self, sql, params=None, batch_size=None):
+        sql, params = self._compile(sql, params)
+        params = params if params else []
+        start = self._begin()
+        cursor = None
+        try:
+            cursor = self._stream_cursor()
+            if batch_size:
+                cursor.arraysize = batch_size
+            cursor.execute(sql, params)
+        finally:
+            self._end(start, "execute", sql, params, cursor, label="stream")
+        return ResultProxy(cursor)
+
+    def _stream_cursor(self):
+        """使用独立的游标，避免流式读取过程中其他语句复用游标冲掉结果"""
+        if self.driver_name in ("pymysql", "MySQLdb"):
+            return self.con.cursor(self.dbapi.cursors.SSCursor)
+        elif self.driver_name == "psycopg2":
+            return self.con.cursor(name=f"pydbclib_{uuid.uuid4().hex}")
+        else:
+            return self.con.cursor()
 
     def rollback(self):
         self.con.rollback()
@@ -115,41 +307,100 @@ class CommonDriver(Driver):
     def commit(self):
         self.con.commit()
 
+    def statement_cache_info(self):
+        if self.statements is None or not self.statements.supported:
+            return None
+        return self.statements.cache_info()
+
+    def release(self):
+        checkout = self._local.__dict__.pop("checkout", None)
+        if checkout is not None:
+            checkout.release()
+
     def close(self):
-        if self.session is not None:
-            self.session.close()
-        if self.con is not None:
-            self.con.close()
+        if self.pool is None:
+            self._record.close()
+        else:
+            self.release()
+            self.pool.dispose()
 
 
-@Logger.class_logger()
 class SQLAlchemyDriver(Driver):
+    """
+    SQLAlchemy 驱动封装，每个线程使用各自的session，连接由engine的连接池管理
+    """
+    query_log = QueryLog(f"{__name__}.SQLAlchemyDriver")
 
     def __init__(self, *args, **kwargs):
         self.driver_name = "sqlalchemy"
         driver_param = kwargs.pop("driver")
-        self._session = None
         from sqlalchemy import engine, create_engine
+        from sqlalchemy.orm import scoped_session, sessionmaker
         if isinstance(driver_param, engine.base.Engine):
             self.engine = driver_param
         else:
             self.engine = create_engine(*args, **kwargs)
+        self._sessions = scoped_session(sessionmaker(bind=self.engine))
+        self.instrumentation = Instrumentation()
 
     @property
     def session(self):
-        if not self._session:
-            from sqlalchemy.orm import sessionmaker
-            self._session = sessionmaker(bind=self.engine)()
-        return self._session
+        return self._sessions()
+
+    @property
+    def threadsafe(self):
+        return True
+
+    def release(self):
+        self._sessions.remove()
+
+    @property
+    def dialect(self):
+        return self.engine.dialect.name
+
+    @property
+    def paramstyle(self):
+        return self.engine.dialect.paramstyle
+
+    @contextmanager
+    def raw_cursor(self):
+        # 使用session当前事务所在的连接，写入和session中的其他操作在同一个事务中
+        cursor = self.session.connection().connection.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
 
     def execute(self, sql, params=None, **kw):
-        self.logger.info("{}, {}".format(sql, params))
-        r = self.session.execute(sql, params, **kw)
-        return ResultProxy(r)
+        start = self._begin()
+        r = None
+        try:
+            r = self.session.execute(sql, params, **kw)
+            return ResultProxy(r)
+        finally:
+            self._end(start, "execute", sql, params, r)
 
     def execute_many(self, sql, params=None, **kw):
-        self.logger.info("{}, {}".format(sql, params))
-        return ResultProxy(self.session.execute(sql, params, **kw))
+        start = self._begin()
+        r = None
+        try:
+            r = self.session.execute(sql, params, **kw)
+            return ResultProxy(r)
+        finally:
+            self._end(start, "execute", sql, params, r, many=True)
+
+    def execute_stream(self, sql, params=None, batch_size=None):
+        from sqlalchemy import text
+        options = {"stream_results": True}
+        if batch_size:
+            options["max_row_buffer"] = batch_size
+        start = self._begin()
+        r = None
+        try:
+            r = self.session.execute(text(sql).execution_options(**options), params)
+            return ResultProxy(r)
+        finally:
+            self._end(start, "execute", sql, params, r, label="stream")
 
     def rollback(self):
         self.session.rollback()
@@ -158,5 +409,275 @@ class SQLAlchemyDriver(Driver):
         self.session.commit()
 
     def close(self):
-        if self.session is not None:
-            self.session.close()
+        self._sessions.remove()
+
+
+# DB-API驱动模块对应的数据库类型
+dbapi_dialects = {
+    "sqlite3": "sqlite",
+    "pymysql": "mysql",
+    "MySQLdb": "mysql",
+    "mysql.connector": "mysql",
+    "psycopg2": "postgresql",
+    "psycopg": "postgresql",
+    "cx_Oracle": "oracle",
+    "oracledb": "oracle",
+    "pymssql": "mssql",
+}
+
+# 位置参数形式的占位符
+positional_placeholders = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+# suffix: upsert语句中 values(...) 之后的 on conflict/on duplicate key update 子句
+InsertStatement = namedtuple("InsertStatement", ["table", "columns", "keys", "suffix"])
+
+_INSERT_REGEX = re.compile(
+    r"^\s*insert\s+into\s+([\w.\"`\[\]]+)\s*\(([^)]*)\)\s*values\s*\(([^)]*)\)"
+    r"\s*(on\s+(?:conflict|duplicate\s+key)\b[^:;]*?)?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+@lru_cache(maxsize=256)
+def parse_insert(sql):
+    """
+    解析简单的 insert into t (a,b) values (:a,:b) 语句(可带不含参数的upsert子句)，无法解析时返回None
+    """
+    match = _INSERT_REGEX.match(sql)
+    if not match:
+        return None
+    columns = [c.strip() for c in match.group(2).split(",")]
+    values = [v.strip() for v in match.group(3).split(",")]
+    if len(columns) != len(values) or not all(re.fullmatch(r":\w+", v) for v in values):
+        return None
+    keys = tuple(v[1:] for v in values)
+    if len(set(keys)) != len(keys):
+        return None
+    return InsertStatement(match.group(1), tuple(columns), keys, match.group(4) or "")
+
+
+_CONFLICT_UPDATE_REGEX = re.compile(r"^on\s+conflict\s*(?:\(([^)]*)\))?[^(]*?\bdo\s+update\b", re.IGNORECASE)
+
+
+def conflict_update_columns(statement):
+    """
+    on conflict (a,b) do update 子句的冲突字段在insert字段中的位置
+    :return: 不是do update时返回()，无法确定冲突字段(如 on constraint)时返回None
+    """
+    match = _CONFLICT_UPDATE_REGEX.match(statement.suffix)
+    if not match:
+        return ()
+    columns = [c.strip() for c in (match.group(1) or "").split(",")]
+    if not all(c in statement.columns for c in columns):
+        return None
+    return tuple(statement.columns.index(c) for c in columns)
+
+
+def rows_to_tuples(rows, keys):
+    """字典记录按占位符顺序转成元组，序列记录原样返回"""
+    if isinstance(rows[0], (list, tuple)):
+        return rows
+    return list(map(make_getter(keys), rows))
+
+
+class BulkLoader(ABC):
+    """
+    批量写入方式
+    name: 方式名称，在BulkResult.strategy中返回
+    dialects: 支持的数据库类型，None表示所有数据库
+    """
+    name = None
+    dialects = None
+
+    def __init__(self, driver, sql, statement):
+        self.driver = driver
+        self.sql = sql
+        self.statement = statement
+
+    @classmethod
+    def supports(cls, driver, statement):
+        return cls.dialects is None or driver.dialect in cls.dialects
+
+    @abstractmethod
+    def load(self, params):
+        """写入一批数据，返回写入行数"""
+        pass
+
+
+class ExecuteManyLoader(BulkLoader):
+    """通用的executemany方式"""
+    name = "executemany"
+
+    def load(self, params):
+        return self.driver.execute_many(self.sql, params).rowcount
+
+
+class MultiValuesLoader(BulkLoader):
+    """
+    insert into t (a,b) values (..),(..) 多行插入方式，按数据库参数个数上限及语句字节数上限分块
+    postgresql的upsert语句每块内按冲突字段去重，冲突字段无法确定时不使用该方式
+    max_bytes: 单条语句的字节数上限，None时取dialects.statement_bytes中对应数据库的配置
+    """
+    name = "multi_values"
+    dialects = {"sqlite", "mysql", "postgresql"}
+    max_rows = 1000
+    max_bytes = None
+
+    @classmethod
+    def supports(cls, driver, statement):
+        return (
+            super().supports(driver, statement)
+            and statement is not None
+            and driver.paramstyle in positional_placeholders
+            and (driver.dialect != "postgresql" or conflict_update_columns(statement) is not None)
+        )
+
+    def __init__(self, driver, sql, statement):
+        super().__init__(driver, sql, statement)
+        # postgresql的on conflict do update不允许一条语句内重复更新同一行，每块内按冲突字段去重，保留最后一条
+        self.conflict_index = conflict_update_columns(statement) if driver.dialect == "postgresql" else ()
+        width = len(statement.columns)
+        self.chunk_size = max(1, min(self.max_rows, max_params(driver.dialect) // width))
+        if self.max_bytes is None:
+            self.max_bytes = max_statement_bytes(driver.dialect)
+        self.row_sql = "(" + ",".join([positional_placeholders[driver.paramstyle]] * width) + ")"
+        self.prefix = f"insert into {statement.table} ({','.join(statement.columns)}) values "
+        self._sql_cache = {}
+
+    def get_sql(self, rows):
+        if rows not in self._sql_cache:
+            sql = self.prefix + ",".join([self.row_sql] * rows)
+            if self.statement.suffix:
+                sql = f"{sql} {self.statement.suffix}"
+            self._sql_cache[rows] = sql
+        return self._sql_cache[rows]
+
+    @staticmethod
+    def row_bytes(row):
+        """按repr的长度估算参数值拼接进sql后的大小(字符串含引号，bytes按转义后的长度)"""
+        text = repr(row)
+        return (len(text) if text.isascii() else len(text.encode())) + 1
+
+    def chunks(self, rows):
+        """
+        按行数上限及估算的语句字节数分块，单行超过上限时单独成块
+        抽样的最宽行按4倍余量计算整块也远低于上限时直接按行数分块，否则逐行估算
+        """
+        limit = self.max_bytes - len(self.get_sql(1)) + len(self.row_sql)
+        step = max(1, len(rows) // 256)
+        widest = max(map(self.row_bytes, rows[::step]), default=0)
+        if widest * 4 * self.chunk_size <= limit:
+            for i in range(0, len(rows), self.chunk_size):
+                yield rows[i:i + self.chunk_size]
+            return
+        start = size = 0
+        for i, row in enumerate(rows):
+            row_bytes = self.row_bytes(row)
+            if i > start and (i - start >= self.chunk_size or size + row_bytes > limit):
+                yield rows[start:i]
+                start, size = i, 0
+            size += row_bytes
+        if start < len(rows):
+            yield rows[start:]
+
+    def load(self, params):
+        rows = rows_to_tuples(params, self.statement.keys)
+        rowcount = 0
+        with self.driver.raw_cursor() as cursor:
+            for chunk in self.chunks(rows):
+                if self.conflict_index:
+                    index = self.conflict_index
+                    chunk = list({tuple(row[i] for i in index): row for row in chunk}.values())
+                cursor.execute(self.get_sql(len(chunk)), [v for row in chunk for v in row])
+                rowcount += cursor.rowcount
+        return rowcount
+
+
+# 数组元素中需要加双引号的字符
+_ARRAY_QUOTE_REGEX = re.compile(r'[{},"\\\s]')
+
+
+class CopyLoader(BulkLoader):
+    """
+    postgresql COPY FROM STDIN 方式，数据先写入内存中的csv缓冲区
+    支持psycopg2(copy_expert)及psycopg3(copy)
+    """
+    name = "copy"
+    dialects = {"postgresql"}
+
+    @classmethod
+    def supports(cls, driver, statement):
+        if not super().supports(driver, statement) or statement is None or statement.suffix:
+            return False
+        with driver.raw_cursor() as cursor:
+            return hasattr(cursor, "copy_expert") or hasattr(cursor, "copy")
+
+    @staticmethod
+    def format_text(value):
+        """非空值按postgresql的文本格式转换，list为数组字面量，dict为json"""
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return "\\x" + bytes(value).hex()
+        elif isinstance(value, list):
+            return CopyLoader.format_array(value)
+        elif isinstance(value, dict):
+            return json.dumps(value)
+        else:
+            return str(value)
+
+    @staticmethod
+    def format_array(values):
+        """数组字面量，如 [1, None, "a b"] => {1,NULL,"a b"}，含特殊字符的元素加双引号并转义"""
+        items = []
+        for value in values:
+            if value is None:
+                items.append("NULL")
+            elif isinstance(value, list):
+                items.append(CopyLoader.format_array(value))
+            else:
+                text = CopyLoader.format_text(value)
+                if not text or text.upper() == "NULL" or _ARRAY_QUOTE_REGEX.search(text):
+                    text = '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                items.append(text)
+        return "{" + ",".join(items) + "}"
+
+    @staticmethod
+    def format_value(value):
+        # csv格式中不加引号的空值表示NULL，加引号的空字符串表示空字符串
+        if value is None:
+            return ""
+        text = value if isinstance(value, str) else CopyLoader.format_text(value)
+        return '"' + text.replace('"', '""') + '"'
+
+    def load(self, params):
+        rows = rows_to_tuples(params, self.statement.keys)
+        sql = f"COPY {self.statement.table} ({','.join(self.statement.columns)}) FROM STDIN WITH (FORMAT csv)"
+        with self.driver.raw_cursor() as cursor:
+            if hasattr(cursor, "copy_expert"):
+                buffer = io.StringIO()
+                fmt = self.format_value
+                buffer.writelines(",".join([fmt(v) for v in row]) + "\n" for row in rows)
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+            else:
+                with cursor.copy(sql.replace("WITH (FORMAT csv)", "")) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+        return len(rows)
+
+
+# 按优先级排列的批量写入方式，可以插入自定义的BulkLoader子类
+bulk_loaders = [CopyLoader, MultiValuesLoader, ExecuteManyLoader]
+
+
+def get_bulk_loader(driver, sql, strategy=None):
+    statement = parse_insert(sql)
+    for loader in bulk_loaders:
+        if strategy is not None and loader.name != strategy:
+            continue
+        if loader.supports(driver, statement):
+            return loader(driver, sql, statement)
+    if strategy is not None:
+        raise ParameterError(f"不支持的批量写入方式: {strategy}")
+    return ExecuteManyLoader(driver, sql, statement)
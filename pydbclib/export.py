@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 查询结果导出csv/tsv文件，不依赖pandas
+每批次记录先用csv模块写入内存缓冲区，再整块写入文件，压缩时也只有每批次一次写入
+"""
+import csv
+import gzip
+import io
+import os
+from collections.abc import Mapping
+
+from pydbclib.exceptions import ParameterError
+from pydbclib.sql import make_getter
+
+_COMPRESSION_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+def infer_compression(file_path, compression):
+    if compression == "infer":
+        return _COMPRESSION_SUFFIXES.get(os.path.splitext(file_path)[1].lower())
+    if compression not in (None, "gzip", "zstd"):
+        raise ParameterError(f"不支持的压缩格式: {compression}")
+    return compression
+
+
+def rotated_path(file_path, index):
+    """
+    按序号生成分卷文件名，file_path包含{}时按format填充序号，否则在第一个扩展名前加序号
+    data.csv.gz => data_00000.csv.gz
+    """
+    if "{" in file_path:
+        return file_path.format(index)
+    directory, name = os.path.split(file_path)
+    stem, dot, extension = name.partition(".")
+    return os.path.join(directory, f"{stem}_{index:05d}{dot}{extension}")
+
+
+class CsvWriter(object):
+    """
+    按批次把记录写入csv文件
+    :param file_path: 文件路径，分卷时为文件名模板
+    :param sep: 分隔符，hive默认\\001
+    :param header: 是否写入表头，也可以是表头名称列表
+    :param columns: 按给定字段(名称或序号)导出
+    :param compression: 压缩格式，gzip、zstd(需要安装zstandard)、None，默认按文件扩展名推断
+    :param rotate_rows: 每个文件最多写入的行数，超出后写入下一个分卷文件，文件名见rotated_path
+    :param encoding: 文件编码
+    :param buffer_size: 文件写入缓冲区大小
+    :param fmtparams: csv.writer的其他参数，如 quoting、lineterminator(默认\\n)
+    """
+
+    def __init__(self, file_path, sep=",", header=False, columns=None, compression="infer", rotate_rows=None,
+                 encoding="utf-8", buffer_size=1024 * 1024, **fmtparams):
+        self.file_path = file_path
+        self.header = header
+        self.columns = None if columns is None else list(columns)
+        self.compression = infer_compression(file_path, compression)
+        self.rotate_rows = rotate_rows
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.paths = []
+        self._text = io.StringIO()
+        fmtparams.setdefault("lineterminator", "\n")
+        self._writer = csv.writer(self._text, delimiter=sep, **fmtparams)
+        self._file = None
+        self._rows = 0
+        self._names = None
+        self._getter = None
+
+    def _open(self, path):
+        if self.compression == "gzip":
+            # 压缩级别6和gzip命令默认一致，比默认的9快很多
+            return gzip.open(path, "wb", compresslevel=6)
+        elif self.compression == "zstd":
+            import zstandard
+            return zstandard.open(path, "wb")
+        return open(path, "wb", buffering=self.buffer_size)
+
+    def _flush(self):
+        self._file.write(self._text.getvalue().encode(self.encoding))
+        self._text.seek(0)
+        self._text.truncate()
+
+    def _next_file(self):
+        if self._file is not None:
+            self._flush()
+            self._file.close()
+        path = rotated_path(self.file_path, len(self.paths)) if self.rotate_rows else self.file_path
+        self._file = self._open(path)
+        self.paths.append(path)
+        self._rows = 0
+        if self.header is True:
+            if self._names:
+                self._writer.writerow(self._names)
+        elif self.header:
+            self._writer.writerow(self.header)
+
+    def _prepare(self, sample, fields):
+        """按第一条记录确定表头及取值方式"""
+        if isinstance(sample, Mapping):
+            self._names = self.columns or list(sample.keys())
+            self._getter = make_getter(self._names)
+        elif self.columns is None:
+            self._names = list(fields) if fields is not None else list(range(len(sample)))
+        else:
+            try:
+                indexes = [c if isinstance(c, int) or fields is None else fields.index(c) for c in self.columns]
+            except ValueError as e:
+                raise ParameterError(f"导出的字段不存在: {e}")
+            self._names = self.columns
+            self._getter = make_getter(indexes)
+
+    def write(self, batches, fields=None):
+        """
+        :param batches: 记录批次的迭代器，记录为元组(按fields排列)或字典
+        :param fields: 元组记录的字段名称
+        :return: 写入的文件路径列表
+        """
+        try:
+            for batch in batches:
+                if not batch:
+                    continue
+                if self._names is None:
+                    self._prepare(batch[0], fields)
+                rows = batch if self._getter is None else list(map(self._getter, batch))
+                offset = 0
+                while offset < len(rows):
+                    if self._file is None or (self.rotate_rows and self._rows >= self.rotate_rows):
+                        self._next_file()
+                    chunk = rows if not self.rotate_rows else rows[offset:offset + self.rotate_rows - self._rows]
+                    self._writer.writerows(chunk)
+                    self._rows += len(chunk)
+                    offset += len(chunk)
+                self._flush()
+            if self._file is None:
+                # 没有记录时也生成文件，字段名称已知时写入表头
+                self._names = self.columns or (list(fields) if fields is not None else [])
+                self._next_file()
+                self._flush()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        return self.paths
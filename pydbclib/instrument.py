@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: sql执行监控
+驱动在sql编译(compile)、执行(execute)、分批取数(fetch)、批量写入(bulk)前后触发事件，
+订阅者为接收QueryEvent的可调用对象，没有订阅者时不计时也不创建事件对象
+
+Example:
+    db.instrumentation.subscribe(lambda event: print(event))
+    db.enable_stats()
+    ...
+    db.stats()  # {"select * from foo where a=?": {"execute": {"count": 10, "p50": 0.0001, ...}, ...}}
+"""
+import math
+import re
+import threading
+from collections import deque, namedtuple
+from functools import lru_cache, partial
+
+# kind: compile/execute/fetch/bulk，elapsed: 耗时(秒)，rows: 返回或影响的行数，bytes: 数据字节数，未知时为None
+QueryEvent = namedtuple("QueryEvent", ["kind", "sql", "elapsed", "rows", "bytes"])
+
+
+class Instrumentation(object):
+    """
+    每个驱动一份的事件分发器
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    @property
+    def enabled(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, subscriber):
+        """添加订阅者，subscriber(event)在执行sql的线程中同步调用，应尽量轻量"""
+        # 复制后替换，分发时不需要加锁
+        self.subscribers = self.subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers = [s for s in self.subscribers if s != subscriber]
+
+    def emit(self, kind, sql, elapsed, rows=None, bytes=None):
+        event = QueryEvent(kind, sql, elapsed, rows, bytes)
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+    def fetch_observer(self, sql):
+        """get_batches的on_fetch回调，没有订阅者时返回None"""
+        return partial(self.emit, "fetch", sql) if self.subscribers else None
+
+
+_NORMALIZE_RULES = [
+    # 字符串常量、各种形式的占位符及数字常量
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"(?<!:):\w+|%\(\w+\)s|%s"), "?"),
+    (re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\s+"), " "),
+    # in (?,?,?) 及多行values (?,?),(?,?) 合并，分块执行的语句归为同一条
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+"), "(?)"),
+    (re.compile(r"(?:when \? then \? ?)+", re.IGNORECASE), "when ? then ? "),
+]
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """去掉常量及占位符差异，得到用于统计的语句"""
+    for regex, replacement in _NORMALIZE_RULES:
+        sql = regex.sub(replacement, sql)
+    return sql.strip()
+
+
+def percentile(samples, p):
+    """已排序样本的最近秩百分位数"""
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+class StatsAggregator(object):
+    """
+    内存中的统计订阅者，按规范化语句及事件类型统计次数、总耗时、行数、字节数及耗时的p50/p95/p99
+    :param max_samples: 每条语句每种事件保留的最近耗时样本数，分位数按这些样本计算
+    :param max_statements: 最多统计的语句数，超出后的语句合并统计到"<other>"
+    """
+
+    def __init__(self, max_samples=1024, max_statements=1000):
+        self.max_samples = max_samples
+        self.max_statements = max_statements
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = normalize_sql(event.sql)
+        with self._lock:
+            kinds = self._data.get(key)
+            if kinds is None:
+                if len(self._data) >= self.max_statements:
+                    key = "<other>"
+                kinds = self._data.setdefault(key, {})
+            entry = kinds.get(event.kind)
+            if entry is None:
+                entry = kinds[event.kind] = {
+                    "count": 0, "total": 0.0, "rows": 0, "bytes": 0, "samples": deque(maxlen=self.max_samples)
+                }
+            entry["count"] += 1
+            entry["total"] += event.elapsed
+            entry["rows"] += event.rows or 0
+            entry["bytes"] += event.bytes or 0
+            entry["samples"].append(event.elapsed)
+
+    def stats(self):
+        """
+        :return: {语句: {事件类型: {"count", "total", "rows", "bytes", "p50", "p95", "p99", "max"}}}，耗时单位为秒
+        """
+        with self._lock:
+            snapshot = {
+                key: {kind: (dict(entry), list(entry["samples"])) for kind, entry in kinds.items()}
+                for key, kinds in self._data.items()
+            }
+        result = {}
+        for key, kinds in snapshot.items():
+            result[key] = {}
+            for kind, (entry, samples) in kinds.items():
+                samples.sort()
+                del entry["samples"]
+                entry.update(
+                    p50=percentile(samples, 50), p95=percentile(samples, 95), p99=percentile(samples, 99),
+                    max=samples[-1]
+                )
+                result[key][kind] = entry
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: sql执行日志
+INFO级别未开启时不计时也不格式化sql和参数，开启后参数列表只输出行数及前几行
+日志记录的extra中带有sql、params、rows、elapsed字段，自定义handler可以直接使用
+
+Example:
+    import logging
+    logging.basicConfig()
+    logging.getLogger("pydbclib").setLevel(logging.INFO)
+"""
+import logging
+
+
+class ParamSummary(object):
+    """
+    参数的摘要，只在日志真正输出时格式化
+    :param params: 单行参数或多行参数列表
+    :param many: params是否为多行参数列表
+    :param max_rows: 多行参数最多输出的行数
+    :param max_length: 输出的最大长度，超出部分截断
+    """
+    __slots__ = ("params", "many", "max_rows", "max_length")
+
+    def __init__(self, params, many=False, max_rows=3, max_length=1000):
+        self.params = params
+        self.many = many
+        self.max_rows = max_rows
+        self.max_length = max_length
+
+    def __str__(self):
+        if self.many:
+            rows = list(self.params[:self.max_rows])
+            text = f"{len(self.params)} rows, first {len(rows)}: {rows!r}"
+        else:
+            text = repr(self.params)
+        if len(text) > self.max_length:
+            text = text[:self.max_length] + f"...({len(text)} chars)"
+        return text
+
+
+class QueryLog(object):
+    """
+    sql执行日志记录器，由Driver._end在语句执行结束(包括失败)后调用log，用法:
+        if query_log.enabled:
+            query_log.log(elapsed, sql, params)
+    :param name: logger名称
+    :param max_rows: 多行参数最多输出的行数
+    :param max_length: 参数输出的最大长度
+    """
+
+    def __init__(self, name, max_rows=3, max_length=1000):
+        self.logger = logging.getLogger(name)
+        self.max_rows = max_rows
+        self.max_length = max_length
+
+    @property
+    def enabled(self):
+        return self.logger.isEnabledFor(logging.INFO)
+
+    def log(self, elapsed, sql, params, many=False, label="execute"):
+        """记录sql、参数摘要及耗时(秒)"""
+        rows = len(params) if many and params is not None else None
+        summary = ParamSummary(params, many, self.max_rows, self.max_length)
+        self.logger.info(
+            "%s %s; params: %s; elapsed: %.3fms", label, sql, summary, elapsed * 1000,
+            extra={"sql": sql, "params": params, "rows": rows, "elapsed": elapsed}
+        )
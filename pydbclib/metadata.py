@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 表结构及sql模板缓存
+"""
+import re
+import threading
+import time
+from collections import namedtuple
+
+TableInfo = namedtuple("TableInfo", ["columns", "types"])
+
+_DDL_REGEX = re.compile(
+    r"\s*(?:create|alter|drop|truncate|rename|comment\s+on)\b"
+    r"(?:.*?\b(?:table|view)\s+(?:if\s+(?:not\s+)?exists\s+)?([\w.\"`\[\]]+))?",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def normalize_name(name):
+    return name.replace('"', "").replace("`", "").replace("[", "").replace("]", "").lower()
+
+
+class MetaData(object):
+    """
+    每个Database一份的表结构及sql模板缓存
+    :param ttl: 表结构缓存有效期(秒)，None表示一直有效，通过Database.execute执行DDL时自动失效
+    :param max_templates: 每张表最多缓存的sql模板数量
+    """
+
+    def __init__(self, ttl=None, max_templates=256):
+        self.ttl = ttl
+        self.max_templates = max_templates
+        self._tables = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get_table(self, name, loader):
+        """
+        获取表结构，缓存不存在或已过期时调用loader()查询
+        :return: TableInfo(columns, types)
+        """
+        cached = self._tables.get(name)
+        if cached is not None and (self.ttl is None or time.monotonic() - cached[0] < self.ttl):
+            return cached[1]
+        info = loader()
+        with self._lock:
+            self._tables[name] = (time.monotonic(), info)
+        return info
+
+    def get_template(self, name, key, builder):
+        """获取表的sql模板，不存在时调用builder()生成"""
+        # 按调用时的表名缓存，热点路径上不做任何字符串处理
+        templates = self._templates.get(name)
+        if templates is not None:
+            sql = templates.get(key)
+            if sql is not None:
+                return sql
+        sql = builder()
+        with self._lock:
+            templates = self._templates.setdefault(name, {})
+            if len(templates) >= self.max_templates:
+                templates.clear()
+            templates[key] = sql
+        return sql
+
+    def invalidate(self, name=None):
+        """清除指定表或所有表的缓存"""
+        with self._lock:
+            if name is None:
+                self._tables.clear()
+                self._templates.clear()
+            else:
+                key = normalize_name(name)
+                for cache in (self._tables, self._templates):
+                    for cached_name in [n for n in cache if normalize_name(n) == key]:
+                        del cache[cached_name]
+
+    def invalidate_ddl(self, sql):
+        """sql为DDL语句时清除相关表的缓存，无法识别表名时清除全部"""
+        match = _DDL_REGEX.match(sql)
+        if match is None:
+            return False
+        self.invalidate(match.group(1))
+        return True
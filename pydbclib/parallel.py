@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 多连接并行读写
+工作线程各自使用独立的连接(CommonDriver需开启连接池，SQLAlchemyDriver每个线程使用独立的session)，
+线程结束前归还连接
+"""
+import threading
+from queue import Queue, Full
+
+from pydbclib.exceptions import ParameterError
+from pydbclib.record import BulkResult, BatchError
+
+
+def check_threadsafe(db):
+    if not db.driver.threadsafe:
+        raise ParameterError("并行模式需要多个连接，CommonDriver请通过pool_size参数开启连接池")
+
+
+def parallel_bulk(db, load, batches, workers):
+    """
+    多个连接并行写入，生产者通过有界队列分发批次，迭代器输入时内存占用不随数据量增长
+    :param db: Database
+    :param load: 写入并提交一批数据的函数，返回BulkResult
+    :param batches: 批次数据迭代器
+    :param workers: 并行连接数
+    :return: BulkResult，batches为每批次写入行数，errors为失败批次
+    """
+    check_threadsafe(db)
+    queue = Queue(maxsize=workers * 2)
+    rowcounts = {}
+    errors = []
+    strategies = set()
+
+    def work():
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    return
+                index, offset, batch = item
+                try:
+                    r = load(batch)
+                except Exception as e:
+                    db.rollback()
+                    errors.append(BatchError(index, offset, len(batch), e))
+                else:
+                    rowcounts[index] = int(r)
+                    strategies.add(r.strategy)
+        finally:
+            db.release()
+
+    threads = [threading.Thread(target=work, name=f"pydbclib-bulk-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    index = offset = 0
+    try:
+        for batch in batches:
+            queue.put((index, offset, batch))
+            index += 1
+            offset += len(batch)
+    finally:
+        for _ in threads:
+            queue.put(None)
+        for t in threads:
+            t.join()
+    strategy = strategies.pop() if len(strategies) == 1 else ",".join(sorted(strategies)) or None
+    return BulkResult(
+        sum(rowcounts.values()), strategy,
+        batches=[rowcounts.get(i) for i in range(index)],
+        errors=sorted(errors, key=lambda e: e.index)
+    )
+
+
+def split_range(low, high, partitions):
+    """
+    把[low, high]等分成partitions个区间，返回区间分割点，支持整数、浮点数、Decimal及日期时间
+    """
+    if partitions < 2 or low is None or high is None or not low < high:
+        return []
+    if isinstance(low, int) and isinstance(high, int):
+        cuts = [low + (high - low) * i // partitions for i in range(1, partitions)]
+    else:
+        try:
+            cuts = [low + (high - low) * i / partitions for i in range(1, partitions)]
+        except TypeError:
+            raise ParameterError(f"无法按{type(low).__name__}类型划分区间，请通过bounds参数指定数值或日期类型的边界")
+    return sorted(set(c for c in cuts if low < c <= high))
+
+
+def range_conditions(key, cuts):
+    """
+    按分割点生成各分区的查询条件及参数，第一个分区包含空值，首尾分区不设边界以覆盖bounds之外的数据
+    """
+    if not cuts:
+        return [("", {})]
+    conditions = [(f"{key} < :k0 or {key} is null", {"k0": cuts[0]})]
+    for i in range(1, len(cuts)):
+        conditions.append((f"{key} >= :k0 and {key} < :k1", {"k0": cuts[i - 1], "k1": cuts[i]}))
+    conditions.append((f"{key} >= :k0", {"k0": cuts[-1]}))
+    return conditions
+
+
+def parallel_read(db, queries, batch_size=10000, ordered=False, **kwargs):
+    """
+    多个连接并行执行查询，合并成一个记录迭代器
+    :param queries: [(sql, params)]，每个查询在独立的线程和连接上执行
+    :param ordered: 是否按查询顺序返回记录，否则按各查询返回的先后顺序
+    :param kwargs: 传给Database.read的其他参数
+    """
+    check_threadsafe(db)
+    stop = threading.Event()
+    if ordered:
+        queues = [Queue(maxsize=2) for _ in queries]
+    else:
+        queues = [Queue(maxsize=len(queries) * 2)] * len(queries)
+
+    def put(queue, item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def work(queue, sql, params):
+        try:
+            records = db.read(sql, params, batch_size=batch_size, **kwargs)
+            while True:
+                rows = records.get(batch_size)
+                if not rows or not put(queue, ("rows", rows)):
+                    break
+            put(queue, ("done", None))
+        except Exception as e:
+            put(queue, ("error", e))
+        finally:
+            db.release()
+
+    def merge():
+        threads = [
+            threading.Thread(target=work, args=(q, sql, params), name=f"pydbclib-read-{i}", daemon=True)
+            for i, (q, (sql, params)) in enumerate(zip(queues, queries))
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for queue in (queues if ordered else queues[:1]):
+                running = 1 if ordered else len(queries)
+                while running:
+                    kind, value = queue.get()
+                    if kind == "rows":
+                        yield from value
+                    elif kind == "done":
+                        running -= 1
+                    else:
+                        raise value
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    return merge()
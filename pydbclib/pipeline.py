@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 多进程ETL管道，Records.pipe_to 的实现
+读取线程分批取数，进程池按批次执行map/filter操作链，转换后的记录由Table.bulk写入目标表，
+提交给进程池的批次数有上限，写入跟不上时读取线程等待，内存占用不随数据量增长
+"""
+import itertools
+import logging
+import os
+import pickle
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from pydbclib.exceptions import ParameterError
+from pydbclib.utils import Row, batches_to_records
+
+logger = logging.getLogger(__name__)
+
+PipeProgress = namedtuple("PipeProgress", ["batches", "rows_in", "rows_out", "elapsed", "rows_per_sec"])
+
+
+def apply_ops(records, ops):
+    """按顺序执行map/filter操作链"""
+    for kind, function in ops:
+        records = map(function, records) if kind == "map" else filter(function, records)
+    return list(records)
+
+
+def transform(batch, ops, columns=None, compact=False):
+    """
+    转换一批记录，在工作进程中执行
+    :param columns: 不为None时batch为查询返回的原始元组记录，先按字段名称转换成字典或Row
+    """
+    if columns is not None:
+        batch = batches_to_records([batch], columns, compact)
+    records = apply_ops(batch, ops)
+    if compact:
+        # Row的类型在工作进程中动态生成，不能传回主进程
+        records = [dict(r) if isinstance(r, Row) else r for r in records]
+    return records
+
+
+def log_progress(progress):
+    logger.info(
+        "pipe %d batches, %d rows in, %d rows out, %.1fs, %.0f rows/s", progress.batches, progress.rows_in,
+        progress.rows_out, progress.elapsed, progress.rows_per_sec
+    )
+
+
+class Pipeline(object):
+    """
+    :param batches: 待转换的记录批次迭代器
+    :param ops: map/filter操作链，[("map", function), ("filter", function)]
+    :param columns: batches为原始元组记录时的字段名称
+    :param compact: 原始记录是否转换成Row对象
+    :param workers: 转换的进程数，默认为cpu核数
+    :param ordered: 是否按读取顺序输出转换后的批次
+    :param executor: process 进程池，thread 线程池(转换函数释放GIL或不能pickle时使用)
+    :param progress: 每批次转换完成后的回调函数，参数为PipeProgress；为True时输出INFO日志
+    """
+
+    def __init__(self, batches, ops, columns=None, compact=False, workers=None, ordered=True,
+                 executor="process", progress=None):
+        if executor not in ("process", "thread"):
+            raise ParameterError(f"不支持的executor: {executor}")
+        if executor == "process":
+            try:
+                pickle.dumps(ops)
+            except Exception as e:
+                raise ParameterError(
+                    f"map/filter的函数需要可以pickle(模块级函数)才能在进程池中执行，或者使用executor='thread': {e}"
+                ) from None
+        self.batches = batches
+        self.ops = ops
+        self.columns = columns
+        self.compact = compact
+        self.workers = workers or os.cpu_count() or 1
+        self.ordered = ordered
+        self.executor = executor
+        self.progress = log_progress if progress is True else progress
+        self.batches_done = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.start = None
+
+    def _report(self, records):
+        self.batches_done += 1
+        self.rows_out += len(records)
+        if self.progress is not None:
+            elapsed = time.perf_counter() - self.start
+            self.progress(PipeProgress(
+                self.batches_done, self.rows_in, self.rows_out, elapsed, self.rows_out / elapsed if elapsed else 0.0
+            ))
+
+    def __iter__(self):
+        """转换后的记录批次"""
+        self.start = time.perf_counter()
+        if not self.ops:
+            # 没有转换操作时在当前线程转换成字典，不经过进程池
+            for batch in self.batches:
+                self.rows_in += len(batch)
+                if self.columns is not None:
+                    batch = list(batches_to_records([batch], self.columns))
+                self._report(batch)
+                if batch:
+                    yield batch
+            return
+        pool_class = ProcessPoolExecutor if self.executor == "process" else ThreadPoolExecutor
+        with pool_class(max_workers=self.workers) as pool:
+            pending = deque()
+            window = self.workers * 2
+            batches = iter(self.batches)
+            exhausted = False
+            while True:
+                # 最多有window个批次在转换或等待写入，写入跟不上时读取线程在这里等待
+                while not exhausted and len(pending) < window:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    self.rows_in += len(batch)
+                    pending.append(pool.submit(transform, batch, self.ops, self.columns, self.compact))
+                if not pending:
+                    return
+                if self.ordered:
+                    done = [pending.popleft()]
+                else:
+                    finished = wait(pending, return_when=FIRST_COMPLETED).done
+                    done = [f for f in pending if f in finished]
+                    for future in done:
+                        pending.remove(future)
+                for future in done:
+                    records = future.result()
+                    self._report(records)
+                    if records:
+                        yield records
+
+
+def pipe(batches, table, ops, columns=None, compact=False, workers=None, ordered=True, writers=None,
+         batch_size=10000, strategy=None, executor="process", progress=None):
+    """
+    转换批次数据并写入目标表
+    :return: Table.bulk 的BulkResult
+    """
+    batches = iter(Pipeline(batches, ops, columns, compact, workers, ordered, executor, progress))
+    # 先取第一批，进程池在写入线程启动前创建好
+    first = next(batches, [])
+    records = itertools.chain(first, itertools.chain.from_iterable(batches))
+    return table.bulk(records, batch_size=batch_size, strategy=strategy, parallel=writers)
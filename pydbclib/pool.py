@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: CommonDriver 使用的线程安全连接池
+"""
+import threading
+import time
+import weakref
+from collections import deque
+
+from pydbclib.exceptions import ConnectError, ParameterError
+
+
+class ConnectionRecord(object):
+    """
+    连接及其绑定的游标
+    statements: 开启预编译模式时该连接上缓存的预编译语句(LRUCache)
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.created_at = time.monotonic()
+        self.statements = None
+        self._cursor = None
+
+    @property
+    def cursor(self):
+        if not self._cursor:
+            self._cursor = self.con.cursor()
+        return self._cursor
+
+    def ping(self):
+        if hasattr(self.con, "ping"):
+            self.con.ping()
+        else:
+            cursor = self.cursor
+            cursor.execute("select 1")
+            cursor.fetchall()
+
+    def close(self):
+        try:
+            if self.statements is not None:
+                self.statements.clear()
+            if self._cursor is not None:
+                self._cursor.close()
+        finally:
+            self.statements = None
+            self._cursor = None
+            self.con.close()
+
+
+class ThreadCheckout(object):
+    """线程持有的连接，线程结束被回收时自动归还连接池"""
+
+    def __init__(self, pool, record):
+        self.record = record
+        self.release = weakref.finalize(self, pool.checkin, record)
+
+
+class ConnectionPool(object):
+    """
+    连接池
+    :param creator: 创建DB-API连接的函数
+    :param min_size: 最少保持的连接数，创建连接池时预先建立
+    :param max_size: 最大连接数
+    :param timeout: 连接全部被占用时获取连接的等待超时时间(秒)
+    :param pre_ping: 取出连接时是否先检测连接是否可用
+    :param recycle: 连接最长使用时间(秒)，超过后取出时重建连接，小于0表示不回收
+    """
+
+    def __init__(self, creator, min_size=0, max_size=5, timeout=30, pre_ping=False, recycle=-1):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ParameterError("连接池大小参数无效")
+        self.creator = creator
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.recycle = recycle
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        for _ in range(min_size):
+            self._idle.append(ConnectionRecord(self.creator()))
+            self._size += 1
+
+    def checkout(self):
+        """取出一个连接，没有空闲连接且已达上限时等待其他线程归还"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ConnectError("连接池已关闭")
+                if self._idle:
+                    record = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    record = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise ConnectError(f"获取连接超时({self.timeout}s), 连接池已满: {self.max_size}")
+                self._cond.wait(remaining)
+            self._in_use += 1
+        try:
+            record = self._prepare(record)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return record
+
+    def _prepare(self, record):
+        if record is None:
+            return ConnectionRecord(self.creator())
+        if 0 <= self.recycle < time.monotonic() - record.created_at:
+            self._discard(record)
+            return ConnectionRecord(self.creator())
+        if self.pre_ping:
+            try:
+                record.ping()
+            except Exception:
+                self._discard(record)
+                return ConnectionRecord(self.creator())
+        return record
+
+    @staticmethod
+    def _discard(record):
+        try:
+            record.close()
+        except Exception:
+            pass
+
+    def checkin(self, record):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            record.con.rollback()
+        except Exception:
+            self._discard(record)
+            record = None
+        with self._cond:
+            self._in_use -= 1
+            if record is None:
+                self._size -= 1
+            elif self._closed:
+                self._size -= 1
+                self._discard(record)
+            else:
+                self._idle.append(record)
+            self._cond.notify()
+
+    def dispose(self):
+        """关闭连接池及所有空闲连接，使用中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+                self._size -= 1
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_time": self._wait_time,
+                "max_wait": self._max_wait,
+            }
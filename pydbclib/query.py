@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: Table.find 返回的延迟查询
+执行前调用的 where/fields/order_by/limit 合并到select语句中由数据库处理，
+map、函数形式的filter、迭代及取数等其他操作时才执行查询，之后与Records的用法相同
+"""
+from pydbclib.dialects import limit_sql
+from pydbclib.exceptions import ParameterError
+
+
+class Query(object):
+    """
+    延迟执行的表查询
+    Example:
+        table.find({"a": 1}).where("b > 0").order_by("b desc").fields("a", "b").limit(10).get_all()
+        => select a,b from foo where a=:c0 and (b > 0) order by b desc limit 10
+    :param table: Table对象
+    :param condition: 查询条件，字典类型或者sql条件表达式
+    :param fields: 返回的字段
+    :param options: Database.read 的其他参数，如 batch_size、stream、compact
+    """
+
+    def __init__(self, table, condition=None, fields=None, **options):
+        self.table = table
+        self._conditions = []
+        self._fields = None if fields is None else tuple(fields)
+        self._order_by = ()
+        self._limit = None
+        self._options = options
+        self._records = None
+        if condition:
+            self.where(condition)
+
+    def _pending(self, operation):
+        if self._records is not None:
+            raise ParameterError(f"查询已开始执行，不能再调用{operation}")
+
+    def where(self, condition=None, **equals):
+        """
+        追加查询条件，多次调用按and组合
+        :param condition: 字典类型的等值条件或sql条件表达式
+        :param equals: 关键字参数形式的等值条件，如 where(a=1, b="x")
+        """
+        if isinstance(condition, dict) or condition is None:
+            condition = {**(condition or {}), **equals}
+            if not condition:
+                return self
+            if self._records is not None or self._limit is not None:
+                # 已执行或已限制行数时不能再下推，在客户端过滤
+                items = list(condition.items())
+                return self._execute().filter(lambda r: all(r[k] == v for k, v in items))
+            self._conditions.append(condition)
+        else:
+            self._pending("where")
+            if equals:
+                raise ParameterError("sql条件表达式不能与关键字参数同时使用")
+            if self._limit is not None:
+                raise ParameterError("limit之后不能再追加sql条件表达式")
+            self._conditions.append(condition)
+        return self
+
+    def filter(self, function):
+        """字典类型的等值条件下推到sql中，函数在客户端过滤"""
+        if isinstance(function, dict):
+            return self.where(function)
+        return self._execute().filter(function)
+
+    def fields(self, *names):
+        """指定返回的字段，fields("a", "b") 或 fields(["a", "b"])"""
+        self._pending("fields")
+        if len(names) == 1 and not isinstance(names[0], str):
+            names = names[0]
+        self._fields = tuple(names) or None
+        return self
+
+    def order_by(self, *keys):
+        """排序字段，如 order_by("a", "b desc")"""
+        self._pending("order_by")
+        if self._limit is not None:
+            raise ParameterError("limit之后不能再调用order_by")
+        if len(keys) == 1 and not isinstance(keys[0], str):
+            keys = keys[0]
+        self._order_by = tuple(keys)
+        return self
+
+    def limit(self, num):
+        if self._records is not None:
+            return self._records.limit(num)
+        self._limit = num if self._limit is None else min(self._limit, num)
+        return self
+
+    def get_sql(self):
+        """生成的sql语句及参数"""
+        param = {}
+        shape = []
+        for condition in self._conditions:
+            if isinstance(condition, dict):
+                shape.append(tuple(condition))
+                param.update((f"c{len(param)}", v) for v in condition.values())
+            else:
+                shape.append(condition)
+        key = ("query", self._fields, tuple(shape), self._order_by)
+        sql = self.table.db.metadata.get_template(self.table.name, key, self._format)
+        if self._limit is not None:
+            sql = limit_sql(self.table.db.driver.dialect, sql, self._limit)
+        return sql, param
+
+    def _format(self):
+        expressions = []
+        index = 0
+        for condition in self._conditions:
+            if isinstance(condition, dict):
+                expressions.extend(f"{k}=:c{index + i}" for i, k in enumerate(condition))
+                index += len(condition)
+            else:
+                expressions.append(f"({condition})" if len(self._conditions) > 1 else condition)
+        sql = f"select {'*' if self._fields is None else ','.join(self._fields)} from {self.table.name}"
+        if expressions:
+            sql += f" where {' and '.join(expressions)}"
+        if self._order_by:
+            sql += f" order by {','.join(self._order_by)}"
+        return sql
+
+    def _execute(self):
+        if self._records is None:
+            sql, param = self.get_sql()
+            self._records = self.table.db.read(sql, param, **self._options)
+        return self._records
+
+    def map(self, function):
+        return self._execute().map(function)
+
+    def rename(self, mapper):
+        return self._execute().rename(mapper)
+
+    def __iter__(self):
+        return self._execute()
+
+    def __next__(self):
+        return next(self._execute())
+
+    next = __next__
+
+    def __getattr__(self, name):
+        # get/get_all/to_df/stats等其他属性由执行后的Records提供
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._execute(), name)
+
+    def __repr__(self):
+        return f"Query({self.get_sql()[0]!r})"
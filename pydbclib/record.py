@@ -3,7 +3,20 @@
 @time: 2020/4/13 11:28 下午
 @desc:
 """
+import inspect
 import itertools
+from collections.abc import Mapping
+from operator import itemgetter
+
+from pydbclib.exceptions import ParameterError
+from pydbclib.export import CsvWriter
+from pydbclib.utils import batch_dataset, batches_to_columns
+
+# engine="csv"时可以使用的其他参数(csv.writer的格式参数及CsvWriter的参数)
+_CSV_PARAMS = {
+    "dialect", "doublequote", "escapechar", "lineterminator", "quotechar", "quoting", "skipinitialspace", "strict",
+    "encoding", "buffer_size"
+}
 
 
 def to_df_iterator(records, batch_size):
@@ -16,12 +29,58 @@ def to_df_iterator(records, batch_size):
             return None
 
 
+def columns_to_df(arrays, columns):
+    import pandas
+    df = pandas.DataFrame(dict(enumerate(arrays)), columns=range(len(arrays)))
+    if columns is not None:
+        df.columns = columns
+    return df
+
+
+def to_df_columnar_iterator(batches, batch_size, width, columns):
+    rows = itertools.chain.from_iterable(batches)
+    for batch in batch_dataset(rows, batch_size):
+        yield columns_to_df(batches_to_columns([batch], width), columns)
+
+
 class Records(object):
+    """
+    查询结果
+    :param rows: 记录迭代器
+    :param as_dict: 记录是否为字典形式
+    :param batches: 按批次返回原始元组记录的迭代器，rows由它生成；
+        rows未开始迭代且未做map/filter等加工时，to_df/to_arrow直接按列读取，不再逐行构建字典
+    :param columns: 查询结果字段名称
+    :param stats: 读取统计，如 {"batches": 3, "rows": 25000, "batch_sizes": [10000, 10000, 10000, 10000]}
+    :param compact: rows是否为batches生成的Row对象
+    :param types: 查询结果字段类型，即cursor.description中的type_code
+    """
 
-    def __init__(self, rows, as_dict):
+    def __init__(self, rows, as_dict, batches=None, columns=None, stats=None, compact=False, types=None):
         self._rows = rows
         self.as_dict = as_dict
         self._limit_num = None
+        self._batches = batches
+        self.columns = columns
+        self.stats = {} if stats is None else stats
+        self.compact = compact
+        self.types = types
+        # map/filter操作链及其输入，pipe_to在进程池中执行操作链
+        self._source = rows
+        self._source_batches = batches
+        self._ops = []
+
+    def _raw_batches(self):
+        """原始批次数据是否还可以直接使用"""
+        if self._batches is None or self.columns is None:
+            return None
+        if inspect.isgenerator(self._rows) and inspect.getgeneratorstate(self._rows) != inspect.GEN_CREATED:
+            return None
+        return self._batches
+
+    def _df_columns(self):
+        # 非字典形式的记录保持原有的数字列名
+        return self.columns if self.as_dict else None
 
     def __iter__(self):
         return self
@@ -32,23 +91,22 @@ class Records(object):
     __next__ = next
 
     def map(self, function):
+        self._batches = None
         self._rows = (function(r) for r in self._rows)
+        self._ops.append(("map", function))
         return self
 
     def filter(self, function):
+        self._batches = None
         self._rows = (r for r in self._rows if function(r))
+        self._ops.append(("filter", function))
         return self
 
     def rename(self, mapper):
         """
         字段重命名
         """
-        def function(record):
-            if isinstance(record, dict):
-                return {mapper.get(k, k): v for k, v in record.items()}
-            else:
-                return dict(zip(mapper, record))
-        return self.map(function)
+        return self.map(Renamer(mapper))
 
     def limit(self, num):
         def rows_limited(rows, limit):
@@ -57,9 +115,60 @@ class Records(object):
                     yield r
                 else:
                     return None
+        self._batches = None
         self._rows = rows_limited(self._rows, num)
+        # limit之前的操作在读取线程中执行
+        self._source = self._rows
+        self._source_batches = None
+        self._ops = []
         return self
 
+    def pipe_to(self, table, workers=None, batch_size=10000, ordered=True, writers=None, strategy=None,
+                executor="process", progress=None):
+        """
+        ETL管道，读取线程分批取数，进程池按批次执行map/filter操作链，转换后的记录批量写入目标表
+        Example:
+            db.read("select * from foo").map(transform).pipe_to(dst.get_table("bar"), workers=4, writers=2)
+        :param table: 目标表，Table对象
+        :param workers: 执行操作链的进程数，默认为cpu核数
+        :param batch_size: 每批次转换及写入的行数
+        :param ordered: 是否按读取顺序写入，writers大于1时各连接之间仍然是并行写入
+        :param writers: 并行写入的连接数，见Table.bulk的parallel参数，默认在当前线程写入
+        :param strategy: 批量写入方式
+        :param executor: process 进程池(map/filter的函数需要可以pickle，即模块级函数)，thread 线程池
+        :param progress: 每批次转换完成后的回调函数，参数为PipeProgress(batches, rows_in, rows_out,
+            elapsed, rows_per_sec)；为True时输出INFO日志
+        :return: BulkResult
+        """
+        from pydbclib.pipeline import pipe
+        source = self._source
+        started = inspect.isgenerator(source) and inspect.getgeneratorstate(source) != inspect.GEN_CREATED
+        if self._source_batches is not None and self.as_dict and self.columns is not None and not started:
+            # 原始元组记录在工作进程中转换成字典，读取线程不逐行构建字典
+            batches = batch_dataset(itertools.chain.from_iterable(self._source_batches), batch_size)
+            columns = self.columns
+        else:
+            batches = batch_dataset(source, batch_size)
+            columns = None
+        return pipe(batches, table, self._ops, columns, self.compact, workers, ordered, writers, batch_size,
+                    strategy, executor, progress)
+
+    def paginate(self, page_size, key=None):
+        """
+        按页返回记录，每页为Page列表，最多page_size条
+        :param key: 键字段名称或列表，指定后每页的last_key为该页最后一条记录的键值，
+            保存后可以通过Table.iter_pages(last_key=...)从该位置继续读取
+        :return: Page生成器
+        """
+        getter = None if key is None else key_getter(key)
+        while True:
+            rows = list(itertools.islice(self._rows, page_size))
+            if not rows:
+                return
+            yield Page(rows, getter(rows[-1]) if getter else None)
+            if len(rows) < page_size:
+                return
+
     def get_one(self):
         r = self.get(1)
         return r[0] if len(r) > 0 else None
@@ -71,23 +180,171 @@ class Records(object):
         return [r for r in self._rows]
 
     def to_df(self, batch_size=None):
+        batches = self._raw_batches()
+        if batches is not None:
+            width = len(self.columns)
+            if batch_size is None:
+                return columns_to_df(batches_to_columns(batches, width), self._df_columns())
+            else:
+                return to_df_columnar_iterator(batches, batch_size, width, self._df_columns())
         if batch_size is None:
             import pandas
             return pandas.DataFrame.from_records(self)
         else:
             return to_df_iterator(self, batch_size)
 
-    def to_csv(self, file_path, sep=',', header=False, columns=None, batch_size=100000, **kwargs):
+    def to_arrow(self):
+        """转换成pyarrow.Table，需要安装pyarrow"""
+        import pyarrow
+        batches = self._raw_batches()
+        if batches is not None:
+            arrays = batches_to_columns(batches, len(self.columns))
+            return pyarrow.Table.from_arrays([pyarrow.array(a) for a in arrays], names=self.columns)
+        rows = self.get_all()
+        if rows and isinstance(rows[0], Mapping):
+            return pyarrow.Table.from_pylist([r if isinstance(r, dict) else dict(r) for r in rows])
+        names = self.columns or [str(i) for i in range(len(rows[0]) if rows else 0)]
+        arrays = batches_to_columns([rows], len(names))
+        return pyarrow.Table.from_arrays([pyarrow.array(a) for a in arrays], names=names)
+
+    def to_numpy(self, dtypes=None, structured=False, batch_size=10000):
+        """
+        转换成按列的numpy数组，需要安装numpy
+        rows未开始迭代且未做map/filter等加工时，按列直接从查询返回的元组写入预分配的数组
+        :param dtypes: 指定字段类型，单个类型、按字段顺序的列表或{字段名: 类型}，
+            未指定的字段按cursor.description的类型或第一批数据推断
+        :param structured: 是否返回结构化数组
+        :param batch_size: 加工后的记录每批次写入的行数
+        :return: {字段名: ndarray}，structured为True时返回结构化数组
+        """
+        from pydbclib.arrays import arrays_to_structured, batches_to_arrays
+        batches = self._raw_batches()
+        if batches is not None:
+            names = self.columns if self.as_dict else list(range(len(self.columns)))
+            arrays = batches_to_arrays(batches, names, dtypes=dtypes, type_codes=self.types)
+        else:
+            batches = batch_dataset(self._rows, batch_size)
+            first = next(batches, [])
+            if first and isinstance(first[0], Mapping):
+                names = list(first[0].keys())
+                getters = [itemgetter(n) for n in names]
+            else:
+                width = len(first[0]) if first else len(self.columns or ())
+                names = self.columns if self.columns and len(self.columns) == width else list(range(width))
+                getters = [itemgetter(i) for i in range(width)]
+            arrays = batches_to_arrays(itertools.chain([first], batches), names, getters, dtypes)
+        return arrays_to_structured(arrays) if structured else arrays
+
+    def to_csv(self, file_path, sep=',', header=False, columns=None, batch_size=100000, engine=None,
+               compression="infer", rotate_rows=None, **kwargs):
         """
         用于大数据量分批写入文件
-        :param file_path: 文件路径
+        :param file_path: 文件路径，rotate_rows分卷时为文件名模板，见export.rotated_path
         :param sep: 分割符号，hive默认\001
         :param header: 是否写入表头
         :param columns: 按给定字段排序
         :param batch_size: 每批次写入文件行数
+        :param engine: csv: 使用csv模块直接写入; pandas: 每批次转换成DataFrame后写入，kwargs传给DataFrame.to_csv
+            默认为csv，kwargs中有csv.writer不支持的参数(如 na_rep、float_format、date_format)时为pandas
+        :param compression: 压缩格式，gzip、zstd、None，默认按文件扩展名推断(.gz/.zst)
+        :param rotate_rows: 每个文件最多写入的行数
+        :param kwargs: csv.writer的其他参数，如 quoting、lineterminator、encoding
+        :return: 写入的文件路径列表
         """
-        mode = "w"
-        for df in self.to_df(batch_size=batch_size):
-            df.to_csv(file_path, sep=sep, index=False, header=header, columns=columns, mode=mode, **kwargs)
-            mode = "a"
-            header = False
+        unknown = sorted(set(kwargs) - _CSV_PARAMS)
+        if engine is None:
+            engine = "pandas" if unknown else "csv"
+        elif engine == "csv" and unknown:
+            raise ParameterError(f"engine='csv'不支持参数{unknown}，pandas的DataFrame.to_csv参数需要使用engine='pandas'")
+        if engine == "pandas":
+            if rotate_rows:
+                raise ParameterError("pandas方式不支持rotate_rows")
+            mode = "w"
+            if compression != "infer":
+                kwargs["compression"] = compression
+            for df in self.to_df(batch_size=batch_size):
+                df.to_csv(file_path, sep=sep, index=False, header=header, columns=columns, mode=mode, **kwargs)
+                mode = "a"
+                header = False
+            return [file_path]
+        elif engine != "csv":
+            raise ParameterError(f"不支持的engine: {engine}")
+        writer = CsvWriter(file_path, sep, header, columns, compression, rotate_rows, **kwargs)
+        batches = self._raw_batches()
+        if batches is not None:
+            # 直接写出游标返回的元组，不构建字典
+            return writer.write(batches, self.columns)
+        return writer.write(batch_dataset(self, batch_size), self.columns if not self.as_dict else None)
+
+
+class Renamer(object):
+    """字段重命名函数，可以pickle后在其他进程中执行"""
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+    def __call__(self, record):
+        if isinstance(record, Mapping):
+            return {self.mapper.get(k, k): v for k, v in record.items()}
+        else:
+            return dict(zip(self.mapper, record))
+
+
+def key_getter(key):
+    """按键字段取值，单个字段返回值本身，多个字段返回元组"""
+    if isinstance(key, str):
+        return lambda record: record[key]
+    key = tuple(key)
+    return lambda record: tuple(record[k] for k in key)
+
+
+class Page(list):
+    """
+    分页读取的一页记录
+    :param last_key: 该页最后一条记录的键值，用于续读下一页
+    """
+
+    def __init__(self, rows, last_key=None):
+        super().__init__(rows)
+        self.last_key = last_key
+
+    def __repr__(self):
+        return f"Page({len(self)} rows, last_key={self.last_key!r})"
+
+
+class BulkResult(int):
+    """
+    批量写入结果，数值为写入的总行数
+    :param strategy: 使用的批量写入方式，如 copy、multi_values、executemany
+    :param batches: 每批次写入的行数，失败的批次为None
+    :param errors: 失败批次的BatchError列表，按批次顺序排列
+    """
+
+    def __new__(cls, rowcount, strategy=None, batches=None, errors=None):
+        obj = super().__new__(cls, rowcount)
+        obj.strategy = strategy
+        obj.batches = [] if batches is None else batches
+        obj.errors = [] if errors is None else errors
+        return obj
+
+    def __repr__(self):
+        return f"BulkResult({int(self)}, strategy={self.strategy!r}, errors={len(self.errors)})"
+
+
+class BatchError(object):
+    """
+    批量写入失败的批次
+    :param index: 批次序号
+    :param offset: 批次第一条记录在输入数据中的位置，从该位置重新写入即可续传
+    :param size: 批次记录数
+    :param error: 异常对象
+    """
+
+    def __init__(self, index, offset, size, error):
+        self.index = index
+        self.offset = offset
+        self.size = size
+        self.error = error
+
+    def __repr__(self):
+        return f"BatchError(index={self.index}, offset={self.offset}, size={self.size}, error={self.error!r})"
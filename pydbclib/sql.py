@@ -1,19 +1,85 @@
 # -*- coding: utf-8 -*-
 """
 sql 语句参数名称提取及参数形式替换
-可以考虑sqlparse库解析
-import sqlparse
-sql2 = "select * from asr where uuid=%s"
-parsed = sqlparse.parse(sql)
-stmt = parsed[0]
-parsed = sqlparse.parse(sql1)
-stmt = parsed[0]
-for token in stmt.flatten():
-    token.ttype is sqlparse.tokens.Name.Placeholder
+使用单遍扫描的词法分析提取':name'形式的占位符，跳过字符串、引号标识符、注释以及'::'类型转换
 """
-import sqlparse
+import re
+from collections import namedtuple
+from operator import itemgetter
 
 from pydbclib.exceptions import SQLFormatError
+from pydbclib.utils import LRUCache
+
+# 编译结果: 替换占位符后的sql, 占位符参数名称列表, 参数名称重复时按位置取参的下标列表(无重复时为None),
+# 以及按名称/按位置把一行参数转换成元组的取值函数
+CompiledSQL = namedtuple("CompiledSQL", ["sql", "keys", "postions", "key_getter", "postion_getter"])
+
+# 按(sql, 占位符形式)缓存编译结果，避免重复语句每次都重新解析
+compiled_cache = LRUCache(maxsize=1024)
+
+# 按出现位置匹配, 各分支首字符互斥, 整个扫描为线性时间
+_TOKEN_REGEX = re.compile(r"""
+    '(?:''|\\.|[^'\\])*'            # 字符串
+  | "(?:""|\\.|[^"\\])*"            # 引号标识符
+  | `(?:``|[^`])*`                  # mysql标识符
+  | --[^\r\n]*                      # 单行注释
+  | /\*.*?\*/                       # 多行注释
+  | ::|:=                           # 类型转换、赋值
+  | (?<!\w):(?P<name>\w+)           # 占位符
+  | (?P<invalid>\?|%(?:\(\w+\))?s)  # 不支持的占位符
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokenize_placeholders(sql, place_holder):
+    """
+    提取sql中':name'形式的占位符并替换成驱动支持的占位符
+    :param sql: sql语句
+    :param place_holder: 替换后的占位符，如'?'、'%s'
+    :return: (替换后的sql, 占位符参数名称列表)
+    """
+    keys = []
+    pieces = []
+    last = 0
+    for match in _TOKEN_REGEX.finditer(sql):
+        name = match.group("name")
+        if name is not None:
+            keys.append(name)
+            pieces.append(sql[last:match.start()])
+            pieces.append(place_holder)
+            last = match.end()
+        elif match.group("invalid") is not None:
+            raise SQLFormatError(f"无效的占位符{match.group()}, 只支持使用':'开头的占位符")
+    if last == 0:
+        return sql, keys
+    pieces.append(sql[last:])
+    return "".join(pieces), keys
+
+
+def make_getter(items):
+    """生成按items取值并返回元组的函数，itemgetter在只有一个元素时返回的不是元组，需要单独处理"""
+    if len(items) == 0:
+        return lambda row: ()
+    elif len(items) == 1:
+        item = items[0]
+        return lambda row: (row[item],)
+    else:
+        return itemgetter(*items)
+
+
+def sqlparse_placeholders(sql, place_holder):
+    """基于sqlparse的占位符提取，仅用于对比测试，需要额外安装sqlparse"""
+    import sqlparse
+    stmt = sqlparse.parse(sql)[0]
+    tokens = list(stmt.flatten())
+    keys = []
+    for token in tokens:
+        if token.ttype is sqlparse.tokens.Name.Placeholder:
+            if ":" in token.value:
+                keys.append(token.value[1:])
+                token.value = place_holder
+            else:
+                raise SQLFormatError(f"无效的占位符{token.value}, 只支持使用':'开头的占位符")
+    return "".join(t.value for t in tokens), keys
 
 
 class Compiler(object):
@@ -35,29 +101,41 @@ class QmarkCompiler(Compiler):
         if not self.parameters:
             return self.sql, None
         elif isinstance(self.parameters, (list, tuple)):
-            sql, keys = self.parse_sql()
-            if len(set(keys)) == len(keys):
-                return sql, self.parameters
+            compiled = self.compile()
+            if compiled.postions is None:
+                return compiled.sql, self.parameters
             else:
-                postions = self.to_postions(keys)
-                return sql, [self.parameters[p] for p in postions]
+                return compiled.sql, compiled.postion_getter(self.parameters)
         else:
-            sql, keys = self.parse_sql()
-            return sql, tuple(self.parameters[k] for k in keys)
+            compiled = self.compile()
+            return compiled.sql, compiled.key_getter(self.parameters)
 
     def process(self):
         if not self.parameters:
             return self.sql, None
         elif isinstance(self.parameters[0], (list, tuple)):
-            sql, keys = self.parse_sql()
-            if len(set(keys)) == len(keys):
-                return sql, self.parameters
+            # 已经是按占位符顺序排列的序列，直接使用不再复制
+            compiled = self.compile()
+            if compiled.postions is None:
+                return compiled.sql, self.parameters
             else:
-                postions = self.to_postions(keys)
-                return sql, [tuple(parameter[p] for p in postions) for parameter in self.parameters]
+                return compiled.sql, list(map(compiled.postion_getter, self.parameters))
         else:
+            compiled = self.compile()
+            return compiled.sql, list(map(compiled.key_getter, self.parameters))
+
+    def compile(self):
+        """解析sql，优先从缓存中取编译结果"""
+        cache_key = (self.sql, self.place_holder)
+        compiled = compiled_cache.get(cache_key)
+        if compiled is None:
             sql, keys = self.parse_sql()
-            return sql, [tuple(parameter[k] for k in keys) for parameter in self.parameters]
+            postions = None if len(set(keys)) == len(keys) else tuple(self.to_postions(keys))
+            compiled = CompiledSQL(
+                sql, tuple(keys), postions, make_getter(keys), postions and make_getter(postions)
+            )
+            compiled_cache.set(cache_key, compiled)
+        return compiled
 
     @staticmethod
     def to_postions(keys):
@@ -70,18 +148,7 @@ class QmarkCompiler(Compiler):
         return [postions[k] for k in keys]
 
     def parse_sql(self):
-        parsed = sqlparse.parse(self.sql)
-        stmt = parsed[0]
-        tokens = list(stmt.flatten())
-        keys = []
-        for token in tokens:
-            if token.ttype is sqlparse.tokens.Name.Placeholder:
-                if ":" in token.value:
-                    keys.append(token.value[1:])
-                    token.value = self.place_holder
-                else:
-                    raise SQLFormatError(f"无效的占位符{token.value}, 只支持使用':'开头的占位符")
-        return "".join(t.value for t in tokens), keys
+        return tokenize_placeholders(self.sql, self.place_holder)
 
 
 class FormatCompiler(QmarkCompiler):
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: CommonDriver 预编译语句缓存
+每个连接按sql缓存一组预编译的游标，重复执行相同sql时跳过服务端的解析:
+    psycopg(3): execute(prepare=True)，服务端 PREPARE
+    mysql.connector: cursor(prepared=True)，二进制协议的预处理语句
+    cx_Oracle/oracledb: cursor.prepare，复用游标上的语句句柄
+    sqlite3: 每条语句使用独立游标，编译结果由连接的语句缓存复用
+其他驱动不支持预编译，按普通方式执行
+缓存淘汰时游标上的结果集仍在读取的，等结果集释放后再关闭游标
+"""
+import re
+import threading
+import weakref
+
+from pydbclib.utils import LRUCache
+
+# 只缓存数据操作语句，DDL等语句服务端不支持预编译
+_PREPARABLE_REGEX = re.compile(r"\s*(?:select|insert|update|delete|merge|with)\b", re.IGNORECASE)
+
+
+class PreparedStatement(object):
+    """
+    预编译的语句及其专用游标
+    """
+
+    def __init__(self, cursor, sql, options=None, prepared=False):
+        self.cursor = cursor
+        self.sql = sql
+        self.options = options or {}
+        # 游标已通过prepare绑定语句时执行sql传None
+        self._operation = None if prepared else sql
+        self._result = None
+
+    def execute(self, params):
+        self.cursor.execute(self._operation, params, **self.options)
+        return self.cursor
+
+    def bind(self, result):
+        """记录正在使用游标的结果集(弱引用)，返回result"""
+        self._result = weakref.ref(result) if self.cursor.description is not None else None
+        return result
+
+    def close(self):
+        """结果集未释放时推迟到结果集回收后关闭游标"""
+        result = self._result() if self._result is not None else None
+        if result is not None:
+            weakref.finalize(result, _close_cursor, self.cursor)
+        else:
+            self.cursor.close()
+
+
+def _prepare_psycopg(con, sql):
+    return PreparedStatement(con.cursor(), sql, {"prepare": True})
+
+
+def _prepare_mysql_connector(con, sql):
+    return PreparedStatement(con.cursor(prepared=True), sql)
+
+
+def _prepare_oracle(con, sql):
+    cursor = con.cursor()
+    cursor.prepare(sql)
+    return PreparedStatement(cursor, sql, prepared=True)
+
+
+def _prepare_sqlite3(con, sql):
+    return PreparedStatement(con.cursor(), sql)
+
+
+preparers = {
+    "psycopg": _prepare_psycopg,
+    "mysql.connector": _prepare_mysql_connector,
+    "cx_Oracle": _prepare_oracle,
+    "oracledb": _prepare_oracle,
+    "sqlite3": _prepare_sqlite3,
+}
+
+
+def _close_cursor(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+def _close_statement(sql, statement):
+    try:
+        statement.close()
+    except Exception:
+        pass
+
+
+class StatementCache(object):
+    """
+    预编译语句缓存，每个连接一份LRU缓存，淘汰时关闭对应的游标(结果集仍在读取时推迟关闭)
+    :param driver_name: DB-API驱动模块名，不支持预编译的驱动get返回None
+    :param maxsize: 每个连接最多缓存的语句数
+    """
+
+    def __init__(self, driver_name, maxsize=100):
+        self.preparer = preparers.get(driver_name)
+        self.maxsize = maxsize
+        self._caches = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def supported(self):
+        return self.preparer is not None
+
+    def get(self, record, sql):
+        """获取连接上sql对应的预编译语句，不支持或非数据操作语句时返回None"""
+        if self.preparer is None or not _PREPARABLE_REGEX.match(sql):
+            return None
+        cache = self._caches.get(record)
+        if cache is None:
+            cache = LRUCache(self.maxsize, on_evict=_close_statement)
+            with self._lock:
+                self._caches[record] = cache
+            record.statements = cache
+        statement = cache.get(sql)
+        if statement is None:
+            statement = self.preparer(record.con, sql)
+            cache.set(sql, statement)
+        return statement
+
+    def cache_info(self):
+        """所有连接合计的命中、未命中、淘汰次数、缓存语句数及命中率"""
+        with self._lock:
+            caches = list(self._caches.values())
+        info = {"hits": 0, "misses": 0, "evictions": 0, "size": 0}
+        for cache in caches:
+            for k, v in cache.cache_info().items():
+                if k in info:
+                    info[k] += v
+        info["maxsize"] = self.maxsize
+        info["connections"] = len(caches)
+        total = info["hits"] + info["misses"]
+        info["hit_rate"] = info["hits"] / total if total else 0.0
+        return info
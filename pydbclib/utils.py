@@ -5,6 +5,11 @@
 """
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
 
 
 def get_dbapi_module(module_name):
@@ -28,14 +33,139 @@ def to_camel_style(text):
     return res
 
 
-def get_records(result, batch_size, columns=None):
-    records = result.fetchmany(1000)
-    while records:
-        if columns:
+def estimate_row_bytes(records, samples=100):
+    """抽样估算每行记录占用的字节数"""
+    step = max(1, len(records) // samples)
+    sampled = records[::step]
+    total = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in sampled)
+    return total / len(sampled)
+
+
+def get_batches(result, batch_size, close=False, fetch_bytes=None, stats=None, on_fetch=None):
+    """
+    按批次返回查询结果的原始元组记录
+    :param batch_size: 每批次读取行数，开启自适应时作为第一批的行数
+    :param fetch_bytes: 每批次的目标字节数，指定后按已读取记录估算的行宽调整每批次行数
+    :param stats: 字典，记录读取的批次数、行数、每次fetchmany的行数及估算的行宽
+    :param on_fetch: 每次fetchmany后的回调函数，参数为(耗时, 行数, 估算的字节数或None)
+    """
+    if stats is None:
+        stats = {}
+    stats.update(batches=0, rows=0, batch_sizes=[], row_bytes=None)
+    size = batch_size
+    try:
+        while True:
+            start = time.perf_counter() if on_fetch is not None else None
+            records = result.fetchmany(size)
+            stats["batch_sizes"].append(size)
+            if not records:
+                if on_fetch is not None:
+                    on_fetch(time.perf_counter() - start, 0, None)
+                return
+            stats["batches"] += 1
+            stats["rows"] += len(records)
+            batch_bytes = None
+            if fetch_bytes:
+                row_bytes = estimate_row_bytes(records)
+                batch_bytes = int(row_bytes * len(records))
+                if stats["row_bytes"] is not None:
+                    row_bytes = (stats["row_bytes"] + row_bytes) / 2
+                stats["row_bytes"] = row_bytes
+                # 每次最多调整4倍，避免行宽波动时批次大小来回震荡
+                size = min(max(int(fetch_bytes // row_bytes), 1, size // 4), size * 4)
+            if on_fetch is not None:
+                on_fetch(time.perf_counter() - start, len(records), batch_bytes)
+            yield records
+    finally:
+        if close:
+            result.close()
+
+
+class Row(Mapping):
+    """
+    紧凑的记录对象，同一结果集的记录共享字段索引，每条记录只引用查询返回的值元组
+    支持 row["a"]、row.a、按字段名迭代、dict(row)，可以和字典比较相等
+    """
+    __slots__ = ("_values",)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __eq__(self, other):
+        if isinstance(other, Row) and other._index is self._index:
+            return self._values == other._values
+        elif isinstance(other, Mapping):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return make_row, (self._fields, tuple(self._values))
+
+    def values(self):
+        return [self._values[i] for i in self._index.values()]
+
+    def items(self):
+        return list(zip(self._index, self.values()))
+
+
+@lru_cache(maxsize=256)
+def row_class(columns):
+    """按字段名称生成共享字段索引的记录类"""
+    columns = tuple(columns)
+    index = {c: i for i, c in enumerate(columns)}
+    return type("Row", (Row,), {"__slots__": (), "__module__": __name__, "_fields": columns, "_index": index})
+
+
+def make_row(columns, values):
+    return row_class(tuple(columns))(values)
+
+
+def batches_to_records(batches, columns=None, compact=False):
+    factory = row_class(tuple(columns)) if columns and compact else None
+    for records in batches:
+        if factory is not None:
+            records = list(map(factory, records))
+        elif columns:
             records = [dict(zip(columns, i)) for i in records]
         for record in records:
             yield record
-        records = result.fetchmany(batch_size)
+
+
+def batches_to_columns(batches, width):
+    """把按行的元组批次转置成按列的数组"""
+    arrays = [[] for _ in range(width)]
+    for records in batches:
+        for array, values in zip(arrays, zip(*records)):
+            array.extend(values)
+    return arrays
+
+
+def get_records(result, batch_size, columns=None, close=False):
+    return batches_to_records(get_batches(result, batch_size, close), columns)
 
 
 def batch_dataset(dataset, batch_size):
@@ -49,6 +179,72 @@ def batch_dataset(dataset, batch_size):
         yield cache
 
 
+class LRUCache(object):
+    """
+    线程安全的LRU缓存，统计命中、未命中及淘汰次数
+    :param on_evict: 缓存项被淘汰或清除时的回调函数，参数为(key, value)，如用于关闭游标
+    """
+
+    def __init__(self, maxsize=1024, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        self._evict(evicted)
+
+    def pop(self, key, default=None):
+        """删除并返回缓存项，不触发on_evict"""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._data.items())
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+        self._evict(evicted)
+
+    def _evict(self, items):
+        if self.on_evict is not None:
+            for key, value in items:
+                self.on_evict(key, value)
+
+    def cache_info(self):
+        return {
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "size": len(self._data), "maxsize": self.maxsize
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
 def get_suffix(text):
     left, right = os.path.splitext(text)
     return right[1:] if right else left
@@ -11,7 +11,8 @@ with open('pydbclib/__init__.py', 'rb') as f:
 setup(
     name='pydbclib',
     version=version,
-    install_requires=['sqlalchemy>=1.1.14, <1.4.0', 'sqlparse', "log4py>=2.1"],
+    install_requires=['sqlalchemy>=1.1.14, <1.4.0'],
+    extras_require={'sqlparse': ['sqlparse'], 'zstd': ['zstandard'], 'numpy': ['numpy>=1.23']},
     description='Python Database Connectivity Lib',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -26,7 +27,7 @@ setup(
     url='https://github.com/taogeYT/pydbclib',
     author_email='li_yatao@outlook.com',
     license='Apache 2.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=False,
     zip_safe=True,
     python_requires='>=3.6',
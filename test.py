@@ -3,13 +3,33 @@
 @time: 2020/3/26 11:42 上午
 @desc:
 """
+import asyncio
+import datetime
+import gzip
+import importlib.util
+import os
+import pickle
 import unittest
 import sqlite3
+import tempfile
+import threading
+import time
 from collections.abc import Iterator
+from contextlib import contextmanager
+from unittest import mock
 
 from sqlalchemy import create_engine
 
-from pydbclib import connect
+from pydbclib import connect, aio, CommonDriver
+from pydbclib.cache import read_tables, written_tables
+from pydbclib.dialects import limit_sql, upsert_sql
+from pydbclib.drivers import CopyLoader, MultiValuesLoader, get_bulk_loader, parse_insert
+from pydbclib.exceptions import SQLFormatError, ConnectError, ParameterError
+from pydbclib.instrument import normalize_sql, percentile
+from pydbclib.log import ParamSummary
+from pydbclib.parallel import split_range, range_conditions
+from pydbclib.statements import StatementCache
+from pydbclib.sql import QmarkCompiler, FormatCompiler, compiled_cache, tokenize_placeholders
 
 
 class TestConnect(unittest.TestCase):
@@ -56,8 +76,21 @@ class TestDataBase(unittest.TestCase):
     def test_bulk(self):
         r = self.db.bulk("insert into foo(a,b) values(:a,:b)", (r for r in [self.record]*1000), batch_size=100)
         self.assertEqual(r, 1000)
+        self.assertEqual(r.strategy, "multi_values")
         self.assertEqual(self.db.read("select * from foo").get_all(), [self.record]*1000)
 
+    def test_bulk_strategy(self):
+        sql = "insert into foo(a,b) values(:a,:b)"
+        r = self.db.bulk(sql, [(i, str(i)) for i in range(2500)], strategy="multi_values")
+        self.assertEqual((r, r.strategy), (2500, "multi_values"))
+        r = self.db.bulk(sql, [self.record] * 10, strategy="executemany")
+        self.assertEqual((r, r.strategy), (10, "executemany"))
+        r = self.db.bulk("insert into foo(a,b) select :a, :b", [self.record] * 10)
+        self.assertEqual((r, r.strategy), (10, "executemany"))
+        self.assertRaises(ParameterError, self.db.bulk, sql, [self.record], strategy="copy")
+        self.assertEqual(self.db.read_one("select count(*) as n, sum(a) as s from foo"),
+                         {"n": 2520, "s": sum(range(2500)) + 20})
+
     def test_read(self):
         r = self.db.read("select * from foo")
         self.assertEqual(r.get(1), [])
@@ -68,11 +101,75 @@ class TestDataBase(unittest.TestCase):
         self.assertEqual(self.db.read("select * from foo").get_all(), [self.record]*10)
         self.assertEqual(self.db.read("select * from foo", as_dict=False).get(1), [(1, "1")])
 
+    def test_read_stream(self):
+        self.db.bulk("insert into foo(a,b) values(:a,:b)", ({"a": i, "b": "x" * 100} for i in range(20000)))
+        self.assertEqual(self.db.read("select * from foo", stream=True, batch_size=7).limit(3).get_all(),
+                         [{"a": i, "b": "x" * 100} for i in range(3)])
+        with self.assertLogs("pydbclib.drivers", "INFO") as logs:
+            self.assertEqual(sum(1 for _ in self.db.read("select * from foo", stream=True, batch_size=100)), 20000)
+            self.assertEqual(sum(1 for _ in self.db.read("select * from foo", batch_size=100)), 20000)
+        self.assertEqual([r.getMessage().split()[0] for r in logs.records], ["stream", "execute"])
+        # SQLAlchemy开启stream_results，DB-API驱动使用服务端游标
+        r = self.db.driver.execute_stream("select * from foo", batch_size=100)
+        self.assertTrue(r.context.context.execution_options["stream_results"])
+        r.close()
+
+        class SSCursor(sqlite3.Cursor):
+            pass
+
+        with connect(":memory:", driver="sqlite3") as db:
+            db.execute("CREATE TABLE foo (a integer)")
+            db.driver.driver_name = "pymysql"
+            db.driver.dbapi = type("dbapi", (), {"cursors": type("cursors", (), {"SSCursor": SSCursor})})
+            r = db.driver.execute_stream("select * from foo", batch_size=100)
+            self.assertEqual((type(r.context), r.context.arraysize), (SSCursor, 100))
+
+    def test_read_adaptive(self):
+        self.db.bulk("insert into foo(a,b) values(:a,:b)", ({"a": i, "b": "x" * 1000} for i in range(1000)))
+        records = self.db.read("select * from foo", batch_size=10)
+        self.assertEqual(len(records.get_all()), 1000)
+        self.assertEqual(records.stats["batch_sizes"], [10] * 101)
+        records = self.db.read("select * from foo", batch_size=10, fetch_bytes=100 * 1024)
+        self.assertEqual(len(records.get_all()), 1000)
+        sizes = records.stats["batch_sizes"]
+        self.assertEqual(sizes[:2], [10, 40])
+        self.assertTrue(all(80 <= i <= 110 for i in sizes[2:]))
+        self.assertEqual(records.stats["rows"], 1000)
+        self.assertGreater(records.stats["row_bytes"], 1000)
+
     def test_read_one(self):
         self.db.get_table("foo").insert([self.record] * 10)
         r = self.db.read_one("select * from foo")
         self.assertEqual(r, self.record)
 
+    def test_bulk_upsert(self):
+        self.db.execute("CREATE TABLE bar (a integer primary key, b varchar(20))")
+        try:
+            table = self.db.get_table("bar")
+            table.bulk([{"a": i, "b": "old"} for i in range(100)])
+            r = table.bulk_upsert(({"a": i, "b": str(i)} for i in range(50, 150)), key=["a"], batch_size=30)
+            self.assertEqual((r, r.strategy, r.batches), (100, "multi_values", [30, 30, 30, 10]))
+            self.assertEqual(self.db.read_one("select count(*) as n from bar where b='old'"), {"n": 50})
+            self.assertEqual(table.find_one({"a": 149}), {"a": 149, "b": "149"})
+        finally:
+            self.db.execute("DROP TABLE bar")
+
+    def test_bulk_update(self):
+        table = self.db.get_table("foo")
+        table.bulk([{"a": i, "b": str(i)} for i in range(100)])
+        r = table.bulk_update([{"a": i, "b": "x"} for i in range(50)], key=["a"], strategy="case")
+        self.assertEqual((r, r.strategy), (50, "case"))
+        self.assertEqual(table.bulk_delete(range(40, 60).__iter__(), key="a"), 20)
+        self.assertEqual(self.db.read_one("select count(*) as n from foo where b='x'"), {"n": 40})
+
+
+def double(record):
+    return {**record, "a": record["a"] * 2}
+
+
+def is_even(record):
+    return record["a"] % 2 == 0
+
 
 class TestTable(unittest.TestCase):
     db = None
@@ -98,12 +195,40 @@ class TestTable(unittest.TestCase):
     def test_get_columns(self):
         self.assertEqual(self.table.get_columns(), ["a", "b"])
 
+    def test_metadata(self):
+        self.assertEqual(self.table.get_columns(), ["a", "b"])
+        self.db.driver.con.execute("ALTER TABLE foo ADD COLUMN c integer")
+        self.assertEqual(self.table.get_columns(), ["a", "b"])
+        self.db.execute("ALTER TABLE foo ADD COLUMN d integer")
+        self.assertEqual(self.table.get_columns(), ["a", "b", "c", "d"])
+        self.db.metadata.ttl = 0
+        self.db.driver.con.execute("ALTER TABLE foo ADD COLUMN e integer")
+        self.assertEqual(self.table.get_columns(), ["a", "b", "c", "d", "e"])
+        self.db.metadata.ttl = None
+        self.assertIs(self.table._get_insert_sql(["a", "b"]), self.table._get_insert_sql(("a", "b")))
+        self.assertIs(self.table._render("update", {"a": 1}, {"b": 2})[0],
+                      self.table._render("update", {"a": 3}, {"b": 4})[0])
+        self.assertEqual(self.table._render("update", {"a": 3}, {"b": 4}),
+                         ("update foo set b=:u0 where a=:c0", {"c0": 3, "u0": 4}))
+        self.db.execute("DROP TABLE foo")
+        self.db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+        self.assertEqual(self.table.get_columns(), ["a", "b"])
+        for url, kwargs in ((":memory:", {"driver": "sqlite3"}), ("sqlite:///:memory:", {})):
+            with connect(url, metadata_ttl=0, **kwargs) as db:
+                self.assertEqual(db.metadata.ttl, 0)
+                db.execute("CREATE TABLE foo (a integer)")
+                self.assertEqual(db.get_table("foo").get_columns(), ["a"])
+                with db.driver.raw_cursor() as cursor:
+                    cursor.execute("ALTER TABLE foo ADD COLUMN b integer")
+                self.assertEqual(db.get_table("foo").get_columns(), ["a", "b"])
+
     def test_insert(self):
         self.assertEqual(self.table.insert(self.record), 1)
         self.assertEqual(self.table.insert([self.record]*10), 10)
 
     def test_bulk(self):
-        self.assertEqual(self.table.bulk([self.record]*1000, batch_size=100), 1000)
+        r = self.table.bulk([self.record]*1000, batch_size=100)
+        self.assertEqual((r, r.strategy), (1000, "multi_values"))
         self.assertEqual(self.table.find().get_all(), [self.record]*1000)
 
     def test_update(self):
@@ -115,6 +240,132 @@ class TestTable(unittest.TestCase):
         self.table.insert([self.record] * 10)
         self.assertEqual(self.table.delete({"a": 1}), 10)
 
+    def test_upsert(self):
+        self.db.execute("CREATE TABLE bar (a integer, b varchar(20), c integer, primary key (a, b))")
+        try:
+            table = self.db.get_table("bar")
+            table.insert({"a": 1, "b": "1", "c": 1})
+            self.assertEqual(table.upsert({"a": 1, "b": "1", "c": 2}, key=["a", "b"]), 1)
+            table.upsert([{"a": 1, "b": "1", "c": 3}, {"a": 2, "b": "2", "c": 2}], key=["a", "b"])
+            self.assertEqual(table.find().get_all(), [{"a": 1, "b": "1", "c": 3}, {"a": 2, "b": "2", "c": 2}])
+            r = table.bulk_upsert([{"a": i % 3, "b": str(i % 3), "c": i} for i in range(10)], key=["a", "b"])
+            self.assertEqual(r, 3)
+            self.assertEqual(table.find(fields=["c"]).get_all(), [{"c": 7}, {"c": 8}, {"c": 9}])
+            self.assertRaises(ParameterError, table.upsert, {"a": 1, "c": 1}, key=["a", "b"])
+        finally:
+            self.db.execute("DROP TABLE bar")
+        self.db.execute("CREATE TABLE bar (id integer primary key, c integer)")
+        try:
+            table = self.db.get_table("bar")
+            self.assertEqual(table.upsert({"id": 1, "c": 1}, key="id"), 1)
+            self.assertEqual(table.upsert({"id": 1, "c": 2}, key="id"), 1)
+            self.assertEqual(table.bulk_upsert([{"id": 1, "c": 3}, {"id": 2, "c": 2}, {"id": 2, "c": 4}], key="id"), 2)
+            self.assertEqual(table.find().get_all(), [{"id": 1, "c": 3}, {"id": 2, "c": 4}])
+        finally:
+            self.db.execute("DROP TABLE bar")
+
+    def test_bulk_update(self):
+        self.table.bulk([{"a": i, "b": str(i)} for i in range(100)])
+        r = self.table.bulk_update(({"a": i, "b": "x"} for i in range(0, 100, 2)), key=["a"], batch_size=20)
+        self.assertEqual((r, r.strategy, r.batches), (50, "executemany", [20, 20, 10]))
+        r = self.table.bulk_update([{"a": i, "b": "y"} for i in range(0, 100, 4)] + [{"a": 0, "b": "z"}],
+                                   key=["a"], strategy="case")
+        self.assertEqual((r, r.strategy), (25, "case"))
+        self.assertEqual(self.table.find({"a": 0}).get_all(), [{"a": 0, "b": "z"}])
+        self.assertEqual(self.db.read_one("select count(*) as n from foo where b in ('x', 'y')"), {"n": 49})
+        self.assertRaises(ParameterError, self.table.bulk_update, [{"b": "y", "a": 1}], key=["a", "b"])
+        self.assertRaises(ParameterError, self.table.bulk_update, [{"a": 1}], key=["a"])
+        self.assertRaises(ParameterError, self.table.bulk_update, [{"a": 1, "b": "1"}], key=["a", "b"], strategy="case")
+        for strategy in ("executemany", "case"):
+            r = self.table.bulk_update([{"a": 1, "b": strategy}, {"a": 2, "b": strategy}], key="a", strategy=strategy)
+            self.assertEqual(r, 2)
+            self.assertEqual(self.table.find({"a": 2}).get_all(), [{"a": 2, "b": strategy}])
+
+    def test_bulk_delete(self):
+        self.table.bulk([{"a": i, "b": str(i % 2)} for i in range(100)])
+        r = self.table.bulk_delete(range(10).__iter__(), key="a", batch_size=4)
+        self.assertEqual((r, r.strategy, r.batches), (10, "in", [4, 4, 2]))
+        r = self.table.bulk_delete([{"a": i, "b": str(i % 2)} for i in range(10, 30)] + [{"a": 30, "b": "x"}])
+        self.assertEqual((r, r.strategy), (20, "executemany"))
+        self.assertEqual(self.table.bulk_delete([{"a": 30}, {"a": 31}]), 2)
+        self.assertEqual(self.db.read_one("select count(*) as n from foo"), {"n": 68})
+        self.assertRaises(ParameterError, self.table.bulk_delete, [1, 2])
+
+    def test_reinsert_rows(self):
+        for db in (connect(":memory:", driver="sqlite3"), connect("sqlite:///:memory:")):
+            with db:
+                db.execute("CREATE TABLE bar (a integer primary key, b varchar(20))")
+                table = db.get_table("bar")
+                table.insert([{"a": i, "b": str(i)} for i in range(6)])
+                rows = db.read("select * from bar order by a", compact=True).get_all()
+                db.execute("delete from bar")
+                self.assertEqual(table.insert(rows[0]), 1)
+                self.assertEqual(table.insert(rows[1:3]), 2)
+                self.assertEqual(table.bulk(rows[3:]), 3)
+                self.assertEqual(table.upsert(rows[0], "a"), 1)
+                self.assertEqual(table.bulk_upsert(rows, "a"), 6)
+                self.assertEqual(table.bulk_update(rows, "a"), 6)
+                self.assertEqual(table.update(rows[0], {"b": "x"}), 1)
+                self.assertEqual(db.read_one("select * from bar where a=:a", rows[0]), {"a": 0, "b": "x"})
+                self.assertEqual(table.bulk_delete(rows[4:], key="a"), 2)
+                self.assertEqual(table.find().get_all(), [{"a": 0, "b": "x"}] + rows[1:4])
+
+    def test_upsert_sql(self):
+        self.assertEqual(upsert_sql("mysql", "foo", ("a", "b"), ("a",)),
+                         "insert into foo (a,b) values (:a,:b) on duplicate key update b=values(b)")
+        self.assertEqual(upsert_sql("postgresql", "foo", ("a",), ("a",)),
+                         "insert into foo (a) values (:a) on conflict (a) do nothing")
+        self.assertEqual(upsert_sql("oracle", "foo", ("a", "b"), ("a",)),
+                         "merge into foo t using (select :a as a,:b as b from dual) s on (t.a=s.a)"
+                         " when matched then update set t.b=s.b when not matched then insert (a,b) values (s.a,s.b)")
+        self.assertTrue(upsert_sql("mssql", "foo", ("a", "b"), ("a",)).endswith(";"))
+        self.assertRaises(ParameterError, upsert_sql, "db2", "foo", ("a",), ("a",))
+
+    def test_iter_pages(self):
+        self.table.insert([{"a": i % 5, "b": str(i)} for i in range(23)])
+        pages = list(self.table.iter_pages(["a", "b"], page_size=10, condition="a < 4 or b = '4'"))
+        self.assertEqual([len(p) for p in pages], [10, 10])
+        self.assertEqual(pages[0].last_key, (1, "6"))
+        records = [r for p in pages for r in p]
+        self.assertEqual(records, sorted(records, key=lambda r: (r["a"], r["b"])))
+        self.assertEqual(len({(r["a"], r["b"]) for r in records}), 20)
+        resumed = self.table.iter_pages(["a", "b"], 10, "a < 4 or b = '4'", last_key=pages[0].last_key)
+        self.assertEqual(list(resumed), pages[1:])
+        self.table.delete("a > 0")
+        self.table.update({"a": 0}, {"a": 1})
+        self.table.insert({"a": 7, "b": "x"})
+        pages = list(self.table.iter_pages("a", page_size=2, fields=["a"], condition={"a": 7}))
+        self.assertEqual((pages, pages[0].last_key), ([[{"a": 7}]], 7))
+        self.assertEqual(list(self.table.iter_pages("a", condition={"a": 9})), [])
+        self.assertRaises(ParameterError, next, self.table.iter_pages("a", fields=["b"]))
+        pages = list(self.table.find().paginate(3, key="a"))
+        self.assertEqual([(len(p), p.last_key) for p in pages], [(3, 1), (3, 7)])
+        self.assertEqual(limit_sql("mssql", "select distinct a from foo", 5), "select distinct top 5 a from foo")
+        self.assertEqual(limit_sql("mssql", "select a from foo order by a", 5),
+                         "select a from foo order by a offset 0 rows fetch next 5 rows only")
+        self.assertEqual(limit_sql("oracle", "select a from foo", 5), "select a from foo fetch first 5 rows only")
+
+    def test_query(self):
+        self.table.insert([{"a": i, "b": str(i % 3)} for i in range(30)])
+        query = self.table.find({"b": "1"}).where("a > 5 or a < 0").order_by("a desc").fields("a").limit(3)
+        self.assertEqual(query.get_sql(), (
+            "select a from foo where b=:c0 and (a > 5 or a < 0) order by a desc limit 3", {"c0": "1"}
+        ))
+        events = []
+        self.db.instrumentation.subscribe(events.append)
+        self.assertEqual(query.get_all(), [{"a": 28}, {"a": 25}, {"a": 22}])
+        self.assertEqual([e.rows for e in events if e.kind == "fetch"], [3, 0])
+        self.db.instrumentation.unsubscribe(events.append)
+        self.assertRaises(ParameterError, query.order_by, "a")
+        query = self.table.find().where(b="2").filter({"a": 5}).limit(10).limit(5)
+        self.assertEqual(query.get_sql(), ("select * from foo where b=:c0 and a=:c1 limit 5", {"c0": "2", "c1": 5}))
+        self.assertEqual(list(query), [{"a": 5, "b": "2"}])
+        self.assertEqual(self.table.find().limit(5).where(b="0").get_all(), [{"a": 0, "b": "0"}, {"a": 3, "b": "0"}])
+        self.assertEqual(self.table.find().filter(lambda r: r["a"] % 10 == 0).limit(2).get_all(),
+                         [{"a": 0, "b": "0"}, {"a": 10, "b": "1"}])
+        self.assertRaises(ParameterError, self.table.find().limit(1).where, "a > 1")
+        self.assertEqual(self.table.find().order_by("a").stats, {})
+
     def test_find(self):
         self.assertEqual(self.table.find().get_one(), None)
         self.table.insert(self.record)
@@ -123,6 +374,19 @@ class TestTable(unittest.TestCase):
         self.assertIsInstance(r, Iterator)
         self.assertEqual(self.table.find({"a": 2}).get(1), [])
 
+    def test_find_stream(self):
+        self.table.insert([self.record] * 10)
+        self.assertEqual(self.table.find({"a": 1}, stream=True, batch_size=3).get_all(), [self.record] * 10)
+
+    def test_find_compact(self):
+        self.table.insert([self.record] * 10)
+        rows = self.table.find(compact=True).get_all()
+        self.assertEqual(rows, [self.record] * 10)
+        self.assertEqual((rows[0]["a"], rows[0].b, dict(rows[0]), list(rows[0])), (1, "1", self.record, ["a", "b"]))
+        self.assertEqual(pickle.loads(pickle.dumps(rows[0])), self.record)
+        self.assertEqual(self.table.find(compact=True).rename({"a": "c"}).get_one(), {"c": 1, "b": "1"})
+        self.assertEqual(self.table.find(compact=True).filter(lambda x: x.a == 1).to_df().shape, (10, 2))
+
     def test_find_one(self):
         self.assertEqual(self.table.find_one(), None)
         self.table.insert(self.record)
@@ -134,6 +398,674 @@ class TestTable(unittest.TestCase):
         df = self.table.find({"a": 1}).limit(1).to_df()
         self.assertEqual(df.loc[0, 'a'], self.record['a'])
         self.assertEqual(df.loc[0, 'b'], self.record['b'])
+        df = self.table.find().to_df()
+        self.assertEqual(list(df.columns), ["a", "b"])
+        self.assertEqual(df.to_dict("records"), [self.record] * 10)
+        dfs = list(self.table.find().to_df(batch_size=4))
+        self.assertEqual([len(i) for i in dfs], [4, 4, 2])
+        self.assertEqual(list(self.db.read("select * from foo", as_dict=False).to_df(batch_size=4))[0].columns.tolist(),
+                         [0, 1])
+        records = self.table.find()
+        records.get_one()
+        self.assertEqual(len(records.to_df()), 9)
+
+    def test_to_csv(self):
+        self.table.insert([{"a": i, "b": f"x,{i}" if i % 2 else None} for i in range(10)])
+        with tempfile.TemporaryDirectory() as path:
+            native, pandas = os.path.join(path, "native.csv"), os.path.join(path, "pandas.csv")
+            self.assertEqual(self.table.find().to_csv(native, header=True), [native])
+            self.table.find().to_csv(pandas, header=True, engine="pandas", batch_size=3)
+            with open(native) as f, open(pandas) as g:
+                content = f.read()
+                self.assertEqual(content, g.read())
+            self.assertEqual(content.splitlines()[:3], ["a,b", "0,", '1,"x,1"'])
+            self.table.find().map(lambda r: r).to_csv(native, sep="\001", columns=["b", "a"], batch_size=4)
+            with open(native) as f:
+                self.assertEqual(f.read().splitlines()[1], "x,1\0011")
+            paths = self.db.read("select * from foo", as_dict=False).to_csv(
+                os.path.join(path, "part.csv.gz"), header=True, rotate_rows=4)
+            self.assertEqual([os.path.basename(p) for p in paths], ["part_00000.csv.gz", "part_00001.csv.gz", "part_00002.csv.gz"])
+            with gzip.open(paths[2], "rt") as f:
+                self.assertEqual(f.read(), 'a,b\n8,\n9,"x,9"\n')
+            empty = os.path.join(path, "empty.csv")
+            self.table.find({"a": -1}).to_csv(empty, header=True)
+            with open(empty) as f:
+                self.assertEqual(f.read(), "a,b\n")
+            # pandas的参数按原来的方式写入
+            legacy = os.path.join(path, "legacy.csv")
+            self.assertEqual(self.table.find().to_csv(legacy, ",", True, ["a", "b"], 3, na_rep="NULL"), [legacy])
+            with open(legacy) as f:
+                self.assertEqual(f.read().splitlines()[:3], ["a,b", "0,NULL", '1,"x,1"'])
+            with self.assertRaisesRegex(ParameterError, "engine='pandas'"):
+                self.table.find().to_csv(legacy, engine="csv", na_rep="NULL")
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+    def test_to_numpy(self):
+        self.table.insert([{"a": None if i == 15 else i, "b": "x" if i == 18 else i % 3} for i in range(20)])
+        arrays = self.db.read("select a, b, a * 0.5 as c from foo", batch_size=7).to_numpy()
+        self.assertEqual(list(arrays), ["a", "b", "c"])
+        self.assertEqual([str(a.dtype) for a in arrays.values()], ["float64", "object", "float64"])
+        self.assertEqual(arrays["a"][14], 14)
+        self.assertTrue(arrays["a"][15] != arrays["a"][15])
+        self.assertEqual(list(arrays["b"][16:19]), ["1", "2", "x"])
+        arrays = self.table.find("a < 10").to_numpy({"a": "int32"})
+        self.assertEqual((arrays["a"].dtype.name, arrays["a"].sum()), ("int32", 45))
+        structured = self.table.find("a < 3").map(lambda r: {"a": r["a"], "d": r["a"] * 2}).to_numpy(structured=True)
+        self.assertEqual(structured.dtype.names, ("a", "d"))
+        self.assertEqual(structured["d"].tolist(), [0, 2, 4])
+        self.assertEqual(len(self.db.read("select a from foo where a < 0", as_dict=False).to_numpy()[0]), 0)
+        self.assertRaises(ParameterError, self.table.find().to_numpy, {"b": "int64"})
+        self.assertRaises(ParameterError, self.table.find().to_numpy, {"c": "int64"})
+        self.db.execute("CREATE TABLE bar (a numeric)")
+        self.db.get_table("bar").insert([{"a": 1}, {"a": 2}, {"a": 3}, {"a": 2.75}])
+        for batch_size in (3, 10):
+            arrays = self.db.read("select a from bar", batch_size=batch_size).to_numpy()
+            self.assertEqual((arrays["a"].dtype.name, arrays["a"].tolist()), ("float64", [1, 2, 3, 2.75]))
+        self.db.execute("DROP TABLE bar")
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_to_arrow(self):
+        self.table.insert([self.record] * 10)
+        table = self.table.find().to_arrow()
+        self.assertEqual(table.column_names, ["a", "b"])
+        self.assertEqual(table.to_pylist(), [self.record] * 10)
+        table = self.table.find().map(lambda x: {**x, "c": 3}).to_arrow()
+        self.assertEqual(table.column_names, ["a", "b", "c"])
+
+
+class TestPrepared(unittest.TestCase):
+
+    def test_statement_cache(self):
+        db = connect(":memory:", driver="sqlite3", prepared=True, prepared_cache_size=2)
+        try:
+            self.assertIsNone(connect(":memory:", driver="sqlite3").statement_cache_info())
+            db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+            table = db.get_table("foo")
+            table.insert([{"a": i, "b": str(i)} for i in range(10)])
+            for i in range(10):
+                self.assertEqual(table.find_one({"a": i}), {"a": i, "b": str(i)})
+                table.update({"a": i}, {"b": "x"})
+            info = db.statement_cache_info()
+            self.assertEqual((info["hits"], info["misses"], info["evictions"], info["size"]), (18, 2, 0, 2))
+            self.assertEqual(info["hit_rate"], 0.9)
+            statements = db.driver._get_record().statements
+            cursor = statements.get("update foo set b=? where a=?").cursor
+            statements.get("select * from foo where a=?")
+            self.assertEqual(db.read("select b from foo").get_all(), [{"b": "x"}] * 10)
+            self.assertEqual(db.statement_cache_info()["evictions"], 1)
+            self.assertRaises(sqlite3.ProgrammingError, cursor.fetchall)
+            # 淘汰时结果集仍在读取的游标不关闭，结果集释放后再关闭
+            records = db.read("select a from foo order by a", batch_size=2)
+            self.assertEqual(records.get(2), [{"a": 0}, {"a": 1}])
+            cursor = statements.get("select a from foo order by a").cursor
+            db.read("select a from foo where a > 0").get_one()
+            db.read("select a from foo where a > 1").get_one()
+            self.assertIsNone(statements.get("select a from foo order by a"))
+            self.assertEqual(records.get_all(), [{"a": i} for i in range(2, 10)])
+            del records
+            self.assertRaises(sqlite3.ProgrammingError, cursor.fetchall)
+            self.assertIsNone(StatementCache("pymysql").get(db.driver._get_record(), "select 1"))
+        finally:
+            db.close()
+        self.assertEqual(len(statements), 0)
+
+
+class TestQueryLog(unittest.TestCase):
+
+    def test_lazy_summary(self):
+        class Param(object):
+            formatted = 0
+
+            def __repr__(self):
+                Param.formatted += 1
+                return "p"
+
+        db = connect(":memory:", driver="sqlite3")
+        try:
+            db.execute("CREATE TABLE foo (a varchar(20))")
+            rows = [(Param(),) for _ in range(100)]
+            self.assertRaises(Exception, db.execute, "insert into foo(a) values(:a)", [{"a": r[0]} for r in rows])
+            self.assertEqual(Param.formatted, 0)
+            with self.assertLogs("pydbclib.drivers", "INFO") as logs:
+                db.execute("insert into foo(a) values(:a)", [{"a": str(i)} for i in range(100)])
+                db.bulk("insert into foo(a) values(:a)", [{"a": str(i)} for i in range(10)])
+            record = logs.records[0]
+            self.assertIn("100 rows, first 3: [('0',), ('1',), ('2',)]", record.getMessage())
+            self.assertEqual((record.sql, record.rows), ("insert into foo(a) values(?)", 100))
+            self.assertGreaterEqual(record.elapsed, 0)
+            self.assertTrue(logs.records[1].getMessage().startswith("bulk(multi_values) insert into foo"))
+            summary = str(ParamSummary(list(range(1000)), max_length=20))
+            self.assertEqual(summary, "[0, 1, 2, 3, 4, 5, 6...(4890 chars)")
+        finally:
+            db.close()
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_events(self):
+        for db in (connect(":memory:", driver="sqlite3"), connect("sqlite:///:memory:")):
+            events = []
+            db.instrumentation.subscribe(events.append)
+            db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+            db.execute("insert into foo(a,b) values(:a,:b)", [{"a": i, "b": str(i)} for i in range(10)])
+            self.assertEqual(len(db.read("select * from foo where a < :a", {"a": 7}, batch_size=3).get_all()), 7)
+            db.bulk("insert into foo(a,b) values(:a,:b)", [{"a": i, "b": str(i)} for i in range(5)])
+            db.instrumentation.unsubscribe(events.append)
+            db.execute("select 1")
+            kinds = [e.kind for e in events]
+            self.assertEqual(kinds.count("fetch"), 4)
+            self.assertEqual([e.rows for e in events if e.kind == "fetch"], [3, 3, 1, 0])
+            self.assertEqual(events[-1][:2], ("bulk", "insert into foo(a,b) values(:a,:b)"))
+            self.assertEqual(events[-1].rows, 5)
+            self.assertIn(10, [e.rows for e in events if e.kind == "execute"])
+            self.assertEqual(kinds.count("compile") > 0, isinstance(db.driver, CommonDriver))
+            self.assertTrue(all(e.elapsed >= 0 for e in events))
+            db.close()
+
+    def test_stats(self):
+        db = connect(":memory:", driver="sqlite3")
+        self.assertIsNone(db.stats())
+        db.enable_stats()
+        db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+        table = db.get_table("foo")
+        for i in range(20):
+            table.insert({"a": i, "b": str(i)})
+        table.find(batch_size=100, fetch_bytes=1024).get_all()
+        table.bulk_delete(range(15).__iter__(), key="a", batch_size=4)
+        stats = db.stats(reset=True)
+        insert = stats["insert into foo (a,b) values (?)"]
+        self.assertEqual((insert["execute"]["count"], insert["execute"]["rows"], insert["compile"]["count"]), (20, 20, 20))
+        self.assertTrue(insert["execute"]["p50"] <= insert["execute"]["p95"] <= insert["execute"]["p99"])
+        self.assertEqual(stats["delete from foo where a in (?)"]["execute"]["count"], 4)
+        fetch = stats["select * from foo"]["fetch"]
+        self.assertEqual(fetch["rows"], 20)
+        self.assertGreater(fetch["bytes"], 0)
+        self.assertEqual(db.stats(), {})
+        db.close()
+
+    def test_normalize(self):
+        self.assertEqual(normalize_sql("select * from  foo where b='x''y' and a in (:k0, :k1) and c > 10"),
+                         "select * from foo where b=? and a in (?) and c > ?")
+        self.assertEqual(normalize_sql("insert into foo (a,b) values (%s,%s),(%s,%s)"), "insert into foo (a,b) values (?)")
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.db = connect(":memory:", driver="sqlite3")
+        self.db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+        self.db.execute("CREATE TABLE bar (a integer)")
+        self.table = self.db.get_table("foo")
+        self.table.insert([{"a": i, "b": str(i)} for i in range(10)])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_hit_and_invalidate(self):
+        self.assertIsNone(self.db.cache_info())
+        self.db.enable_cache()
+        events = []
+        self.db.instrumentation.subscribe(events.append)
+        sql = "select * from foo where a < :a"
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 5)
+        self.assertEqual(self.db.read(sql, {"a": 5}).map(lambda r: r["b"]).get_all(), ["0", "1", "2", "3", "4"])
+        self.assertEqual(self.db.read(sql, {"a": 5}, as_dict=False, batch_size=2).get_one(), (0, "0"))
+        self.assertEqual(self.table.find_one({"a": 1}), {"a": 1, "b": "1"})
+        self.assertEqual(self.table.find_one({"a": 1}), {"a": 1, "b": "1"})
+        self.assertEqual(len([e for e in events if e.kind == "execute"]), 2)
+        self.assertEqual(self.db.cache_info()["hits"], 3)
+        self.assertEqual(len(self.db.read(sql, {"a": 3}).get_all()), 3)
+
+        self.db.get_table("bar").insert({"a": 1})
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 5)
+        self.assertEqual(self.db.cache_info()["misses"], 3)
+        self.table.update({"a": 1}, {"b": "x"})
+        self.assertEqual(self.table.find_one({"a": 1}), {"a": 1, "b": "x"})
+        self.table.bulk([{"a": 0, "b": "y"}])
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 6)
+        self.db.execute('delete from "main".FOO where a = 0')
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 4)
+        self.assertEqual(len(self.db.read(sql, {"a": 5}, cache=False).get_all()), 4)
+        self.db.commit()
+
+        self.table.delete({"a": 2})
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 3)
+        self.db.rollback()
+        self.assertEqual(len(self.db.read(sql, {"a": 5}).get_all()), 4)
+        self.db.invalidate_cache()
+        self.assertEqual(self.db.cache_info()["size"], 0)
+
+        # 批量写入已提交，之后回滚不需要清除缓存
+        self.table.update({"a": 1}, {"b": "z"})
+        self.table.bulk([{"a": 10, "b": "z"}])
+        self.assertEqual(self.db._written, set())
+        self.assertEqual(len(self.db.read(sql, {"a": 20}).get_all()), 10)
+        self.db.rollback()
+        self.assertEqual(self.db.cache_info()["size"], 1)
+        self.assertEqual(self.table.find_one({"a": 1}), {"a": 1, "b": "z"})
+
+    def test_write_during_read(self):
+        self.db.enable_cache()
+        records = self.db.read("select * from foo", batch_size=3)
+        self.assertEqual(len(records.get(1)), 1)
+        self.table.insert({"a": 10, "b": "10"})
+        self.db.commit()
+        records.get_all()
+        self.assertEqual(self.db.cache_info()["size"], 0)
+        self.assertEqual(len(self.db.read("select * from foo").get_all()), 11)
+        self.assertEqual(len(self.db.read("select * from foo").get_all()), 11)
+        self.assertEqual(self.db.cache_info()["hits"], 1)
+
+    def test_uncacheable(self):
+        self.db.enable_cache()
+        self.assertGreater(len({self.db.read_one("select random() as r")["r"] for _ in range(5)}), 1)
+        self.assertGreater(len({self.db.read("select a, random() from foo", as_dict=False).get_one()[1]
+                                for _ in range(5)}), 1)
+        self.assertEqual(self.db.read("select 1 as a").get_all(), [{"a": 1}])
+        self.assertEqual(self.db.cache_info()["size"], 0)
+
+    def test_limits(self):
+        cache = self.db.enable_cache(ttl=0.05, max_rows=5)
+        self.db.read("select * from foo").get_all()
+        self.db.read("select * from foo where a < 3").get_one()
+        self.db.read("select * from foo where a < 4").get_all()
+        self.assertEqual(len(cache.backend), 1)
+        self.assertIsNotNone(cache.get(("read", "select * from foo where a < 4", None)))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(("read", "select * from foo where a < 4", None)))
+        self.db.disable_cache()
+        self.assertIsNone(self.db.cache)
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            self.db.enable_cache("sqlite", path=path, max_entries=2)
+            for i in range(3):
+                self.assertEqual(self.db.read("select b from foo where a = :a", {"a": i}).get_all(), [{"b": str(i)}])
+            self.assertEqual(self.db.read("select b from foo where a = :a", {"a": 2}).get_all(), [{"b": "2"}])
+            self.assertEqual(self.db.cache_info()["size"], 2)
+            self.db.disable_cache()
+            cache = self.db.enable_cache("sqlite", path=path)
+            self.assertEqual(self.db.read("select b from foo where a = :a", {"a": 2}).get_all(), [{"b": "2"}])
+            self.assertEqual(cache.hits, 1)
+            self.table.insert({"a": 2, "b": "z"})
+            self.assertEqual(len(self.db.read("select b from foo where a = :a", {"a": 2}).get_all()), 2)
+            self.db.disable_cache()
+        self.assertRaises(ParameterError, self.db.enable_cache, "sqlite")
+
+    def test_tables(self):
+        self.assertEqual(read_tables("select * from a.foo f, baz join bar b on f.a=b.a"), {"foo", "bar", "baz"})
+        self.assertEqual(read_tables("with t as (select * from foo) select * from t"), {"foo", "t"})
+        self.assertIsNone(read_tables("insert into foo select * from bar"))
+        self.assertIsNone(read_tables("select 1"))
+        self.assertIsNone(read_tables("select * from foo where a < random()"))
+        self.assertIsNone(read_tables("select strftime('%f', 'now') from foo"))
+        self.assertEqual(written_tables("insert into [dbo].[Foo] (a) values (1)"), {"foo"})
+        self.assertEqual(written_tables("create table if not exists foo (a int)"), {"foo"})
+        self.assertEqual(written_tables("select 1"), set())
+        self.assertIsNone(written_tables("call refresh()"))
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.db = connect(self.path, driver="sqlite3", check_same_thread=False, pool_size=2, pool_timeout=0.2)
+        self.db.execute("CREATE TABLE foo (a integer, b varchar(20))", autocommit=True)
+
+    def tearDown(self):
+        self.db.close()
+        os.remove(self.path)
+
+    def test_threads(self):
+        table = self.db.get_table("foo")
+
+        def work(i):
+            table.insert({"a": i, "b": str(i)})
+            self.db.commit()
+            self.db.release()
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.db.read_one("select count(*) as n from foo"), {"n": 8})
+        self.db.release()
+        status = self.db.pool_status()
+        self.assertEqual(status["in_use"], 0)
+        self.assertLessEqual(status["size"], 2)
+        self.assertEqual(status["checkouts"], 9)
+
+    def test_timeout(self):
+        self.db.execute("select 1")
+        hold, errors = threading.Event(), []
+
+        def work():
+            try:
+                self.db.execute("select 1")
+                hold.wait(1)
+            except ConnectError as e:
+                errors.append(e)
+            finally:
+                self.db.release()
+
+        holder = threading.Thread(target=work)
+        holder.start()
+        waiter = threading.Thread(target=work)
+        waiter.start()
+        waiter.join()
+        hold.set()
+        holder.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.db.pool_status()["timeouts"], 1)
+        self.assertEqual(self.db.pool_status()["in_use"], 1)
+
+    def test_parallel_bulk(self):
+        table = self.db.get_table("foo")
+        records = ({"a": i, "b": str(i)} if i != 25 else {"a": i} for i in range(100))
+        r = table.bulk(records, batch_size=10, parallel=2)
+        self.assertEqual(r, 90)
+        self.assertEqual(r.batches, [10, 10, None] + [10] * 7)
+        self.assertEqual([(e.index, e.offset, e.size) for e in r.errors], [(2, 20, 10)])
+        self.assertIsInstance(r.errors[0].error, KeyError)
+        self.assertEqual(self.db.read_one("select count(*) as n from foo"), {"n": 90})
+        self.assertEqual(self.db.pool_status()["in_use"], 1)
+        db = connect(f"sqlite:///{self.path}")
+        r = db.get_table("foo").bulk([{"a": 1, "b": "1"}] * 100, batch_size=10, parallel=3)
+        self.assertEqual((r, r.batches), (100, [10] * 10))
+        self.assertEqual(db.read_one("select count(*) as n from foo"), {"n": 190})
+        db.close()
+        with connect(":memory:", driver="sqlite3") as db:
+            self.assertRaises(ParameterError, db.get_table("foo").bulk, [{"a": 1}], parallel=2)
+
+    def test_partitioned_find(self):
+        db = connect(self.path, driver="sqlite3", check_same_thread=False, pool_size=5)
+        table = db.get_table("foo")
+        table.bulk([{"a": i, "b": str(i % 2)} for i in range(100)] + [{"a": None, "b": "0"}])
+        rows = table.find(partition_by="a", partitions=4).get_all()
+        self.assertEqual(len(rows), 101)
+        self.assertEqual(sorted(r["a"] for r in rows if r["a"] is not None), list(range(100)))
+        rows = table.find({"b": "1"}, partition_by="a", partitions=4, ordered=True, batch_size=5).get_all()
+        self.assertEqual([r["a"] // 25 for r in rows], sorted(r["a"] // 25 for r in rows))
+        self.assertEqual(sorted(r["a"] for r in rows), list(range(1, 100, 2)))
+        rows = table.find("a >= 50", partition_by="a", partitions=3, bounds=(60, 70), fields=["a"]).get_all()
+        self.assertEqual(sorted(r["a"] for r in rows), list(range(50, 100)))
+        self.assertEqual(
+            table.find(partition_by="a", ordered=True).limit(3).get(5),
+            table.find(partition_by="a", ordered=True).get(3)
+        )
+        db.close()
+
+    def test_pre_ping(self):
+        db = connect(self.path, driver="sqlite3", check_same_thread=False, pool_size=1, pool_pre_ping=True)
+        db.driver.con.close()
+        db.release()
+        self.assertEqual(db.read_one("select count(*) as n from foo"), {"n": 0})
+        db.close()
+
+
+class TestAsync(unittest.TestCase):
+    record = {"a": 1, "b": "1"}
+
+    def test_database(self):
+        async def main():
+            async with await aio.connect(":memory:", driver="sqlite3") as db:
+                await db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+                r = await db.execute("insert into foo(a,b) values(:a,:b)", [self.record] * 10)
+                self.assertEqual(r.rowcount, 10)
+                self.assertEqual(await db.bulk("insert into foo(a,b) values(:a,:b)", [self.record] * 10, 3), 10)
+                self.assertEqual(await db.read_one("select count(*) as n from foo"), {"n": 20})
+                rows = [r async for r in db.read("select * from foo", batch_size=3).limit(5)]
+                self.assertEqual(rows, [self.record] * 5)
+                records = db.read("select * from foo", as_dict=False, batch_size=7)
+                self.assertEqual(await records.get(2), [(1, "1")] * 2)
+                self.assertEqual(len(await records.get_all()), 18)
+
+        asyncio.run(main())
+
+    def test_table(self):
+        async def main():
+            db = await aio.connect(":memory:", driver="sqlite3")
+            await db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+            table = db.get_table("foo")
+            self.assertEqual(await table.get_columns(), ["a", "b"])
+            self.assertEqual(await table.insert([self.record] * 10), 10)
+            self.assertEqual(await table.bulk([self.record] * 10, batch_size=3), 10)
+            self.assertEqual(await table.update({"a": 1}, {"a": 2}), 20)
+            self.assertEqual(await table.find_one({"a": 2}), {"a": 2, "b": "1"})
+            records = table.find({"a": 2}).map(lambda x: {**x, "c": 3})
+            self.assertEqual(await records.get_one(), {"a": 2, "b": "1", "c": 3})
+            self.assertEqual(await table.delete({"a": 2}), 20)
+            await db.close()
+
+        asyncio.run(main())
+
+    def test_pool(self):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+
+        async def main():
+            db = await aio.connect(path, driver="sqlite3", check_same_thread=False, pool_size=3)
+            await db.execute("CREATE TABLE foo (a integer, b varchar(20))", autocommit=True)
+            table = db.get_table("foo")
+            await table.bulk([self.record] * 30, batch_size=10)
+            streams = [table.find(batch_size=4) for _ in range(3)]
+            counts = await asyncio.gather(*[self._count(s) for s in streams])
+            self.assertEqual(counts, [30] * 3)
+            self.assertEqual(db.db.pool_status()["size"], 3)
+            await db.close()
+
+        try:
+            asyncio.run(main())
+        finally:
+            os.remove(path)
+
+    def test_nested_await(self):
+        async def main(db, batch_size):
+            await db.execute("CREATE TABLE foo (a integer, b varchar(20))")
+            await db.execute("CREATE TABLE bar (a integer)")
+            await db.get_table("foo").insert([self.record] * 10)
+            n = 0
+            async for r in db.read("select * from foo", batch_size=batch_size):
+                await db.execute("insert into bar(a) values(:a)", {"a": r["a"]})
+                self.assertEqual(await db.read_one("select count(*) as n from bar"), {"n": n + 1})
+                n += 1
+            self.assertEqual(n, 10)
+            await db.close()
+
+        async def run(url, batch_size, **kwargs):
+            db = await aio.connect(url, **kwargs)
+            await asyncio.wait_for(main(db, batch_size), 5)
+
+        # sqlite3驱动同一连接上的语句共用游标(与同步接口相同)，一次取完结果
+        asyncio.run(run(":memory:", 100, driver="sqlite3"))
+        asyncio.run(run("sqlite:///:memory:", 3))
+
+    @staticmethod
+    async def _count(records):
+        n = 0
+        async for _ in records:
+            n += 1
+            await asyncio.sleep(0)
+        return n
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.src = connect(":memory:", driver="sqlite3")
+        self.src.execute("CREATE TABLE foo (a integer, b varchar(20))")
+        self.src.get_table("foo").bulk([{"a": i, "b": str(i)} for i in range(100)])
+        self.dst = connect(":memory:", driver="sqlite3")
+        self.dst.execute("CREATE TABLE bar (a integer, c varchar(20))")
+        self.table = self.dst.get_table("bar")
+
+    def tearDown(self):
+        self.src.close()
+        self.dst.close()
+
+    def test_process_pool(self):
+        progress = []
+        records = self.src.read("select * from foo", batch_size=7).filter(is_even).map(double).rename({"b": "c"})
+        result = records.pipe_to(self.table, workers=2, batch_size=10, progress=progress.append)
+        self.assertEqual(result, 50)
+        self.assertEqual([p.rows_in for p in progress][-1], 100)
+        self.assertEqual((len(progress), progress[-1].rows_out), (10, 50))
+        self.assertEqual(self.dst.read("select a, c from bar").get(3), [{"a": 0, "c": "0"}, {"a": 4, "c": "2"},
+                                                                      {"a": 8, "c": "4"}])
+        records = self.src.read("select * from foo", compact=True).map(lambda r: {"a": r.a, "c": r.b})
+        self.assertRaises(ParameterError, records.pipe_to, self.table)
+
+    def test_thread_pool(self):
+        records = self.src.read("select * from foo", compact=True).limit(30).map(lambda r: {"a": r.a, "c": r.b})
+        result = records.filter(lambda r: r["a"] < 20).pipe_to(self.table, workers=3, batch_size=4, ordered=False,
+                                                               executor="thread")
+        self.assertEqual(result, 20)
+        self.assertEqual(sorted(r["a"] for r in self.dst.read("select a from bar")), list(range(20)))
+        result = self.src.get_table("foo").find("a >= 90").rename({"b": "c"}).pipe_to(self.table, workers=1)
+        self.assertEqual(result, 10)
+
+    def test_no_ops(self):
+        with mock.patch("pydbclib.pipeline.ProcessPoolExecutor") as pool:
+            result = self.src.read("select a, b as c from foo", batch_size=30).pipe_to(self.table, batch_size=40)
+            self.assertEqual(result, 100)
+            result = self.src.read("select a, b as c from foo", compact=True).pipe_to(self.table)
+            self.assertEqual(result, 100)
+        pool.assert_not_called()
+        self.assertEqual(self.dst.read_one("select count(*) as n from bar"), {"n": 200})
+
+
+class TestBulkLoader(unittest.TestCase):
+
+    def test_copy_format(self):
+        row = [None, "", 'a"b,c', 1, True, b"\x01", {"k": 1}]
+        self.assertEqual(
+            ",".join(CopyLoader.format_value(v) for v in row),
+            ',"","a""b,c","1","t","\\x01","{""k"": 1}"'
+        )
+        self.assertEqual(CopyLoader.format_array([1, None, 2]), "{1,NULL,2}")
+        self.assertEqual(CopyLoader.format_array([[1, 2], [3, 4]]), "{{1,2},{3,4}}")
+        self.assertEqual(
+            CopyLoader.format_array(["a b", "", "null", 'x"y', "c\\d", "{}", True, b"\x01"]),
+            '{"a b","","null","x\\"y","c\\\\d","{}",t,"\\\\x01"}'
+        )
+        self.assertEqual(CopyLoader.format_value(["a,b", 'x"y']), '"{""a,b"",""x\\""y""}"')
+
+    def test_multi_values_upsert(self):
+        class Cursor(object):
+            rowcount = 0
+            executed = []
+
+            def execute(self, sql, params):
+                self.executed.append(params)
+                self.rowcount = len(params) // 2
+
+        class Driver(object):
+            dialect = "postgresql"
+            paramstyle = "pyformat"
+
+            @contextmanager
+            def raw_cursor(self):
+                yield Cursor()
+
+        sql = "insert into foo (a,b) values (:a,:b) on conflict (a) do update set b=excluded.b"
+        loader = MultiValuesLoader(Driver(), sql, parse_insert(sql))
+        self.assertEqual(loader.load([{"a": 1, "b": 1}, {"a": 2, "b": 2}, {"a": 1, "b": 3}]), 2)
+        self.assertEqual(Cursor.executed, [[1, 3, 2, 2]])
+        for suffix in ("on conflict on constraint foo_pk do update set b=excluded.b",
+                       "on conflict (lower(a)) do update set b=excluded.b"):
+            sql = f"insert into foo (a,b) values (:a,:b) {suffix}"
+            self.assertFalse(MultiValuesLoader.supports(Driver(), parse_insert(sql)))
+        sql = "insert into foo (a,b) values (:a,:b) on conflict (a) do nothing"
+        self.assertTrue(MultiValuesLoader.supports(Driver(), parse_insert(sql)))
+
+    def test_multi_values_bytes(self):
+        with connect(":memory:", driver="sqlite3") as db:
+            db.execute("create table foo(a integer, b text)")
+            sql = "insert into foo (a,b) values (:a,:b)"
+            loader = get_bulk_loader(db.driver, sql, "multi_values")
+            rows = [(i, "x" * 1000) for i in range(100)]
+            self.assertEqual([len(c) for c in loader.chunks(rows)], [100])
+            loader.max_bytes = 10000
+            chunks = list(loader.chunks(rows))
+            self.assertGreater(len(chunks), 10)
+            self.assertTrue(all(sum(len(repr(r)) for r in c) < 10000 for c in chunks))
+            self.assertEqual([r for c in chunks for r in c], rows)
+            # 单行超过上限时单独写入
+            loader.max_bytes = 100
+            self.assertEqual([len(c) for c in loader.chunks(rows[:3])], [1, 1, 1])
+            self.assertEqual(loader.load(rows), 100)
+            self.assertEqual(db.read_one("select count(*) c from foo")["c"], 100)
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_split_range(self):
+        self.assertEqual(split_range(0, 100, 4), [25, 50, 75])
+        self.assertEqual(split_range(0, 2, 4), [1])
+        self.assertEqual(split_range(5, 5, 4), [])
+        self.assertEqual(split_range(0.0, 1.0, 2), [0.5])
+        self.assertEqual(split_range(datetime.date(2020, 1, 1), datetime.date(2020, 1, 5), 2), [datetime.date(2020, 1, 3)])
+        self.assertRaises(ParameterError, split_range, "a", "b", 2)
+        self.assertEqual(range_conditions("a", []), [("", {})])
+        self.assertEqual(range_conditions("a", [1, 2])[1], ("a >= :k0 and a < :k1", {"k0": 1, "k1": 2}))
+
+
+class TestCompiler(unittest.TestCase):
+
+    def setUp(self):
+        compiled_cache.clear()
+
+    def test_process(self):
+        sql = "insert into foo(a,b,c) values(:a, ':a', :b)"
+        self.assertEqual(
+            QmarkCompiler(sql, {"a": 1, "b": 2}).process_one(),
+            ("insert into foo(a,b,c) values(?, ':a', ?)", (1, 2))
+        )
+        self.assertEqual(
+            FormatCompiler(sql, [{"a": 1, "b": 2}]).process(),
+            ("insert into foo(a,b,c) values(%s, ':a', %s)", [(1, 2)])
+        )
+        self.assertEqual(
+            QmarkCompiler("select * from foo where a=:a or b=:a and c=:c", [(1, 2)]).process(),
+            ("select * from foo where a=? or b=? and c=?", [(1, 1, 2)])
+        )
+
+    def test_process_many(self):
+        self.assertEqual(
+            QmarkCompiler("delete from foo where a=:a", [{"a": 1}, {"a": 2}]).process(),
+            ("delete from foo where a=?", [(1,), (2,)])
+        )
+        rows = [(1, "1"), (2, "2")]
+        self.assertIs(QmarkCompiler("insert into foo(a,b) values(:a,:b)", rows).process()[1], rows)
+
+    def test_tokenize_placeholders(self):
+        sql = "select a::int, \"b:x\", 'it''s :q' from foo /* :c */ where a=:a -- :d\n and b=:b"
+        self.assertEqual(
+            tokenize_placeholders(sql, "%s"),
+            ("select a::int, \"b:x\", 'it''s :q' from foo /* :c */ where a=%s -- :d\n and b=%s", ["a", "b"])
+        )
+        self.assertEqual(tokenize_placeholders("select 1", "?"), ("select 1", []))
+        self.assertRaises(SQLFormatError, tokenize_placeholders, "select * from foo where a=?", "?")
+
+    def test_compiled_cache(self):
+        sql = "select * from foo where a=:a"
+        for i in range(3):
+            QmarkCompiler(sql, {"a": i}).process_one()
+        FormatCompiler(sql, {"a": 1}).process_one()
+        info = compiled_cache.cache_info()
+        self.assertEqual((info["hits"], info["misses"], info["size"]), (2, 2, 2))
+        maxsize = compiled_cache.maxsize
+        compiled_cache.maxsize = 1
+        try:
+            QmarkCompiler("select * from foo where b=:b", {"b": 1}).process_one()
+            self.assertEqual(compiled_cache.cache_info()["evictions"], 2)
+        finally:
+            compiled_cache.maxsize = maxsize
 
 
 if __name__ == '__main__':